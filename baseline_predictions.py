@@ -6,6 +6,7 @@ import glob
 import seaborn as sns
 from sklearn.neighbors import LocalOutlierFactor
 from helper import select_hosts
+import flow_store
 sns.set_style("darkgrid")
 
 
@@ -40,9 +41,9 @@ def create_aggregated_view(data, selected, flag, grouping='host'):
         else:
             aggregation_dict[feature] = 'mean'
     if grouping == 'host':
-        agg_data = data.groupby('src_ip').agg(aggregation_dict).reset_index()
+        agg_data = data.groupby('src_ip', observed=True).agg(aggregation_dict).reset_index()
     else:
-        agg_data = data.groupby(['src_ip', 'dst_ip']).agg(aggregation_dict).reset_index()
+        agg_data = data.groupby(['src_ip', 'dst_ip'], observed=True).agg(aggregation_dict).reset_index()
     return agg_data
 
 
@@ -122,10 +123,11 @@ if __name__ == '__main__':
     grouping = 'host'
 
     # Read the training set consisting only by benign data
+    columns = ['date', 'src_ip', 'dst_ip', 'label'] + selected
     if flag == 'CTU-bi':
-        train = pd.read_pickle(training_filepath + '/binetflow_normal.pkl')
+        train = flow_store.read_flows(training_filepath, 'binetflow_normal', columns=columns)
     else:
-        train = pd.read_pickle(training_filepath + '/normal.pkl')
+        train = flow_store.read_flows(training_filepath, 'normal', columns=columns)
 
     # select the major hosts as it is done in the other methods
     train_hosts = list(map(lambda item: item[0], select_hosts(train, 50).values.tolist()))
@@ -143,16 +145,16 @@ if __name__ == '__main__':
             continue
         print("=============== Evaluating on " + test_filepath.split('/')[-2] + " =============== ")
         if flag == 'CTU-bi':
-            normal = pd.read_pickle(test_filepath + 'binetflow_normal.pkl')
-            anomalous = pd.read_pickle(test_filepath + 'binetflow_anomalous.pkl')
+            normal = flow_store.read_flows(test_filepath, 'binetflow_normal', columns=columns)
+            anomalous = flow_store.read_flows(test_filepath, 'binetflow_anomalous', columns=columns)
         else:
-            normal = pd.read_pickle(test_filepath + 'normal.pkl')
+            normal = flow_store.read_flows(test_filepath, 'normal', columns=columns)
             # only of the CICIDS dataset
             if 'Monday' not in test_filepath:
-                anomalous = pd.read_pickle(test_filepath + 'anomalous.pkl')
+                anomalous = flow_store.read_flows(test_filepath, 'anomalous', columns=columns)
         # only of the CICIDS dataset
         if 'Monday' not in test_filepath:
-            all_data = pd.concat([normal, anomalous], ignore_index=True).sort_values(by='date').reset_index(drop=True)
+            all_data = flow_store.concat_flows([normal, anomalous]).sort_values(by='date').reset_index(drop=True)
         else:
             all_data = normal
 
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+import os
+import sys
+import shutil
+import json
+import pickle
+import time
+import helper
+import flow_store
+from multiprocessing import Pool
+
+# the default values of the batch configuration (any of them can be overridden in the configuration file)
+DEFAULT_CONFIG = {
+    # the type of dataset to be used (CTU-bi | CICIDS | UNSW)
+    'flag': 'CTU-bi',
+    # the relative path of the dataset to be used and the stage for which the traces are extracted (training | test)
+    'dataset_filepath': None,
+    'stage': 'test',
+    # the features to be used in the multivariate modelling
+    'selected': ['src_port', 'dst_port', 'protocol_num', 'src_bytes', 'dst_bytes'],
+    # the type of modelling to be conducted (connection level: 0 | host level: 1)
+    'host_level': 1,
+    # the type of window to use (0: non-timed | 1: static-timed | 2: dynamic-timed)
+    'window': 2,
+    # the number of flows of each non-timed window and their stride (in number of flows)
+    'flow_window': 100,
+    'flow_stride': 20,
+    # new features to be added (no: 0 | yes: 1)
+    'new_features': 0,
+    # aggregation windows to be used (no: 0 | yes-rolling: 1 | yes-resample: 2)
+    'aggregation': 0,
+    # flag for computing the rolling aggregation windows once for all the flows and sharing them between the traces
+    # (faster, but the first records of each trace are aggregated also with the flows preceding the trace)
+    'shared_rolling': False,
+    # the filepath of the discretization limits (if discretization is to be applied)
+    'discretization_filepath': None,
+    # flag for modifications in trace extraction for state-of-the-art experiments
+    'sota': True,
+    # flag for selecting only network entities with a sufficient number of flows, and the minimum number of flows
+    'select_major': True,
+    'threshold': 50,
+    'bidirectional': False,
+    # flag for selecting the network entities in a streaming pass with a bounded-memory sketch of the given capacity
+    # (only the flows of the selected entities are read afterwards)
+    'streaming_selection': False,
+    'sketch_capacity': 100000,
+    # the maximum number of flows per entity used for the trace extraction (None for no budget), and the number of time
+    # strata over which the budget is allocated
+    'flow_budget': 20000,
+    'budget_strata': 10,
+    # the number of worker processes (all the available cores if not given), among which the entities are distributed
+    # (the high-level windows of each entity are then processed in order by its worker)
+    'processes': None
+}
+
+# the location and the index of the column export of the flows shared with the worker processes
+_export = None
+
+
+def read_config(config_filepath):
+    """
+    Function for reading the JSON configuration of a batch extraction and completing it with the default values.
+    :param config_filepath: the filepath of the configuration file
+    :return: the configuration dictionary
+    """
+    with open(config_filepath, 'r') as f:
+        config = json.load(f)
+    unknown = set(config.keys()) - set(DEFAULT_CONFIG.keys())
+    if unknown:
+        raise ValueError('Unknown configuration keys: ' + ', '.join(sorted(unknown)))
+    config = dict(DEFAULT_CONFIG, **config)
+    if config['flag'] not in ['CTU-bi', 'CICIDS', 'UNSW']:
+        raise ValueError('Unknown dataset flag: ' + str(config['flag']))
+    if config['stage'] not in ['training', 'test']:
+        raise ValueError('Unknown stage: ' + str(config['stage']))
+    if config['dataset_filepath'] is None:
+        raise ValueError('The dataset_filepath of the flows has to be given')
+    if not 0 < config['flow_stride'] <= config['flow_window']:
+        raise ValueError('The stride of the non-timed windows has to be positive and at most equal to their length')
+    if config['streaming_selection'] and (config['bidirectional'] or not config['select_major']):
+        raise ValueError('Streaming selection is only supported for unidirectional selection of major entities')
+    return config
+
+
+def flow_names(config):
+    """
+    Function for finding the names of the stored flows needed for the trace extraction of the given stage. For training
+    only the normal flows are used, while for testing both the normal and the anomalous ones.
+    :param config: the configuration dictionary
+    :return: the list with the names of the stored flows
+    """
+    if config['flag'] == 'CTU-bi':
+        names = ['binetflow_normal' if not config['sota'] else 'binetflow_normal_sota', 'binetflow_anomalous']
+    else:
+        names = ['normal', 'anomalous']
+    return names[:1] if config['stage'] == 'training' else names
+
+
+def load_flows(config, hosts=None, connections=None):
+    """
+    Function for reading from the flow store the flows needed for the trace extraction of the given stage.
+    :param config: the configuration dictionary
+    :param hosts: a list of source IPs whose flows should be read (None for all of them)
+    :param connections: a list of (source IP, destination IP) pairs whose flows should be read (None for all of them)
+    :return: the dataframe with the flows
+    """
+    columns = ['date', 'src_ip', 'dst_ip'] + config['selected']
+    return flow_store.concat_flows([flow_store.read_flows(config['dataset_filepath'], name, columns=columns,
+                                                          hosts=hosts, connections=connections)
+                                    for name in flow_names(config)])
+
+
+def stream_instances(config):
+    """
+    Function for selecting the network entities with a sufficient number of flows in a streaming pass over the stored
+    flows, and for reading only the flows of the selected entities.
+    :param config: the configuration dictionary
+    :return: the list of the selected entities and the dataframe with their flows
+    """
+    read_chunks = lambda: (chunk for name in flow_names(config)
+                           for chunk in flow_store.iter_flows(config['dataset_filepath'], name,
+                                                              columns=['src_ip', 'dst_ip']))
+    if config['host_level']:
+        instances = helper.stream_select_hosts(read_chunks, config['threshold'], capacity=config['sketch_capacity'])
+        instances = instances['src_ip'].tolist()
+        return instances, load_flows(config, hosts=instances)
+    instances = helper.stream_select_connections(read_chunks, config['threshold'], capacity=config['sketch_capacity'])
+    instances = list(zip(instances['src_ip'], instances['dst_ip']))
+    return instances, load_flows(config, connections=instances)
+
+
+def select_instances(data, config):
+    """
+    Function for selecting the network entities for which traces are extracted.
+    :param data: the dataframe with the flows
+    :param config: the configuration dictionary
+    :return: the list of the selected entities (host ips or (src_ip, dst_ip) tuples) and the flows of these entities
+    """
+    if config['host_level']:
+        if config['select_major']:
+            instances, data = helper.select_hosts(data, config['threshold'], bidirectional=config['bidirectional'],
+                                                  return_data=True)
+            instances = [instance[0] for instance in instances.values.tolist()]
+        else:
+            instances = data['src_ip'].unique().tolist()
+    else:
+        if config['select_major']:
+            instances, data = helper.select_connections(data, config['threshold'],
+                                                        bidirectional=config['bidirectional'], return_data=True)
+        else:
+            instances = data.groupby(['src_ip', 'dst_ip'], observed=True).size().reset_index()
+        instances = [(instance[0], instance[1]) for instance in instances.values.tolist()]
+    return instances, data
+
+
+def init_worker(directory, name, level, meta):
+    """
+    Function for initializing each worker process with the column export of the flows. The workers open the flows of
+    each entity from the memory-mapped column files, so that they share the same pages instead of each holding a copy
+    of the flows.
+    :param directory: the directory of the export
+    :param name: the name of the export
+    :param level: the level of the entities indexed in the export (host | connection)
+    :param meta: the index of the export
+    :return: sets the module-level variable used by the workers
+    """
+    global _export
+    _export = (directory, name, level, meta)
+
+
+def extract_instance(task):
+    """
+    Function for extracting the traces of a single network entity in a worker process. The output of the extraction is
+    redirected to a log file next to the traces' file so that the output of the workers is not interleaved.
+    :param task: a tuple with the entity, its name, the filepath of its traces, the flow budget and the number of time
+    strata, and the keyword arguments of the extract_traces function (apart from the data and the filepath)
+    :return: the name of the entity, its number of flows, the traces' filepath, and the time of the extraction
+    """
+    instance, instance_name, traces_filepath, flow_budget, num_strata, kwargs = task
+    start = time.perf_counter()
+    directory, name, level, meta = _export
+    instance_data = flow_store.open_columns(directory, name, entity=instance, level=level, meta=meta, as_frame=True)
+    # if the number of flows is excessive then sample from these flows to a feasible extent
+    instance_data, kept = helper.budget_flows(instance_data, flow_budget, num_strata)
+    # create the directory if it does not exist
+    os.makedirs(os.path.dirname(traces_filepath), exist_ok=True)
+    stdout = sys.stdout
+    with open('.'.join(traces_filepath.split('.')[:-1]) + '.log', 'w') as log:
+        sys.stdout = log
+        try:
+            helper.extract_traces(instance_data, traces_filepath, **kwargs)
+        finally:
+            sys.stdout = stdout
+    helper.store_kept_flows(traces_filepath, kept)
+    return instance_name, instance_data.shape[0], traces_filepath, time.perf_counter() - start
+
+
+def run_batch(config):
+    """
+    Function for extracting the traces of all the selected network entities of a dataset in parallel, according to the
+    given configuration. The output files are the same as the ones of the interactive extraction.
+    :param config: the configuration dictionary
+    :return: a list with the name, the number of flows, the traces' filepath, and the extraction time of each entity
+    """
+    selected = list(config['selected'])
+    alphabet_size = -1
+    if config['streaming_selection']:
+        instances, data = stream_instances(config)
+    else:
+        data = load_flows(config)
+
+    if config['discretization_filepath'] is not None:
+        # apply the stored discretization limits to the appropriate features
+        with open(config['discretization_filepath'], 'rb') as f:
+            discretization_dict = pickle.load(f)
+        selected, alphabet_size = helper.discretize_flows(data, selected, discretization_dict)
+
+    host_level = bool(config['host_level'])
+    analysis_type = 'host_level' if host_level else 'connection_level'
+    if not config['streaming_selection']:
+        instances, data = select_instances(data, config)
+    print('Number of ' + ('hosts' if host_level else 'connections') + ' to be processed: ' + str(len(instances)))
+    # the flows needed for the extraction are exported once as memory-mapped columns, in which the date-sorted flows of
+    # each instance are contiguous, and the dataframe is released before the workers are started
+    level = 'host' if host_level else 'connection'
+    export_name = 'batch_' + config['stage']
+    meta = flow_store.write_columns(data[list(dict.fromkeys(['date', 'src_ip', 'dst_ip'] + selected))],
+                                    config['dataset_filepath'], export_name, level)
+    del data
+
+    # the windowing and aggregation settings are the same for all the entities
+    timed, dynamic, timed_name = helper.window_settings(config['window'])
+    resample = config['aggregation'] == 2
+    aggregation = bool(config['aggregation'])
+    features = helper.aggregation_features(selected, host_level, resample) if aggregation else selected
+    kwargs = {'selected': features, 'alphabet_size': alphabet_size, 'timed': timed, 'dynamic': dynamic,
+              'aggregation': aggregation, 'resample': resample, 'new_features': bool(config['new_features']),
+              'shared_rolling': bool(config['shared_rolling']), 'flow_window': config['flow_window'],
+              'flow_stride': config['flow_stride']}
+
+    tasks = []
+    for instance in instances:
+        instance_name = instance if host_level else instance[0] + '-' + instance[1]
+        traces_filepath = helper.build_traces_filepath(config['dataset_filepath'], config['stage'], analysis_type,
+                                                       selected, instance_name, aggregation=aggregation,
+                                                       resample=resample, new_features=config['new_features'],
+                                                       bidirectional=config['bidirectional'], timed_name=timed_name)
+        tasks += [(instance, instance_name, traces_filepath, config['flow_budget'], config['budget_strata'], kwargs)]
+    # the entities with the most flows are scheduled first so that no long extraction is left for the end
+    tasks.sort(key=lambda task: meta['index'].get(task[0], (0, 0))[1], reverse=True)
+
+    timings = []
+    start = time.perf_counter()
+    try:
+        with Pool(config['processes'], initializer=init_worker,
+                  initargs=(config['dataset_filepath'], export_name, level, meta)) as pool:
+            for i, result in enumerate(pool.imap_unordered(extract_instance, tasks)):
+                timings += [result]
+                print('[' + str(i + 1) + '/' + str(len(tasks)) + '] ' + result[0] + ': ' + str(result[1]) +
+                      ' flows in ' + '{:.2f}'.format(result[3]) + 's')
+    finally:
+        # the export is only needed during the extraction
+        shutil.rmtree(flow_store.columns_path(config['dataset_filepath'], export_name, level))
+    total = time.perf_counter() - start
+    print('Extracted the traces of ' + str(len(tasks)) + ' entities in ' + '{:.2f}'.format(total) + 's (' +
+          '{:.2f}'.format(sum(timing[3] for timing in timings)) + 's of extraction time)')
+    return timings
+
+
+if __name__ == '__main__':
+    # the configuration file can be given either as an argument or interactively
+    if len(sys.argv) > 1:
+        config_filepath = sys.argv[1]
+    else:
+        config_filepath = input('Give the path to the JSON configuration file of the batch extraction: ')
+    config = read_config(config_filepath)
+    timings = run_batch(config)
+    # store the timings of the extraction next to the configuration file
+    timings_filepath = '.'.join(config_filepath.split('.')[:-1]) + '_timings.pkl'
+    with open(timings_filepath, 'wb') as f:
+        pickle.dump(timings, f)
+    print('Timings stored in ' + timings_filepath)
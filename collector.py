@@ -0,0 +1,365 @@
+#!/usr/bin/python
+
+import asyncio
+import io
+import socket
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from dataset_specs import DATASET_SPECS
+from initial_preprocessing import count_fields, parse_dates, preprocess_data
+
+
+def read_records(lines, spec):
+    """
+    Helper function for parsing record lines with the parsing options of a dataset
+    :param lines: the list of record lines
+    :param spec: the spec of the dataset (see dataset_specs)
+    :return: the dataframe with the parsed records
+    """
+    data = pd.read_csv(io.StringIO('\n'.join(lines)), delimiter=spec['delimiter'], header=None, names=spec['names'],
+                       usecols=spec['usecols'], dtype=spec['dtype'], na_values=spec['na_values'],
+                       on_bad_lines='skip', engine='c')
+    for field in spec['date_fields']:
+        data[field] = parse_dates(data[field], spec['date_formats'], spec['date_unit'])
+    return data
+
+
+def parse_records(lines, flag):
+    """
+    Function for parsing a micro-batch of flow records. Each record is a line in the format of the input files of the
+    dataset (for the unidirectional netflows of CTU-13 the format of the preprocessed files). As in the quarantine of
+    the input files, records with a different number of fields than the ones of the dataset (up to its last used
+    column) are malformed. If the rest of the records cannot be parsed together (e.g. due to a value of the wrong type)
+    then they are parsed one by one, so that only the malformed ones are skipped
+    :param lines: the list of record lines
+    :param flag: flag showing the origin of the records (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :return: the dataframe with the parsed records (None if there are none) and the number of malformed records that
+    were skipped
+    """
+    spec = DATASET_SPECS[flag]
+    num_of_fields = max(spec['usecols']) + 1
+    well_formed = [line for line in lines if count_fields(line, spec['delimiter']) == num_of_fields]
+    try:
+        parsed = [read_records(well_formed, spec)] if len(well_formed) else []
+    except ValueError:
+        parsed = []
+        for line in well_formed:
+            try:
+                parsed += [read_records([line], spec)]
+            except ValueError:
+                continue
+    data = pd.concat(parsed, ignore_index=True) if len(parsed) else None
+    return data, len(lines) - (data.shape[0] if data is not None else 0)
+
+
+class FlowCollector:
+    def __init__(self, flag, buffer_size=10000, queue_size=100000, batch_size=5000, sota=True, categories=None,
+                 on_batch=None):
+        """
+        Init function for the FlowCollector class used for receiving flow records in real time. Received record lines
+        are put in a bounded queue, from which they are taken in micro-batches, normalized, and appended to bounded
+        buffers per host (the oldest flows of a host are discarded when its buffer is full). When the queue is full the
+        TCP and file sources wait (backpressure), while the UDP source drops the records since it cannot be paused
+        :param flag: flag showing the origin of the records (CTU-uni | CTU-bi | CICIDS | UNSW)
+        :param buffer_size: the maximum number of flows kept for each host
+        :param queue_size: the maximum number of record lines waiting to be normalized
+        :param batch_size: the maximum number of record lines normalized at once
+        :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+        :param categories: dictionary with the categories of the categorical features (see preprocess_data)
+        :param on_batch: optional function called with each normalized micro-batch (e.g. for running the detectors),
+        from the worker thread that processes the batches
+        """
+        self.flag = flag
+        self.encoding = DATASET_SPECS[flag]['encoding']
+        self.batch_size = batch_size
+        self.sota = sota
+        self.categories = categories if categories is not None else {}
+        self.on_batch = on_batch
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.buffers = defaultdict(lambda: deque(maxlen=buffer_size))
+        self.host_counts = pd.Series(dtype='int64')
+        self.counters = {'received': 0, 'dropped': 0, 'malformed': 0, 'normalized': 0, 'max_queue_depth': 0}
+        self.rate = 0.0
+
+    async def put_line(self, line):
+        """
+        Function for adding a record line to the queue, waiting while the queue is full
+        :param line: the record line
+        :return: the line is added to the queue
+        """
+        await self.queue.put(line)
+        self.counters['received'] += 1
+
+    def put_line_nowait(self, line):
+        """
+        Function for adding a record line to the queue without waiting. The line is dropped if the queue is full
+        :param line: the record line
+        :return: the line is added to the queue (or counted as dropped)
+        """
+        try:
+            self.queue.put_nowait(line)
+            self.counters['received'] += 1
+        except asyncio.QueueFull:
+            self.counters['dropped'] += 1
+
+    async def serve_udp(self, host='127.0.0.1', port=9995):
+        """
+        Function for receiving record lines as UDP datagrams (each datagram may contain multiple lines)
+        :param host: the address to listen on
+        :param port: the port to listen on
+        :return: the datagram transport
+        """
+        collector = self
+
+        class RecordProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                for line in data.decode(collector.encoding).splitlines():
+                    if line:
+                        collector.put_line_nowait(line)
+
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(RecordProtocol,
+                                                                                 local_addr=(host, port))
+        print('Listening for UDP records on ' + host + ':' + str(port) + '...')
+        return transport
+
+    async def serve_tcp(self, host='127.0.0.1', port=9995):
+        """
+        Function for receiving record lines over TCP connections (one record per line)
+        :param host: the address to listen on
+        :param port: the port to listen on
+        :return: the TCP server
+        """
+        async def handle(reader, writer):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode(self.encoding).rstrip('\r\n')
+                if line:
+                    # the connection is not read further while the queue is full
+                    await self.put_line(line)
+            writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        print('Listening for TCP records on ' + host + ':' + str(port) + '...')
+        return server
+
+    async def tail_file(self, filepath, from_start=False, poll_interval=0.5):
+        """
+        Function for reading the record lines appended to a growing file
+        :param filepath: the path of the file
+        :param from_start: flag showing if the lines already in the file should be read as well
+        :param poll_interval: the seconds to wait before checking for new lines when the end of the file is reached
+        :return: runs until cancelled
+        """
+        with open(filepath, 'r', encoding=self.encoding) as f:
+            if not from_start:
+                f.seek(0, 2)
+            partial = ''
+            while True:
+                line = f.readline()
+                if not line:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                # incomplete lines are kept until the rest of them is written
+                if not line.endswith('\n'):
+                    partial += line
+                    continue
+                line = (partial + line).rstrip('\r\n')
+                partial = ''
+                if line:
+                    await self.put_line(line)
+
+    def process_batch(self, lines):
+        """
+        Function for normalizing a micro-batch of record lines and appending the flows to the buffers of their hosts
+        :param lines: the list of record lines
+        :return: the dataframe with the normalized flows (None if all the records were malformed)
+        """
+        data, malformed = parse_records(lines, self.flag)
+        if data is None:
+            self.counters['malformed'] += malformed
+            return None
+        # the host filtering considers all the flows received so far
+        host_counts = self.host_counts.add(data['src_ip'].value_counts(), fill_value=0).astype('int64')
+        data = preprocess_data(data, self.flag, self.categories, sota=self.sota, host_counts=host_counts)
+        self.host_counts = host_counts
+        self.counters['malformed'] += malformed
+        self.counters['normalized'] += data.shape[0]
+        for ip, flows in data.groupby('src_ip', sort=False):
+            self.buffers[ip].extend(flows.to_dict('records'))
+        if self.on_batch is not None:
+            self.on_batch(data)
+        return data
+
+    async def consume(self):
+        """
+        Function for taking the record lines from the queue in micro-batches (the lines already waiting in the queue are
+        taken together, up to the batch size) and processing them
+        :return: runs until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        # a single worker keeps the batches in the order they were received
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                lines = [await self.queue.get()]
+                while len(lines) < self.batch_size and not self.queue.empty():
+                    lines.append(self.queue.get_nowait())
+                self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'],
+                                                       self.queue.qsize() + len(lines))
+                # the batch is processed in a worker thread so that the sources keep receiving records in the meantime
+                try:
+                    await loop.run_in_executor(executor, self.process_batch, lines)
+                except Exception as e:
+                    # a batch that cannot be normalized is counted as malformed instead of stopping the collector
+                    print('Skipping a batch of ' + str(len(lines)) + ' records that could not be normalized: ' + str(e))
+                    self.counters['malformed'] += len(lines)
+        finally:
+            executor.shutdown(wait=False)
+
+    async def report(self, interval=5):
+        """
+        Function for periodically computing and printing the number of records per second and the queue depth
+        :param interval: the seconds between reports
+        :return: runs until cancelled
+        """
+        last_count, last_time = self.counters['normalized'], time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self.rate = (self.counters['normalized'] - last_count) / (now - last_time)
+            last_count, last_time = self.counters['normalized'], now
+            print(str(round(self.rate, 1)) + ' records/sec | queue depth: ' + str(self.queue.qsize()) + ' | hosts: ' +
+                  str(len(self.buffers)) + ' | dropped: ' + str(self.counters['dropped']) + ' | malformed: ' +
+                  str(self.counters['malformed']))
+
+    def stats(self):
+        """
+        Function returning the counters of the collector
+        :return: a dictionary with the counters, the current queue depth, and the last measured records per second
+        """
+        return dict(self.counters, queue_depth=self.queue.qsize(), records_per_sec=self.rate, hosts=len(self.buffers))
+
+    def host_flows(self, ip):
+        """
+        Function returning the buffered flows of a host
+        :param ip: the IP of the host
+        :return: the dataframe with the buffered flows of the host sorted by date
+        """
+        if ip not in self.buffers:
+            return pd.DataFrame()
+        return pd.DataFrame(list(self.buffers[ip])).sort_values(by='date', kind='mergesort').reset_index(drop=True)
+
+    async def run(self, source='udp', host='127.0.0.1', port=9995, filepath=None, report_interval=5):
+        """
+        Function for running the collector with the given source until cancelled
+        :param source: the source of the records (udp | tcp | file)
+        :param host: the address to listen on (for the udp and tcp sources)
+        :param port: the port to listen on (for the udp and tcp sources)
+        :param filepath: the path of the file to be tailed (for the file source)
+        :param report_interval: the seconds between the reports of the counters
+        :return: runs until cancelled
+        """
+        tasks = [asyncio.create_task(self.consume()), asyncio.create_task(self.report(report_interval))]
+        server = None
+        if source == 'udp':
+            server = await self.serve_udp(host, port)
+        elif source == 'tcp':
+            server = await self.serve_tcp(host, port)
+        else:
+            tasks += [asyncio.create_task(self.tail_file(filepath))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if server is not None:
+                server.close()
+
+
+def generate_records(filepath, destination='udp', host='127.0.0.1', port=9995, rate=1000, skiprows=1,
+                     lines_per_datagram=10, encoding='utf_8'):
+    """
+    Test generator replaying the records of a finished file to a collector at a fixed rate
+    :param filepath: the path of the file with the records (in the format of the input files of the dataset)
+    :param destination: where the records are sent (udp | tcp | the path of a file to which they are appended)
+    :param host: the address of the collector (for the udp and tcp destinations)
+    :param port: the port of the collector (for the udp and tcp destinations)
+    :param rate: the number of records sent per second (None for no limit)
+    :param skiprows: the number of header lines of the file to be skipped
+    :param lines_per_datagram: the number of records sent in each UDP datagram
+    :param encoding: the encoding of the file
+    :return: the number of records sent
+    """
+    if destination == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((host, port))
+    elif destination == 'tcp':
+        sock = socket.create_connection((host, port))
+    else:
+        sock = open(destination, 'a', encoding=encoding)
+    sent = 0
+    batch = []
+    start = time.monotonic()
+    with open(filepath, 'r', encoding=encoding) as f:
+        for i, line in enumerate(f):
+            if i < skiprows:
+                continue
+            batch.append(line.rstrip('\r\n'))
+            if len(batch) < lines_per_datagram:
+                continue
+            sent += send_batch(sock, destination, batch, encoding)
+            batch = []
+            # wait so that the requested rate is not exceeded
+            if rate is not None:
+                time.sleep(max(0.0, sent / rate - (time.monotonic() - start)))
+    sent += send_batch(sock, destination, batch, encoding)
+    sock.close()
+    return sent
+
+
+def send_batch(sock, destination, batch, encoding):
+    """
+    Helper function of the generator for sending a batch of record lines
+    :param sock: the socket (or file) that the lines are written to
+    :param destination: the destination of the records (udp | tcp | the path of a file)
+    :param batch: the list of record lines
+    :param encoding: the encoding of the lines
+    :return: the number of lines sent
+    """
+    if not len(batch):
+        return 0
+    payload = '\n'.join(batch) + '\n'
+    if destination in ['udp', 'tcp']:
+        sock.sendall(payload.encode(encoding))
+    else:
+        sock.write(payload)
+        sock.flush()
+    return len(batch)
+
+
+if __name__ == '__main__':
+    # the collector receives the records while the generator replays the records of a file to a running collector
+    mode = input("Enter the desired mode (collect | generate): ")
+    while True:
+        flag = input("Enter the desired flag (CTU-uni | CTU-bi | CICIDS | UNSW): ")
+        if flag in DATASET_SPECS:
+            break
+    source = input("Enter the source of the records (udp | tcp | file): ")
+    filepath = None
+    if source == 'file':
+        filepath = input("Enter the path of the file to be tailed: ")
+    if mode == 'collect':
+        try:
+            asyncio.run(FlowCollector(flag).run(source=source, filepath=filepath))
+        except KeyboardInterrupt:
+            print('Collector stopped!!!')
+    else:
+        records_filepath = input("Enter the path of the file with the records to be replayed: ")
+        rate = input("Enter the number of records per second (for no limit give no answer): ")
+        sent = generate_records(records_filepath, destination=filepath if source == 'file' else source,
+                                rate=int(rate) if rate else None, encoding=DATASET_SPECS[flag]['encoding'])
+        print(str(sent) + ' records have been sent!!!')
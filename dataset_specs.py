@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+import socket
+
+# the names of the IP protocols according to their numbers (for datasets storing only the protocol number)
+IP_PROTOCOL_NAMES = {num: name[8:] for name, num in vars(socket).items() if name.startswith("IPPROTO")}
+
+# The declarative specification of each supported dataset, executed by the reading and preprocessing functions of the
+# initial_preprocessing module. Each spec contains:
+#   - names, usecols, dtype: the names, the positions, and the parsing types of the columns read from the raw files
+#   - delimiter, skiprows, header_marker, na_values, encoding: the parsing options of the raw files (the files whose
+#     name contains the header_marker have a header line that needs to be skipped)
+#   - date_fields, date_formats, date_unit: the date columns and their candidate formats (or their unit for epochs)
+#   - output_depth: the number of path components of the directory where the preprocessed flows are stored
+#   - shared_protocols: flag showing if the protocol categories are shared between all the files of the dataset
+#   - host_network: the (prefix, minimum number of flows) of the hosts kept in the state-of-the-art experiments
+#   - background: the label pattern of the flows dropped when not running the state-of-the-art experiments
+#   - dropna: flag showing if the rows with missing values are dropped
+#   - fillna: the values used for filling the missing values of each column
+#   - hex_ports: the columns that may contain hexadecimal port values
+#   - types: the types of the columns after preprocessing
+#   - derived: the columns computed as expressions of other columns
+#   - category_codes: the categorical columns encoded as numerical codes in a <column>_num column, given either a fixed
+#     list of categories or None for categories learned in the order of their first appearance
+#   - category_names: the columns holding numerical codes that are kept in a <column>_num column and replaced by their
+#     names according to the given table
+#   - splits: the label rules used for splitting the flows (each rule has a name, that may contain the {stem} of the
+#     input file, one of the equals | differs | contains | excludes conditions on the label, and optionally the value of
+#     the sota flag for which it applies)
+DATASET_SPECS = {
+    # Unidirectional Netflow data from CTU-13 dataset
+    'CTU-uni': {
+        'names': ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'flags', 'packets',
+                  'bytes', 'label'],
+        'usecols': [_ for _ in range(0, 8)] + [9, 10, 12],
+        'dtype': {'date': str, 'duration': 'float64', 'protocol': str, 'src_ip': str, 'src_port': str, 'dst_ip': str,
+                  'dst_port': str, 'flags': str, 'packets': 'int64', 'bytes': 'int64', 'label': str},
+        'delimiter': ',',
+        'skiprows': 1,
+        'header_marker': None,
+        'na_values': [],
+        'encoding': 'utf_8',
+        'date_fields': ['date'],
+        'date_formats': ['%Y-%m-%d %H:%M:%S.%f'],
+        'date_unit': None,
+        'output_depth': 3,
+        'shared_protocols': False,
+        'host_network': None,
+        'background': None,
+        'dropna': False,
+        'fillna': {'src_port': '-1', 'dst_port': '-1'},
+        'hex_ports': [],
+        'types': {'packets': 'int64', 'bytes': 'int64', 'duration': 'float64', 'src_port': 'int64',
+                  'dst_port': 'int64'},
+        'derived': {},
+        'category_codes': {'protocol': None, 'flags': None},
+        'category_names': {},
+        'splits': [{'name': 'netflow_anomalous', 'equals': 'Botnet'},
+                   {'name': 'netflow_normal', 'equals': 'LEGITIMATE'},
+                   {'name': 'netflow_background', 'equals': 'Background'}]
+    },
+    # Bidirectional Netflow data from CTU-13 dataset
+    'CTU-bi': {
+        'names': ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'direction', 'dst_ip', 'dst_port', 'state',
+                  'packets', 'bytes', 'src_bytes', 'label'],
+        'usecols': [_ for _ in range(0, 9)] + [_ for _ in range(11, 15)],
+        'dtype': {'date': str, 'duration': 'float64', 'protocol': str, 'src_ip': str, 'src_port': str,
+                  'direction': str, 'dst_ip': str, 'dst_port': str, 'state': str, 'packets': 'int64',
+                  'bytes': 'int64', 'src_bytes': 'int64', 'label': str},
+        'delimiter': ',',
+        'skiprows': 1,
+        'header_marker': None,
+        'na_values': [],
+        'encoding': 'utf_8',
+        'date_fields': ['date'],
+        'date_formats': ['%Y/%m/%d %H:%M:%S.%f'],
+        'date_unit': None,
+        'output_depth': 3,
+        'shared_protocols': False,
+        # only hosts from the host network with more than 150 flows in total are kept
+        'host_network': ('147.32.8', 150),
+        'background': 'Background',
+        'dropna': False,
+        'fillna': {'state': 'missing', 'src_port': '-1', 'dst_port': '-1'},
+        'hex_ports': ['src_port', 'dst_port'],
+        'types': {'packets': 'int64', 'bytes': 'int64', 'src_bytes': 'int64', 'duration': 'float64',
+                  'src_port': 'int64', 'dst_port': 'int64'},
+        'derived': {'dst_bytes': 'bytes - src_bytes'},
+        'category_codes': {'protocol': ['udp', 'tcp', 'icmp', 'arp', 'igmp', 'rtp', 'pim', 'rtcp', 'udt', 'ipv6']},
+        'category_names': {},
+        'splits': [{'name': 'binetflow_anomalous', 'contains': 'From-Botnet'},
+                   {'name': 'binetflow_normal', 'contains': 'From-Normal', 'sota': False},
+                   {'name': 'binetflow_normal_sota', 'excludes': 'Botnet', 'sota': True}]
+    },
+    # Netflow data from UNSW-NB15 dataset
+    'UNSW': {
+        'names': ['src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol', 'state', 'duration', 'src_bytes',
+                  'dst_bytes', 'missed_src_bytes', 'missed_dst_bytes', 'service', 'src_packets', 'dst_packets', 'date',
+                  'end_date', 'detailed_label', 'label'],
+        'usecols': [_ for _ in range(0, 9)] + [_ for _ in range(11, 14)] + [16, 17, 28, 29, 47, 48],
+        'dtype': {'src_ip': str, 'src_port': str, 'dst_ip': str, 'dst_port': str, 'protocol': str, 'state': str,
+                  'duration': 'float64', 'src_bytes': 'int64', 'dst_bytes': 'int64', 'missed_src_bytes': 'int64',
+                  'missed_dst_bytes': 'int64', 'service': str, 'src_packets': 'int64', 'dst_packets': 'int64',
+                  'date': 'int64', 'end_date': 'int64', 'detailed_label': str, 'label': 'int64'},
+        'delimiter': ',',
+        'skiprows': [],
+        # special handling for the first dataset of the UNSW datasets
+        'header_marker': '1',
+        'na_values': ['-'],
+        'encoding': 'utf_8',
+        'date_fields': ['date', 'end_date'],
+        'date_formats': [],
+        'date_unit': 's',
+        'output_depth': 2,
+        'shared_protocols': True,
+        'host_network': None,
+        'background': None,
+        'dropna': False,
+        'fillna': {'detailed_label': 'missing', 'service': 'missing', 'src_port': '-1', 'dst_port': '-1'},
+        'hex_ports': ['src_port', 'dst_port'],
+        'types': {'src_port': 'int64', 'dst_port': 'int64', 'src_bytes': 'int64', 'dst_bytes': 'int64',
+                  'missed_src_bytes': 'int64', 'missed_dst_bytes': 'int64', 'src_packets': 'int64',
+                  'dst_packets': 'int64', 'duration': 'float64'},
+        'derived': {},
+        'category_codes': {'protocol': None},
+        'category_names': {},
+        'splits': [{'name': '{stem}_anomalous', 'equals': 1},
+                   {'name': '{stem}_normal', 'equals': 0}]
+    },
+    # Netflow data from CICIDS2017 dataset (the features 'total length of forward packets' and 'total length of
+    # backward packets' have been considered as sent and received bytes)
+    'CICIDS': {
+        'names': ['src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol', 'date', 'duration', 'total_fwd_packets',
+                  'total_bwd_packets', 'src_bytes', 'dst_bytes', 'label'],
+        'usecols': [_ for _ in range(1, 12)] + [84],
+        # numeric columns are parsed as floats since empty rows exist (they are dropped during preprocessing)
+        'dtype': {'src_ip': str, 'src_port': 'float64', 'dst_ip': str, 'dst_port': 'float64', 'protocol': 'float64',
+                  'date': str, 'duration': 'float64', 'total_fwd_packets': 'float64', 'total_bwd_packets': 'float64',
+                  'src_bytes': 'float64', 'dst_bytes': 'float64', 'label': str},
+        'delimiter': ',',
+        'skiprows': 1,
+        'header_marker': None,
+        'na_values': [],
+        'encoding': 'latin_1',
+        'date_fields': ['date'],
+        # the timestamps of the different days are not stored consistently with or without seconds
+        'date_formats': ['%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M'],
+        'date_unit': None,
+        'output_depth': 3,
+        'shared_protocols': False,
+        'host_network': None,
+        'background': None,
+        # drop rows with NaN values (mostly for the Thursday morning dataset)
+        'dropna': True,
+        'fillna': {},
+        'hex_ports': [],
+        'types': {'src_port': 'int64', 'dst_port': 'int64', 'total_fwd_packets': 'int64',
+                  'total_bwd_packets': 'int64', 'src_bytes': 'int64', 'dst_bytes': 'int64', 'duration': 'float64'},
+        'derived': {},
+        'category_codes': {},
+        'category_names': {'protocol': IP_PROTOCOL_NAMES},
+        'splits': [{'name': 'anomalous', 'differs': 'BENIGN'},
+                   {'name': 'normal', 'equals': 'BENIGN'}]
+    }
+}
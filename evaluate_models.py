@@ -1,8 +1,9 @@
 #!/usr/bin/python
 
-from helper import parse_dot, run_traces_on_model, dict2list, reduce_data_by_label, parse_symbolic_dot, run_traces_on_symbolic_model
+from helper import parse_dot, run_traces_on_model, dict2list, reduce_data_by_label, parse_symbolic_dot, run_traces_on_symbolic_model, \
+    build_entity_index, load_kept_flows
 from statistics import median
-import pandas as pd
+import flow_store
 import numpy as np
 import pickle
 import re
@@ -291,6 +292,10 @@ if __name__ == '__main__':
     # keep a value showing the last test set tested so that the accumulation of the aggregated results can be refreshed
     prev_test_path = ''
     accumulated_results = defaultdict(list)
+    # the last test set read and the entity indices built on it
+    cached_test_path = ''
+    test_data = None
+    entity_indices = dict()
     for j in range(m):
         if DEBUGGING:
             test_traces_filepath = debug_test_filepaths[j][0]
@@ -313,32 +318,31 @@ if __name__ == '__main__':
             test_data_filepath = debug_test_filepaths[j][1]
         else:
             test_data_filepath = input('Give the relative path of the testing dataframe to be used for evaluation: ')
-        if flag == 'CTU-bi':
-            normal = pd.read_pickle(test_data_filepath + '/binetflow_normal.pkl') if not sota else \
-                pd.read_pickle(test_data_filepath + '/binetflow_normal_sota.pkl')
-            anomalous = pd.read_pickle(test_data_filepath + '/binetflow_anomalous.pkl')
-        else:
-            normal = pd.read_pickle(test_data_filepath + '/normal.pkl')
-            anomalous = pd.read_pickle(test_data_filepath + '/anomalous.pkl')
-        all_data = pd.concat([normal, anomalous], ignore_index=True).reset_index(drop=True)
-        # keep only the flows currently under evaluation based on the ips extracted from the testing traces' filepath
-        # and sort values by date
-        if len(ips) == 1:
-            # host level analysis
-            if 'bdr' in test_traces_filepath:
-                all_data = all_data[(all_data['src_ip'] == ips[0]) | (all_data['dst_ip'] == ips[0])]\
-                    .sort_values(by='date').reset_index(drop=True)
-            else:
-                all_data = all_data[all_data['src_ip'] == ips[0]].sort_values(by='date').reset_index(drop=True)
-        else:
-            # connection level analysis
-            if 'bdr' in test_traces_filepath:
-                all_data = all_data[((all_data['src_ip'] == ips[0]) & (all_data['dst_ip'] == ips[1])) |
-                                    ((all_data['dst_ip'] == ips[0]) & (all_data['src_ip'] == ips[1]))] \
-                    .sort_values(by='date').reset_index(drop=True)
+        # the testing dataframe is read once per test set together with the columns needed for the evaluation, and the
+        # flows of each entity under evaluation (based on the ips extracted from the testing traces' filepath) are
+        # retrieved through an entity index built once per test set and analysis level
+        if test_data_filepath != cached_test_path:
+            columns = ['date', 'src_ip', 'dst_ip', 'label'] + (['detailed_label'] if flag == 'UNSW' else [])
+            if flag == 'CTU-bi':
+                normal = flow_store.read_flows(test_data_filepath, 'binetflow_normal' if not sota else
+                                               'binetflow_normal_sota', columns=columns)
+                anomalous = flow_store.read_flows(test_data_filepath, 'binetflow_anomalous', columns=columns)
             else:
-                all_data = all_data[(all_data['src_ip'] == ips[0]) & (all_data['dst_ip'] == ips[1])]\
-                    .sort_values(by='date').reset_index(drop=True)
+                normal = flow_store.read_flows(test_data_filepath, 'normal', columns=columns)
+                anomalous = flow_store.read_flows(test_data_filepath, 'anomalous', columns=columns)
+            test_data = flow_store.concat_flows([normal, anomalous])
+            entity_indices = dict()
+            cached_test_path = test_data_filepath
+        # in bidirectional analysis the flows in which the entity is found in either direction are kept
+        level = ('host' if len(ips) == 1 else 'connection', 'bdr' in test_traces_filepath)
+        if level not in entity_indices:
+            entity_indices[level] = build_entity_index(test_data, level[0], bidirectional=level[1])
+        entity = ips[0] if len(ips) == 1 else (ips[0], ips[1])
+        all_data = test_data.iloc[entity_indices[level].get(entity, [])].reset_index(drop=True)
+        # only the flows kept by the flow budget of the entity (if any) have been used in the testing traces
+        kept = load_kept_flows(test_traces_filepath)
+        if kept is not None:
+            all_data = all_data.iloc[kept].reset_index(drop=True)
         true_labels = all_data['label'].values
         # keep also the detailed labels for analysis reasons
         if flag == 'UNSW':
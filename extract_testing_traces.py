@@ -2,9 +2,10 @@
 
 import os
 import helper
-import pandas as pd
+import flow_store
 from copy import deepcopy
 import pickle
+from multiprocessing import Pool
 
 if __name__ == '__main__':
     # first set the flag of the type of dataset to be used
@@ -41,16 +42,21 @@ if __name__ == '__main__':
     # alphabet size in case the discretized version is used
     alphabet_size = -1
 
+    # the maximum number of flows of each instance used for the trace extraction (None for no budget)
+    flow_budget = 20000
+
     # set the input filepath of the dataframes' directory
     testing_filepath = input('Give the relative path of the dataset to be used for testing: ')
+    # only the columns needed for the trace extraction are read from the flow store
+    columns = ['date', 'src_ip', 'dst_ip'] + old_selected
     if flag == 'CTU-bi':
-        normal = pd.read_pickle(testing_filepath + '/binetflow_normal.pkl') if not sota else \
-            pd.read_pickle(testing_filepath + '/binetflow_normal_sota.pkl')
-        anomalous = pd.read_pickle(testing_filepath + '/binetflow_anomalous.pkl')
+        normal = flow_store.read_flows(testing_filepath, 'binetflow_normal' if not sota else 'binetflow_normal_sota',
+                                       columns=columns)
+        anomalous = flow_store.read_flows(testing_filepath, 'binetflow_anomalous', columns=columns)
     else:
-        normal = pd.read_pickle(testing_filepath + '/normal.pkl')
-        anomalous = pd.read_pickle(testing_filepath + '/anomalous.pkl')
-    data = pd.concat([normal, anomalous], ignore_index=True).reset_index(drop=True)
+        normal = flow_store.read_flows(testing_filepath, 'normal', columns=columns)
+        anomalous = flow_store.read_flows(testing_filepath, 'anomalous', columns=columns)
+    data = flow_store.concat_flows([normal, anomalous])
 
     if with_discretization:
         # first retrieve the discretization limits to be used for each feature
@@ -58,19 +64,8 @@ if __name__ == '__main__':
         with open(discretization_filepath, 'rb') as f:
             discretization_dict = pickle.load(f)
 
-        alphabet_size = 1
         # then apply discretization to the appropriate features
-        for feature in discretization_dict.keys():
-            alphabet_size *= (len(discretization_dict[feature]) + 1)
-            if 'num' not in feature:
-                data[feature + '_num'] = data[feature].apply(helper.find_percentile,
-                                                             args=(discretization_dict[feature],))
-                selected.remove(feature)
-                selected += [feature + '_num']
-            else:
-                data[feature] = data[feature].apply(helper.check_existence, args=(discretization_dict[feature],))
-        helper.netflow_encoding(data, selected, discretization_dict)
-        selected = ['encoding']
+        selected, alphabet_size = helper.discretize_flows(data, selected, discretization_dict)
         old_selected = deepcopy(selected)
 
     # for testing keep only hosts or connection that have a sufficient number of flows so that enough information is
@@ -85,73 +80,62 @@ if __name__ == '__main__':
         if select_major:
             instances = helper.select_connections(data, 50).values.tolist()
         else:
-            instances = data.groupby(['src_ip', 'dst_ip']).size().reset_index().values.tolist()
+            instances = data.groupby(['src_ip', 'dst_ip'], observed=True).size().reset_index().values.tolist()
         print('Number of connections to be processed: ' + str(len(instances)))
+    # the date-sorted positions of the flows of each instance are found in one pass over the data
+    entity_index = helper.build_entity_index(data, 'host' if host_level else 'connection')
+    # the worker processes among which the high-level windows of the entities are distributed, created once for
+    # all the entities (none if there is a single core)
+    pool = Pool() if os.cpu_count() > 1 else None
     # extract the data per host
     for instance in instances:
         if host_level:
             instance_name = instance
             print('Extracting traces for host ' + instance_name)
-            instance_data = data.loc[data['src_ip'] == instance].sort_values(by='date').reset_index(drop=True)
+            instance_data = data.iloc[entity_index[instance]].reset_index(drop=True)
             print('The number of flows for this host are: ' + str(instance_data.shape[0]))
         else:
             instance_name = instance[0] + '-' + instance[1]
             print('Extracting traces for connection ' + instance_name)
-            instance_data = data.loc[(data['src_ip'] == instance[0]) & (data['dst_ip'] == instance[1])].\
-                sort_values(by='date').reset_index(drop=True)
+            instance_data = data.iloc[entity_index[(instance[0], instance[1])]].reset_index(drop=True)
             print('The number of flows for this connection are: ' + str(instance_data.shape[0]))
 
+        # if the number of flows is excessive then sample from these flows to a feasible extent
+        instance_data, kept = helper.budget_flows(instance_data, flow_budget)
+
         # first ask about the nature of the windowing technique
-        timed = int(input('What type of window to use (0: non-timed | 1: static-timed | 2: dynamic-timed)? '))
-        dynamic = True if timed == 2 else False
-        timed = bool(timed)
-        # if static windows are used add it to the naming of the tracefile
-        timed_name = ''
-        if not timed:
-            timed_name = '_static'
-        elif not dynamic:
-            timed_name = '_static_timed'
+        timed, dynamic, timed_name = helper.window_settings(
+            int(input('What type of window to use (0: non-timed | 1: static-timed | 2: dynamic-timed)? ')))
 
         # secondly ask if new features has been added during training
         new_features = int(input('Were there any new features added during training (no: 0 | yes: 1)? '))
 
         # 0 for multivariate | 2 for symbolic
         aggregation = int(input('Do you want to use aggregation windows (no: 0 | yes-rolling: 1 | yes-resample: 2 )? '))
+        resample = aggregation == 2
+        aggregation = bool(aggregation)
+        # add also the needed features in case of aggregation
         if aggregation:
-            # set the traces output filepath depending on the aggregation value
-            # if aggregation has been set to 1 then proper naming is conducted in the extract_traces function of
-            # the helper.py file
-            resample = False if aggregation == 1 else True
-            aggregation = True
-            if resample:
-                traces_filepath = '/'.join(testing_filepath.split('/')[0:2]) + '/test/' + analysis_type + '/' \
-                                  + '_'.join(old_selected) + '/' + testing_filepath.split('/')[2] + '-' + \
-                                  instance_name + '-traces_resampled' + ('' if new_features else '_reduced') + \
-                                  ('_bdr' if bidirectional else '') + timed_name + '.txt'
-            else:
-                traces_filepath = '/'.join(testing_filepath.split('/')[0:2]) + '/test/' + analysis_type + '/' \
-                                  + '_'.join(old_selected) + '/' + testing_filepath.split('/')[2] + '-' + \
-                                  instance_name + '-traces_aggregated' + ('' if new_features else '_reduced') + \
-                                  ('_bdr' if bidirectional else '') + timed_name + '.txt'
-            # add also the destination ip in case of aggregation
-            if host_level:
-                selected += ['dst_ip'] if not resample else ['dst_ip', 'date']
-            else:
-                if resample:
-                    selected += ['date']
-        # if no new features have been added
-        else:
-            traces_filepath = '/'.join(testing_filepath.split('/')[0:2]) + '/test/' + analysis_type + '/' + \
-                              '_'.join(old_selected) + '/' + testing_filepath.split('/')[2] + '-' + \
-                              instance_name + '-traces' + ('_bdr' if bidirectional else '') + timed_name + '.txt'
-            aggregation = False
-            resample = False
+            selected = helper.aggregation_features(selected, host_level, resample)
+
+        # set the traces output filepath depending on the aggregation value
+        traces_filepath = helper.build_traces_filepath(testing_filepath, 'test', analysis_type, old_selected,
+                                                       instance_name, aggregation=aggregation, resample=resample,
+                                                       new_features=new_features, bidirectional=bidirectional,
+                                                       timed_name=timed_name)
 
         # create the directory if it does not exist
         os.makedirs(os.path.dirname(traces_filepath), exist_ok=True)
 
         # and extract the traces
         helper.extract_traces(instance_data, traces_filepath, selected, alphabet_size, timed=timed, dynamic=dynamic,
-                              aggregation=aggregation, resample=resample, new_features=bool(new_features))
+                              aggregation=aggregation, resample=resample, new_features=bool(new_features),
+                              pool=pool)
+        # and keep track of the flows kept by the budget, so that they can be matched to their labels in evaluation
+        helper.store_kept_flows(traces_filepath, kept)
         # finally reset the selected features
         selected = deepcopy(old_selected)
+    # and stop the worker processes
+    if pool is not None:
+        pool.close()
+        pool.join()
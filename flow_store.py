@@ -0,0 +1,374 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import pickle
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+# number of hash buckets used for partitioning the flows according to their source IP
+NUM_BUCKETS = 32
+# the partitioning columns added to the stored flows (they are removed again when the flows are read)
+PARTITION_COLS = ['src_bucket', 'day']
+# the file kept in each store with the date watermark of each source IP bucket and the flow counts of each source IP
+# (files starting with an underscore are ignored when the partitions are read)
+STATE_FILE = '_state.pkl'
+# the compact dtypes of the stored flows. The addresses and the rest of the string columns are dictionary encoded as
+# categoricals (the categories are the reversible dictionary of the integer codes), the ports need a signed type since
+# missing ports are set to -1, and the packet counters fit in unsigned 32-bit integers
+COMPACT_DTYPES = {'src_ip': 'category', 'dst_ip': 'category', 'protocol': 'category', 'direction': 'category',
+                  'state': 'category', 'flags': 'category', 'service': 'category', 'detailed_label': 'category',
+                  'label': 'category', 'src_port': 'int32', 'dst_port': 'int32', 'packets': 'uint32',
+                  'src_packets': 'uint32', 'dst_packets': 'uint32', 'total_fwd_packets': 'uint32',
+                  'total_bwd_packets': 'uint32'}
+
+
+def host_buckets(ips, num_buckets=NUM_BUCKETS):
+    """
+    Function for mapping IP addresses to the hash buckets used for partitioning the flow store. A deterministic hash is
+    used (and not Python's salted hash) so that the same host is always mapped to the same bucket across runs
+    :param ips: the IP addresses as a list, array, or Series
+    :param num_buckets: the number of buckets
+    :return: a numpy array with the bucket of each IP address
+    """
+    hashed = pd.util.hash_pandas_object(pd.Series(ips).astype(str), index=False).values
+    return (hashed % np.uint64(num_buckets)).astype(np.int32)
+
+
+def compact_flows(data):
+    """
+    Function for converting a dataframe of flows to the compact dtypes of the flow store. Numerical labels (as in
+    UNSW-NB15) are narrowed to 8-bit integers instead of becoming categorical, and integer columns whose values do not
+    fit in the compact dtype are left untouched
+    :param data: the dataframe with the flows
+    :return: the dataframe with the compact dtypes
+    """
+    dtypes = {}
+    for col, dtype in COMPACT_DTYPES.items():
+        if col not in data.columns or data[col].dtype == dtype:
+            continue
+        if col == 'label' and pd.api.types.is_numeric_dtype(data[col]):
+            dtype = 'int8'
+        if dtype == 'category':
+            dtypes[col] = dtype
+        elif pd.api.types.is_integer_dtype(data[col]) and \
+                (data.shape[0] == 0 or (data[col].min() >= np.iinfo(dtype).min and
+                                        data[col].max() <= np.iinfo(dtype).max)):
+            dtypes[col] = dtype
+    return data.astype(dtypes) if len(dtypes) else data
+
+
+def concat_flows(frames):
+    """
+    Function for concatenating dataframes of flows without losing their compact dtypes. Plain concatenation turns the
+    categorical columns with different categories into object columns, so the categories are unified first
+    :param frames: the list of dataframes with the flows
+    :return: the concatenated dataframe
+    """
+    frames = list(frames)
+    for col in frames[0].columns:
+        if all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = pd.api.types.union_categoricals([frame[col].cat.remove_unused_categories()
+                                                          for frame in frames]).categories
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def store_path(directory, name):
+    """
+    Helper function returning the path of a stored set of flows
+    :param directory: the directory of the dataset (e.g. Datasets/CTU13/scenario10)
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :return: the path of the partitioned store
+    """
+    return os.path.join(directory, name + '.parquet')
+
+
+def read_state(directory, name):
+    """
+    Function for reading the state of a stored set of flows, i.e. the latest date written in each source IP bucket (the
+    high-water mark of the bucket) and the number of flows of each source IP
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :return: a dictionary with the 'watermarks' (bucket -> date) and the 'host_counts' (Series indexed by source IP)
+    """
+    state_path = os.path.join(store_path(directory, name), STATE_FILE)
+    if not os.path.exists(state_path):
+        return {'watermarks': {}, 'host_counts': pd.Series(dtype='int64')}
+    with open(state_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def new_flows_mask(data, watermarks):
+    """
+    Function for finding the flows that are newer than the watermark of their source IP bucket. Flows of buckets without
+    a watermark are always considered new
+    :param data: the dataframe with the flows
+    :param watermarks: a dictionary with the latest date written in each bucket
+    :return: a boolean numpy array marking the new flows
+    """
+    if not len(watermarks) or data.shape[0] == 0:
+        return np.ones(data.shape[0], dtype=bool)
+    marks = pd.Series(watermarks, dtype='datetime64[ns]').reindex(host_buckets(data['src_ip'])).values
+    return np.isnat(marks) | (data['date'].values > marks)
+
+
+def update_watermarks(watermarks, data):
+    """
+    Function for raising the watermark of each source IP bucket to the latest date of the given flows in the bucket
+    :param watermarks: a dictionary with the latest date of each bucket (updated in place)
+    :param data: the dataframe with the flows
+    :return: the updated watermarks
+    """
+    if data.shape[0] == 0:
+        return watermarks
+    for bucket, date in data['date'].groupby(host_buckets(data['src_ip'])).max().items():
+        if bucket not in watermarks or date > watermarks[bucket]:
+            watermarks[bucket] = date
+    return watermarks
+
+
+def write_flows(data, directory, name, append=False):
+    """
+    Function for writing a dataframe of flows into a columnar store partitioned by the hash bucket of the source IP and
+    by the day of each flow. The flows of each partition are written sorted by date, and the state of the store (the
+    watermark of each bucket and the flow counts of each source IP) is updated with the written flows
+    :param data: the dataframe with the flows
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param append: flag showing if the flows should be added to an existing store instead of replacing it
+    :return: the number of flows written
+    """
+    path = store_path(directory, name)
+    if not append and os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    # an empty frame would only create a file without partitions
+    if data.shape[0] == 0:
+        return 0
+    data = compact_flows(data).sort_values(by='date', kind='mergesort').reset_index(drop=True)
+    # the categories that are not used in the flows written are not stored in the dictionaries of the partitions
+    for col in data.select_dtypes(include='category').columns:
+        data[col] = data[col].cat.remove_unused_categories()
+    data['src_bucket'] = host_buckets(data['src_ip'])
+    data['day'] = data['date'].dt.strftime('%Y-%m-%d')
+    data.to_parquet(path, engine='pyarrow', partition_cols=PARTITION_COLS, index=False)
+
+    # update the state of the store with the written flows
+    state = read_state(directory, name)
+    update_watermarks(state['watermarks'], data)
+    counts = data['src_ip'].astype(object).value_counts()
+    state['host_counts'] = state['host_counts'].add(counts, fill_value=0).astype('int64')
+    with open(os.path.join(path, STATE_FILE), 'wb') as f:
+        pickle.dump(state, f)
+    return data.shape[0]
+
+
+def read_flows(directory, name, columns=None, hosts=None, connections=None, start=None, end=None):
+    """
+    Function for reading flows from the partitioned store. Only the requested columns are read (column projection) and
+    only the partitions that may contain the requested hosts, connections, or dates are scanned (predicate pushdown).
+    In case no store exists for the given name, the legacy pickle file (<name>.pkl) is read and filtered instead.
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param columns: the columns to be read (None for all of them)
+    :param hosts: a list of source IPs whose flows should be read (None for all of them)
+    :param connections: a list of (source IP, destination IP) pairs whose flows should be read (None for all of them)
+    :param start: the earliest date to be read (None for no lower limit)
+    :param end: the latest date to be read (None for no upper limit)
+    :return: the dataframe with the selected flows sorted by date (in the compact dtypes of the store)
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ['date']))
+    path = store_path(directory, name)
+    if not os.path.exists(path):
+        data = compact_flows(pd.read_pickle(os.path.join(directory, name + '.pkl')))
+        if columns is not None:
+            data = data[columns]
+    else:
+        filters = []
+        src_ips = set()
+        if hosts is not None:
+            src_ips.update(hosts)
+        if connections is not None:
+            src_ips.update(src for src, _ in connections)
+        if len(src_ips):
+            src_ips = sorted(src_ips)
+            filters += [('src_bucket', 'in', sorted(set(host_buckets(src_ips).tolist()))), ('src_ip', 'in', src_ips)]
+        if start is not None:
+            filters += [('day', '>=', pd.Timestamp(start).strftime('%Y-%m-%d'))]
+        if end is not None:
+            filters += [('day', '<=', pd.Timestamp(end).strftime('%Y-%m-%d'))]
+        # the filtered columns need to be read as well
+        read_columns = columns
+        if columns is not None:
+            read_columns = list(dict.fromkeys(columns + (['src_ip'] if len(src_ips) else []) +
+                                              (['dst_ip'] if connections is not None else [])))
+        data = pd.read_parquet(path, engine='pyarrow', columns=read_columns, filters=filters if len(filters) else None)
+        data.drop(columns=[col for col in PARTITION_COLS if col in data.columns], inplace=True)
+
+    # exact row filtering (the pushed down predicates only prune partitions and row groups)
+    if hosts is not None or connections is not None:
+        mask = np.zeros(data.shape[0], dtype=bool)
+        if hosts is not None:
+            mask |= data['src_ip'].isin(hosts).values
+        if connections is not None:
+            pairs = pd.MultiIndex.from_tuples(connections, names=['src_ip', 'dst_ip'])
+            mask |= pd.MultiIndex.from_arrays([data['src_ip'], data['dst_ip']]).isin(pairs)
+        data = data[mask]
+    if start is not None:
+        data = data[data['date'] >= pd.Timestamp(start)]
+    if end is not None:
+        data = data[data['date'] <= pd.Timestamp(end)]
+    if columns is not None:
+        data = data[columns]
+    return data.sort_values(by='date', kind='mergesort').reset_index(drop=True)
+
+
+def iter_flows(directory, name, columns=None, batch_size=1000000):
+    """
+    Function for reading the flows of the store in batches, so that a pass over all the flows needs memory only for one
+    batch at a time. The batches follow the order of the partitions (and not the order of the dates). In case no store
+    exists for the given name, the legacy pickle file (<name>.pkl) is read and sliced into batches instead.
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param columns: the columns to be read (None for all of them)
+    :param batch_size: the maximum number of flows in each batch
+    :return: a generator of dataframes with the flows of each batch
+    """
+    path = store_path(directory, name)
+    if not os.path.exists(path):
+        data = compact_flows(pd.read_pickle(os.path.join(directory, name + '.pkl')))
+        if columns is not None:
+            data = data[list(columns)]
+        for start in range(0, data.shape[0], batch_size):
+            yield data.iloc[start:start + batch_size].reset_index(drop=True)
+        return
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    if columns is None:
+        columns = [col for col in dataset.schema.names if col not in PARTITION_COLS]
+    for batch in dataset.to_batches(columns=list(columns), batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def columns_path(directory, name, level='host'):
+    """
+    Helper function returning the path of the memory-mapped column export of a stored set of flows
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param level: the level of the entities indexed in the export (host | connection)
+    :return: the path of the column export
+    """
+    return os.path.join(directory, name + '_' + level + '.columns')
+
+
+def export_columns(directory, name, level='host', columns=None):
+    """
+    Function for exporting a stored set of flows as memory-mapped numpy column files (one .npy file per column). The
+    flows are sorted by entity (source IP, or source-destination IP pair) and then by date, so that the flows of each
+    entity are contiguous and sorted by date, and an index from each entity to its (offset, length) in the columns is
+    stored together with them. Categorical columns are stored as their integer codes and their categories are kept in
+    the index file
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param level: the level of the entities to be indexed (host | connection)
+    :param columns: the columns to be exported (None for all of them)
+    :return: the index of the export (see read_column_index)
+    """
+    keys = ['src_ip'] if level == 'host' else ['src_ip', 'dst_ip']
+    return write_columns(read_flows(directory, name, columns=None if columns is None else list(columns) + keys),
+                         directory, name, level)
+
+
+def write_columns(data, directory, name, level='host'):
+    """
+    Function for exporting a dataframe of flows as memory-mapped numpy column files, in the same way as the
+    export_columns function exports a stored set of flows (e.g. for exporting flows that were processed after being
+    read from the store)
+    :param data: the dataframe with the flows (containing the date and the IP columns of the entities)
+    :param directory: the directory of the dataset
+    :param name: the name of the export
+    :param level: the level of the entities to be indexed (host | connection)
+    :return: the index of the export (see read_column_index)
+    """
+    keys = ['src_ip'] if level == 'host' else ['src_ip', 'dst_ip']
+    data = data.assign(**{key: data[key].astype('category') for key in keys})
+    data = data.sort_values(by=keys + ['date'], kind='mergesort').reset_index(drop=True)
+
+    path = columns_path(directory, name, level)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    meta = {'level': level, 'length': data.shape[0], 'columns': {}, 'index': {}}
+    for col in data.columns:
+        values = data[col]
+        if values.dtype == object:
+            values = values.astype('category')
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            meta['columns'][col] = values.cat.categories.tolist()
+            values = values.cat.codes
+        else:
+            meta['columns'][col] = None
+        np.save(os.path.join(path, col + '.npy'), np.ascontiguousarray(values.values))
+
+    # the flows of an entity start wherever the codes of the entity's columns change
+    if data.shape[0]:
+        change = np.zeros(data.shape[0], dtype=bool)
+        change[0] = True
+        for key in keys:
+            codes = data[key].cat.codes.values
+            change[1:] |= codes[1:] != codes[:-1]
+        starts = np.flatnonzero(change)
+        lengths = np.diff(np.append(starts, data.shape[0]))
+        entities = data['src_ip'].values[starts].tolist() if level == 'host' else \
+            list(zip(data['src_ip'].values[starts].tolist(), data['dst_ip'].values[starts].tolist()))
+        meta['index'] = dict(zip(entities, zip(starts.tolist(), lengths.tolist())))
+    with open(os.path.join(path, '_index.pkl'), 'wb') as f:
+        pickle.dump(meta, f)
+    return meta
+
+
+def read_column_index(directory, name, level='host'):
+    """
+    Function for reading the index of a column export
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param level: the level of the entities indexed in the export (host | connection)
+    :return: a dictionary with the 'level', the total 'length', the 'columns' (column -> categories or None), and the
+    'index' (entity -> (offset, length))
+    """
+    with open(os.path.join(columns_path(directory, name, level), '_index.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def open_columns(directory, name, entity=None, level='host', columns=None, meta=None, as_frame=False):
+    """
+    Function for opening the flows of an entity from a column export. The column files are memory-mapped, so the
+    flows of the entity are returned as zero-copy views found in O(1) through the index, and forked workers opening the
+    same export share the same pages
+    :param directory: the directory of the dataset
+    :param name: the name of the stored flows (e.g. binetflow_normal_sota)
+    :param entity: the source IP (host level) or the (source IP, destination IP) pair (connection level) whose flows are
+    opened (None for all the flows)
+    :param level: the level of the entities indexed in the export (host | connection)
+    :param columns: the columns to be opened (None for all of them)
+    :param meta: the already read index of the export (it is read if None)
+    :param as_frame: flag showing if the flows should be returned as a dataframe (with the categorical columns decoded)
+    instead of a dictionary of arrays (with the categorical columns as codes)
+    :return: a dictionary with the array of each column or the dataframe with the flows of the entity sorted by date
+    """
+    if meta is None:
+        meta = read_column_index(directory, name, level)
+    path = columns_path(directory, name, level)
+    columns = list(meta['columns'].keys()) if columns is None else columns
+    arrays = {col: np.load(os.path.join(path, col + '.npy'), mmap_mode='r') for col in columns}
+    if entity is not None:
+        offset, length = meta['index'].get(entity, (0, 0))
+        arrays = {col: values[offset:offset + length] for col, values in arrays.items()}
+    if not as_frame:
+        return arrays
+    return pd.DataFrame({col: values if meta['columns'][col] is None else
+                         pd.Categorical.from_codes(values, categories=meta['columns'][col])
+                         for col, values in arrays.items()})
@@ -2,18 +2,21 @@
 
 from pandas.tseries.offsets import DateOffset
 from copy import deepcopy
-from scipy.stats import mode
 from statistics import mean
 from model import ModelNode, Model
 from tslearn.metrics import dtw
 from sklearn.preprocessing import MinMaxScaler
 import re
+import os
+import shutil
 import pickle
 import numpy as np
 import pandas as pd
 from sklearn.cluster import KMeans
 import matplotlib.pyplot as plt
+import io
 import sys
+import heapq
 from collections import defaultdict
 
 
@@ -49,78 +52,345 @@ def keep_only_major_connection(data):
     :param data: the host data
     :return: the host data containing only the flows with the major destination IP
     """
-    major_dst_ip = data.groupby('dst_ip').size().idxmax(axis=0)
+    major_dst_ip = data.groupby('dst_ip', observed=True).size().idxmax(axis=0)
     return data[data['dst_ip'] == major_dst_ip].sort_values(by='date').reset_index(drop=True)
 
 
-def check_ips(x, ips_dict):
+# the pairs of columns that are swapped when the direction of a flow is reversed
+DIRECTIONAL_PAIRS = [('src_ip', 'dst_ip'), ('src_port', 'dst_port'), ('src_bytes', 'dst_bytes')]
+
+
+def swap_directions(data, swap):
     """
-    Helper function for swaping the needed values when bidirectional flows are examined. This function is meant
-    to be applied on each row a dataframe.
-    :param x: input row of the dataframe
-    :param ips_dict: a dictionary with the ips seen, when only the source IP is considered as host, and their counts
-    :return: the transformed row
+    Helper function for reversing the direction of the selected flows in a vectorized way, by swapping the values of
+    the source and destination columns (IPs, ports, bytes) with array operations. The categories of categorical columns
+    are unified first, so that the swapped values remain valid
+    :param data: the dataframe with the flows
+    :param swap: a boolean array marking the flows to be reversed
+    :return: a new dataframe with the selected flows reversed
     """
-    # if the destination IP has been seen as a host and has more flows than the current source IP, make the swap
-    if x['dst_ip'] in ips_dict.keys() and ips_dict[x['dst_ip']] > ips_dict[x['src_ip']]:
-        x['src_ip'], x['dst_ip'] = x['dst_ip'], x['src_ip']
-        x['src_port'], x['dst_port'] = x['dst_port'], x['src_port']
-        x['src_bytes'], x['dst_bytes'] = x['dst_bytes'], x['src_bytes']
-    return x
+    data = data.copy()
+    for src, dst in DIRECTIONAL_PAIRS:
+        if src not in data.columns or dst not in data.columns:
+            continue
+        if isinstance(data[src].dtype, pd.CategoricalDtype) and isinstance(data[dst].dtype, pd.CategoricalDtype):
+            categories = data[src].cat.categories.union(data[dst].cat.categories)
+            src_codes = data[src].cat.set_categories(categories).cat.codes.values
+            dst_codes = data[dst].cat.set_categories(categories).cat.codes.values
+            data[src] = pd.Categorical.from_codes(np.where(swap, dst_codes, src_codes), categories=categories)
+            data[dst] = pd.Categorical.from_codes(np.where(swap, src_codes, dst_codes), categories=categories)
+        else:
+            src_values, dst_values = data[src].values, data[dst].values
+            data[src] = np.where(swap, dst_values, src_values)
+            data[dst] = np.where(swap, src_values, dst_values)
+    return data
 
 
-def select_hosts(init_data, threshold=50, bidirectional=False):
+def canonicalize_hosts(data, host_counts):
+    """
+    Function for making the host with the most flows the source of each flow, when bidirectional flows are examined.
+    A flow is reversed if its destination IP has been seen as a host (source IP) with more flows than its source IP
+    :param data: the dataframe with the flows
+    :param host_counts: a Series with the number of flows of each source IP
+    :return: the canonicalized dataframe
+    """
+    src_counts = host_counts.reindex(data['src_ip'].astype(object).values).values
+    dst_counts = host_counts.reindex(data['dst_ip'].astype(object).values).values
+    # missing destination counts (NaN) never lead to a swap
+    return swap_directions(data, dst_counts > src_counts)
+
+
+def select_hosts(init_data, threshold=50, bidirectional=False, return_data=False):
     """
     Function for identifying only the flows of source IPs with at least a threshold number of records in the data.
     :param init_data: the initial data
     :param threshold: the threshold number of flows per host IP
     :param bidirectional: a boolean flag for checking for host IPs in both directions (source and destination). If set
     to False, only source IPs will be considered as hosts
-    :return: the selected data
+    :param return_data: a boolean flag for returning the (canonicalized in the bidirectional case) data as well
+    :return: the selected data (and the data if return_data is set)
     """
-    host_cnts = init_data.groupby(by='src_ip').size().reset_index().rename(columns={0: "size"})
+    host_cnts = init_data.groupby(by='src_ip', observed=True).size()
     if bidirectional:
-        ips_counts = dict(host_cnts.values.tolist())
-        init_data = init_data.apply(lambda x: check_ips(x, ips_counts), axis=1)
-        host_cnts = init_data.groupby(by='src_ip').size().reset_index().rename(columns={0: "size"})
-    return host_cnts[host_cnts['size'] > threshold]
+        init_data = canonicalize_hosts(init_data, host_cnts)
+        host_cnts = init_data.groupby(by='src_ip', observed=True).size()
+    host_cnts = host_cnts.reset_index().rename(columns={0: "size"})
+    host_cnts = host_cnts[host_cnts['size'] > threshold]
+    return (host_cnts, init_data) if return_data else host_cnts
 
 
-def check_connections(x, connections_dict):
+def canonicalize_connections(data, connection_counts):
     """
-    Helper function for swaping the needed values when bidirectional connections are examined. This function is meant
-    to be applied on each row a dataframe.
-    :param x: input row of the dataframe
-    :param connections_dict: a dictionary with the connections seen in the forward direction and their counts
-    :return: the transformed row
+    Function for making the direction with the most flows the forward direction of each connection, when bidirectional
+    connections are examined. A flow is reversed if its connection has been seen in the reverse direction with more
+    flows than in its own direction
+    :param data: the dataframe with the flows
+    :param connection_counts: a Series with the number of flows of each (source IP, destination IP) pair
+    :return: the canonicalized dataframe
     """
-    connection = x['src_ip'] + '-' + x['dst_ip']
-    connection_reversed = x['dst_ip'] + '-' + x['src_ip']
-    # if the connection in the forward direction has been seen as a forward connection and has more flows than the
-    # current forward connection, make the swap
-    if connection_reversed in connections_dict.keys() and connections_dict[connection_reversed] > \
-            connections_dict[connection]:
-        x['src_ip'], x['dst_ip'] = x['dst_ip'], x['src_ip']
-        x['src_port'], x['dst_port'] = x['dst_port'], x['src_port']
-        x['src_bytes'], x['dst_bytes'] = x['dst_bytes'], x['src_bytes']
-    return x
+    src_ips, dst_ips = data['src_ip'].astype(object).values, data['dst_ip'].astype(object).values
+    forward_counts = connection_counts.reindex(pd.MultiIndex.from_arrays([src_ips, dst_ips])).values
+    reverse_counts = connection_counts.reindex(pd.MultiIndex.from_arrays([dst_ips, src_ips])).values
+    # missing reverse counts (NaN) never lead to a swap
+    return swap_directions(data, reverse_counts > forward_counts)
 
 
-def select_connections(init_data, threshold=50, bidirectional=False):
+def select_connections(init_data, threshold=50, bidirectional=False, return_data=False):
     """
     Function for identifying only the flows with at least a threshold number of source-destination IP pairs in the data.
     :param init_data: the initial data
     :param threshold: the threshold number of flows per source-destination IP pairs
     :param bidirectional: a boolean flag for checking for connections in both directions (source and destination). If
     set to False, only the original direction will be checked
-    :return: the selected data
+    :param return_data: a boolean flag for returning the (canonicalized in the bidirectional case) data as well
+    :return: the selected data (and the data if return_data is set)
     """
-    connections_cnts = init_data.groupby(['src_ip', 'dst_ip']).size().reset_index().rename(columns={0: "size"})
+    connections_cnts = init_data.groupby(['src_ip', 'dst_ip'], observed=True).size()
     if bidirectional:
-        connections_counts = dict([[triple[0] + '-' + triple[1], triple[2]] for triple in connections_cnts[['src_ip', 'dst_ip', 'size']].values.tolist()])
-        init_data = init_data.apply(lambda x: check_connections(x, connections_counts), axis=1)
-        connections_cnts = init_data.groupby(['src_ip', 'dst_ip']).size().reset_index().rename(columns={0: "size"})
-    return connections_cnts[connections_cnts['size'] > threshold]
+        connections_cnts.index = connections_cnts.index.set_levels([level.astype(object)
+                                                                    for level in connections_cnts.index.levels])
+        init_data = canonicalize_connections(init_data, connections_cnts)
+        # the flows of a connection are moved to its reverse direction only if the reverse direction has more flows, so
+        # the new counts are derived from the existing ones without grouping the data again
+        forward = connections_cnts.values
+        reverse = connections_cnts.reindex(pd.MultiIndex.from_arrays(
+            [connections_cnts.index.get_level_values(1), connections_cnts.index.get_level_values(0)])).fillna(0).values
+        connections_cnts = pd.Series(np.where(reverse > forward, 0, forward + np.where(reverse < forward, reverse, 0))
+                                     .astype(np.int64), index=connections_cnts.index)
+        connections_cnts = connections_cnts[connections_cnts > 0]
+    connections_cnts = connections_cnts.reset_index().rename(columns={0: "size"})
+    connections_cnts = connections_cnts[connections_cnts['size'] > threshold]
+    return (connections_cnts, init_data) if return_data else connections_cnts
+
+
+class SpaceSaving:
+    def __init__(self, capacity=100000):
+        """
+        Bounded-memory heavy-hitter sketch (Space-Saving) keeping an overestimate of the number of flows of at most
+        capacity entities. The overestimate of each monitored entity exceeds its true count by at most total / capacity,
+        and an entity that is not monitored has at most as many flows as the minimum monitored count
+        :param capacity: the maximum number of monitored entities
+        """
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.errors = pd.Series(dtype='int64')
+        self.total = 0
+        self.evicted = False
+
+    def update(self, counts):
+        """
+        Method for merging the exact counts of a batch of flows into the sketch. The entities that are not monitored are
+        added with the minimum monitored count as their error (once entities have been evicted), and only the capacity
+        entities with the highest counts are kept afterwards
+        :param counts: a Series with the number of flows of each entity in the batch
+        :return: the updated sketch
+        """
+        counts = counts[counts > 0].astype('int64')
+        self.total += int(counts.sum())
+        floor = self.min_count()
+        new = ~counts.index.isin(self.counts.index)
+        # the empty sketch takes the index (and index names) of the first batch
+        self.counts = self.counts.add(counts, fill_value=0).astype('int64') if len(self.counts) else counts.copy()
+        self.errors = self.errors.reindex(self.counts.index, fill_value=0).astype('int64')
+        if floor:
+            new_index = counts.index[new]
+            self.counts.loc[new_index] += floor
+            self.errors.loc[new_index] = floor
+        if len(self.counts) > self.capacity:
+            self.evicted = True
+            self.counts = self.counts.nlargest(self.capacity, keep='first')
+            self.errors = self.errors.reindex(self.counts.index)
+        return self
+
+    def min_count(self):
+        """
+        Method returning the upper bound of the number of flows of any entity that is not monitored by the sketch
+        :return: the minimum monitored count if entities have been evicted from the sketch, otherwise 0
+        """
+        return int(self.counts.min()) if self.evicted else 0
+
+    def candidates(self, threshold):
+        """
+        Method returning the monitored entities whose overestimated count exceeds the threshold. All the entities with
+        more than threshold flows are included as long as the minimum monitored count does not exceed the threshold
+        :param threshold: the threshold number of flows
+        :return: a Series with the overestimated count of each candidate entity
+        """
+        if self.min_count() > threshold:
+            print('The sketch capacity is too small for a threshold of ' + str(threshold) + ' flows (entities with up '
+                  'to ' + str(self.min_count()) + ' flows may be missed) -- Increase the capacity!!!')
+        return self.counts[self.counts > threshold]
+
+
+def stream_select(read_chunks, keys, threshold=50, capacity=100000, exact=True):
+    """
+    Function for identifying the entities with more than a threshold number of flows in one pass over batches of flows,
+    with memory bounded by the capacity of a Space-Saving sketch instead of the size of the data. The candidate entities
+    found by the sketch can optionally be confirmed in a second pass that counts exactly the flows of the candidates.
+    :param read_chunks: a function returning a new iterator over the batches of flows (called once for each pass)
+    :param keys: the columns identifying an entity (['src_ip'] for hosts | ['src_ip', 'dst_ip'] for connections)
+    :param threshold: the threshold number of flows per entity
+    :param capacity: the maximum number of entities monitored by the sketch
+    :param exact: a boolean flag for confirming the candidates with exact counts in a second pass (otherwise the
+    overestimated counts of the sketch are returned)
+    :return: the selected entities with their number of flows, in the format of select_hosts and select_connections
+    """
+    sketch = SpaceSaving(capacity)
+    for chunk in read_chunks():
+        sketch.update(chunk_counts(chunk, keys))
+    cnts = sketch.candidates(threshold)
+    if exact:
+        exact_cnts = pd.Series(0, index=cnts.index, dtype='int64')
+        for chunk in read_chunks():
+            chunk_cnts = chunk_counts(chunk, keys)
+            chunk_cnts = chunk_cnts[chunk_cnts.index.isin(exact_cnts.index)]
+            exact_cnts = exact_cnts.add(chunk_cnts, fill_value=0).astype('int64')
+        cnts = exact_cnts[exact_cnts > threshold]
+    cnts = cnts.sort_index()
+    cnts.index.names = keys
+    return cnts.rename('size').reset_index()
+
+
+def chunk_counts(chunk, keys):
+    """
+    Helper function for counting the flows of each entity in a batch of flows, with the entities as plain (not
+    categorical) values so that the counts of batches with different categories can be merged
+    :param chunk: the dataframe with the batch of flows
+    :param keys: the columns identifying an entity
+    :return: a Series with the number of flows of each entity
+    """
+    cnts = chunk.groupby(keys, observed=True).size()
+    if len(keys) == 1:
+        cnts.index = cnts.index.astype(object)
+    else:
+        cnts.index = cnts.index.set_levels([level.astype(object) for level in cnts.index.levels])
+    return cnts
+
+
+def stream_select_hosts(read_chunks, threshold=50, capacity=100000, exact=True):
+    """
+    Function for identifying the source IPs with more than a threshold number of flows with bounded memory (see the
+    stream_select function).
+    :param read_chunks: a function returning a new iterator over the batches of flows (called once for each pass)
+    :param threshold: the threshold number of flows per host IP
+    :param capacity: the maximum number of hosts monitored by the sketch
+    :param exact: a boolean flag for confirming the candidate hosts with exact counts in a second pass
+    :return: the selected hosts with their number of flows
+    """
+    return stream_select(read_chunks, ['src_ip'], threshold=threshold, capacity=capacity, exact=exact)
+
+
+def stream_select_connections(read_chunks, threshold=50, capacity=100000, exact=True):
+    """
+    Function for identifying the source-destination IP pairs with more than a threshold number of flows with bounded
+    memory (see the stream_select function).
+    :param read_chunks: a function returning a new iterator over the batches of flows (called once for each pass)
+    :param threshold: the threshold number of flows per source-destination IP pair
+    :param capacity: the maximum number of connections monitored by the sketch
+    :param exact: a boolean flag for confirming the candidate connections with exact counts in a second pass
+    :return: the selected connections with their number of flows
+    """
+    return stream_select(read_chunks, ['src_ip', 'dst_ip'], threshold=threshold, capacity=capacity, exact=exact)
+
+
+def build_entity_index(data, level='host', bidirectional=False):
+    """
+    Function for building an index from each entity of the data to the positions of its flows sorted by date, in one
+    grouping pass over the data. The flows of an entity are then retrieved with data.iloc[index[entity]] instead of
+    scanning the whole dataframe for each entity
+    :param data: the dataframe with the flows
+    :param level: the level of the entities (host | connection)
+    :param bidirectional: a boolean flag for indexing the flows of an entity in both directions, i.e. the flows in which
+    a host is found as source or destination, or the flows of a connection in either direction (in which case each
+    connection can be looked up with both orders of its IPs)
+    :return: a dictionary with the source IP (host level) or the (source IP, destination IP) pair (connection level) of
+    each entity as key and the numpy array with the positions of its flows sorted by date as value
+    """
+    # the flows are ranked by date once (stable sort), so that the positions of each group come out sorted by date
+    order = np.argsort(data['date'].values, kind='mergesort')
+    ranked = data[['src_ip'] if level == 'host' and not bidirectional else ['src_ip', 'dst_ip']].iloc[order]
+    if level == 'host':
+        groups = ranked.groupby('src_ip', observed=True, sort=False).indices
+        if bidirectional:
+            reverse_groups = ranked.groupby('dst_ip', observed=True, sort=False).indices
+            groups = {entity: np.union1d(groups.get(entity, []), reverse_groups.get(entity, [])).astype(np.int64)
+                      for entity in set(groups) | set(reverse_groups)}
+    else:
+        groups = ranked.groupby(['src_ip', 'dst_ip'], observed=True, sort=False).indices
+        if bidirectional:
+            groups = {(src, dst): np.union1d(positions, groups.get((dst, src), [])).astype(np.int64)
+                      for (src, dst), positions in groups.items()}
+            groups.update({(dst, src): positions for (src, dst), positions in list(groups.items())
+                           if (dst, src) not in groups})
+    return {entity: order[positions] for entity, positions in groups.items()}
+
+
+def budget_flows(data, budget=20000, num_strata=10):
+    """
+    Function for bounding the number of flows of an entity with time-stratified block sampling. The time span of the
+    flows is split into num_strata strata of equal duration, the budget is allocated to the strata proportionally to
+    their number of flows, and in each stratum a contiguous block of consecutive flows is kept, so that the windows
+    extracted from the kept flows preserve the structure of the original ones
+    :param data: the dataframe with the flows of the entity
+    :param budget: the maximum number of flows to be kept (None for no budget)
+    :param num_strata: the number of time strata
+    :return: the dataframe with the kept flows and a numpy array with the positions of the kept flows in the input
+    dataframe (None if all the flows are kept)
+    """
+    if budget is None or data.shape[0] <= budget:
+        return data, None
+    order = np.argsort(data['date'].values, kind='mergesort')
+    dates = data['date'].values[order].astype('datetime64[ns]').astype(np.int64)
+    edges = np.linspace(dates[0], dates[-1], num_strata + 1)[1:-1]
+    counts = np.bincount(np.searchsorted(edges, dates, side='right'), minlength=num_strata)
+    # proportional allocation with the remaining flows given to the strata with the largest fractional quotas
+    quotas = budget * counts / data.shape[0]
+    allocation = np.floor(quotas).astype(np.int64)
+    allocation[np.argsort(allocation - quotas, kind='mergesort')[:budget - allocation.sum()]] += 1
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    kept = np.sort(order[np.concatenate([np.arange(start, start + size) for start, size in zip(starts, allocation)])])
+    return data.iloc[kept].reset_index(drop=True), kept
+
+
+def kept_flows_filepath(traces_filepath):
+    """
+    Helper function returning the filepath of the positions of the flows kept by the budget of an entity, next to its
+    traces' file
+    :param traces_filepath: the filepath of the traces' file
+    :return: the filepath of the kept flows
+    """
+    return '.'.join(traces_filepath.split('.')[:-1]) + '_kept.pkl'
+
+
+def store_kept_flows(traces_filepath, kept):
+    """
+    Function for storing the positions of the flows kept by the budget of an entity, so that the indices of its traces
+    can be mapped back to the flows of the entity during evaluation. A stale file of a previous extraction is removed in
+    case all the flows have been kept
+    :param traces_filepath: the filepath of the traces' file
+    :param kept: a numpy array with the positions of the kept flows (None if all the flows have been kept)
+    :return: stores (or removes) the file with the kept flows
+    """
+    kept_filepath = kept_flows_filepath(traces_filepath)
+    if kept is None:
+        if os.path.exists(kept_filepath):
+            os.remove(kept_filepath)
+    else:
+        with open(kept_filepath, 'wb') as f:
+            pickle.dump(kept, f)
+
+
+def load_kept_flows(traces_filepath):
+    """
+    Function for loading the positions of the flows kept by the budget of an entity
+    :param traces_filepath: the filepath of the traces' file
+    :return: a numpy array with the positions of the kept flows (None if all the flows have been kept)
+    """
+    kept_filepath = kept_flows_filepath(traces_filepath)
+    if not os.path.exists(kept_filepath):
+        return None
+    with open(kept_filepath, 'rb') as f:
+        return pickle.load(f)
 
 
 def set_windowing_vars(data):
@@ -222,6 +492,30 @@ def netflow_encoding(data, selected, discretization_dict):
     data['encoding'] = data['encoding'].astype(int)
 
 
+def discretize_flows(data, selected, discretization_dict):
+    """
+    Function for discretizing the selected features of the input dataframe according to the given discretization limits
+    and for encoding each flow as a single symbol. The discretized features are added to the dataframe as <feature>_num
+    columns and the symbol of each flow in the 'encoding' column.
+    :param data: the dataframe with the input data
+    :param selected: a list with the selected features
+    :param discretization_dict: the dictionary with the discritization information
+    :return: the selected features after the encoding (only the 'encoding' one) and the size of the alphabet
+    """
+    selected = deepcopy(selected)
+    alphabet_size = 1
+    for feature in discretization_dict.keys():
+        alphabet_size *= (len(discretization_dict[feature]) + 1)
+        if 'num' not in feature:
+            data[feature + '_num'] = data[feature].apply(find_percentile, args=(discretization_dict[feature],))
+            selected.remove(feature)
+            selected += [feature + '_num']
+        else:
+            data[feature] = data[feature].apply(check_existence, args=(discretization_dict[feature],))
+    netflow_encoding(data, selected, discretization_dict)
+    return ['encoding'], alphabet_size
+
+
 def traces_dissimilarity(trace1, trace2, multivariate=True, normalization=True):
     """
     Function for calculating the dissimilarity between two input traces. The traces are in the form of list of lists and
@@ -248,8 +542,19 @@ def convert2flexfringe_format(win_data, ints=True):
     :param ints: flag showing if there are only int data in the dataframe
     :return: a list of the events in the trace with features separated by comma in each event
     """
+    return format_records(win_data.to_numpy(), ints)
+
+
+def format_records(values, ints=True):
+    """
+    Function to convert the rows of a feature matrix into records in the format accepted by the multivariate version of
+    flexfringe
+    :param values: the numpy array with the features of each record
+    :param ints: flag showing if there are only int data in the array
+    :return: a list of the records with features separated by comma in each record
+    """
     fun = lambda x: int(x) if ints else float(x)
-    return list(map(lambda x: ','.join(map(lambda t: str(fun(t)), x)), win_data.to_numpy().tolist()))
+    return list(map(lambda x: ','.join(map(lambda t: str(fun(t)), x)), values.tolist()))
 
 
 def trace2list(trace):
@@ -261,15 +566,269 @@ def trace2list(trace):
     return list(map(lambda x: list(map(int, x.split(','))), trace))
 
 
-def calculate_window_mask(data, start_date, end_date):
+class TraceWriter:
+    def __init__(self, out_filepath, alphabet_size):
+        """
+        Writer of the traces extracted from the flows of an entity in the format accepted by flexfringe. The records of
+        the flows are kept once in a feature matrix and each trace is written as a (start, end) range of its rows, so
+        that the flows shared by overlapping traces are neither copied nor converted to the flexfringe format more than
+        once. Each trace is appended to the traces' file as soon as it is extracted, so that the traces of an entity are
+        never kept in memory all together. Since the header of the file (the number of traces and features) is known
+        only at the end, the traces are first written in a temporary file (<out_filepath>.part), which is copied after
+        the header when the writer is closed. The indices of the flows of each trace are appended as a separate pickled
+        list to the indices' file (<out_filepath>_indices.pkl), which is read by the load_trace_indices function
+        :param out_filepath: the filepath of the traces' file
+        :param alphabet_size: the size of the alphabet (positive only if discretized input is given -> 'encoding')
+        """
+        self.out_filepath = out_filepath
+        self.alphabet_size = alphabet_size
+        self.num_of_traces = 0
+        self.records = None
+        self.records_indices = None
+        self.body = open(out_filepath + '.part', 'w')
+        self.indices = open(trace_indices_filepath(out_filepath), 'wb')
+
+    def set_records(self, values, indices, ints=True):
+        """
+        Method for setting the feature matrix from which the traces are written. Its rows are converted to the
+        flexfringe format once, and the records of each trace are joined from a view of the converted rows
+        :param values: the numpy array with the features of each flow
+        :param indices: the index of the flows of the rows
+        :param ints: flag showing if there are only int data in the array
+        :return: the updated writer
+        """
+        self.records = np.array(format_records(values, ints), dtype=object)
+        self.records_indices = indices
+        return self
+
+    def write(self, start, end):
+        """
+        Method for appending the trace of the rows in positions [start, end) of the feature matrix
+        :param start: the first row of the trace
+        :param end: the row after the last row of the trace
+        :return: the updated writer
+        """
+        return self.write_records(self.records[start:end], self.records_indices[start:end])
+
+    def write_records(self, trace, indices):
+        """
+        Method for appending a trace to the traces' file and the indices of its flows to the indices' file
+        :param trace: the records of the trace in the flexfringe format
+        :param indices: the index of the flows of the records
+        :return: the updated writer
+        """
+        if self.alphabet_size > 0:
+            # if symbols are used
+            self.body.write('1 ' + str(len(trace)) + ' ' + ' '.join(trace) + '\n')
+        else:
+            # if the multivariate version is used
+            self.body.write('1 ' + str(len(trace)) + ' 0:' + ' 0:'.join(trace) + '\n')
+        pickle.dump([indices.tolist()], self.indices)
+        self.num_of_traces += 1
+        return self
+
+    def close_part(self):
+        """
+        Method for closing the files of the writer without completing the traces' file with its header, so that its
+        traces can be appended to the traces of another writer by the append method
+        :return: the number of traces written
+        """
+        self.body.close()
+        self.indices.close()
+        return self.num_of_traces
+
+    def append(self, part_filepath, num_of_traces):
+        """
+        Method for appending the traces (and their indices) written by another writer, closed by its close_part method
+        :param part_filepath: the filepath of the traces' file of the other writer
+        :param num_of_traces: the number of traces written by the other writer
+        :return: the updated writer
+        """
+        with open(part_filepath + '.part', 'r') as body:
+            shutil.copyfileobj(body, self.body)
+        with open(trace_indices_filepath(part_filepath), 'rb') as indices:
+            shutil.copyfileobj(indices, self.indices)
+        os.remove(part_filepath + '.part')
+        os.remove(trace_indices_filepath(part_filepath))
+        self.num_of_traces += num_of_traces
+        return self
+
+    def close(self, num_of_features):
+        """
+        Method for completing the traces' file with its header
+        :param num_of_features: the number of features of each record
+        :return: creates the traces' file and closes the indices' file
+        """
+        self.body.close()
+        self.indices.close()
+        with open(self.out_filepath, 'w') as f:
+            if self.alphabet_size > 0:
+                f.write(str(self.num_of_traces) + ' ' + str(self.alphabet_size) + '\n')
+            else:
+                f.write(str(self.num_of_traces) + ' ' + '100:' + str(num_of_features) + '\n')
+            with open(self.out_filepath + '.part', 'r') as body:
+                shutil.copyfileobj(body, f)
+        os.remove(self.out_filepath + '.part')
+
+
+def trace_indices_filepath(traces_filepath):
     """
-    Function for calculating the window mask for the input dataframe given a starting and an ending date
-    :param data: the input dataframe
+    Function for finding the filepath of the file with the indices of the flows of each trace of a traces' file
+    :param traces_filepath: the filepath of the traces' file
+    :return: the filepath of the indices' file
+    """
+    return '.'.join(traces_filepath.split('.')[:-1]) + '_indices.pkl'
+
+
+def load_trace_indices(indices_filepath):
+    """
+    Function for loading the indices of the flows of each trace, stored as consecutive pickled lists of indices' lists
+    (a single list in case of files created before the traces were written one at a time)
+    :param indices_filepath: the filepath of the indices' file
+    :return: the list with the list of the indices of each trace
+    """
+    traces_indices = []
+    with open(indices_filepath, 'rb') as f:
+        while True:
+            try:
+                traces_indices += pickle.load(f)
+            except EOFError:
+                break
+    return traces_indices
+
+
+def find_window_range(dates, start_date, end_date):
+    """
+    Function for finding the positions of the flows of a time window given a starting and an ending date, with a binary
+    search on the sorted dates of the flows instead of a comparison of all the dates
+    :param dates: the numpy array with the sorted dates of the flows
     :param start_date: the starting date
     :param end_date: the ending date
-    :return: the window mask
+    :return: the first position of the window and the position after its last flow (the flows of the window are the
+    ones in positions [lo, hi))
     """
-    return (data['date'] >= start_date) & (data['date'] <= end_date)
+    return dates.searchsorted(pd.Timestamp(start_date).to_datetime64(), side='left'), \
+        dates.searchsorted(pd.Timestamp(end_date).to_datetime64(), side='right')
+
+
+def fit_window(dates, lo, start_date, window_len, trace_limits):
+    """
+    Function for finding the nearest time window starting at the given date whose number of flows conforms to the trace
+    limits, directly from the sorted dates of the flows. Since the number of flows of a window grows with its size, a
+    window with too many flows is reduced to the largest one ending just before the flow found max_trace_length
+    positions after its first flow, and a window with too few flows is increased to the smallest one ending at the flow
+    found min_trace_length positions after its first flow (or at the last flow in case fewer flows remain)
+    :param dates: the numpy array with the sorted dates of the flows
+    :param lo: the position of the first flow of the window
+    :param start_date: the starting date of the window
+    :param window_len: the current number of flows of the window
+    :param trace_limits: a tuple containing the minimum and maximum length that a trace can have
+    :return: the size of the window
+    """
+    min_trace_length, max_trace_length = trace_limits
+    if window_len > max_trace_length:
+        window = pd.Timestamp(dates[lo + max_trace_length]) - pd.Timestamp(start_date) - pd.Timedelta(1, unit='ns')
+    else:
+        window = pd.Timestamp(dates[min(lo + min_trace_length, len(dates)) - 1]) - pd.Timestamp(start_date)
+    # the window cannot become shorter than the resolution of the timestamps (flows with the same timestamp as the start
+    # date are always part of the window)
+    return max(window, pd.Timedelta(1, unit='us'))
+
+
+def rolling_window_starts(index, window):
+    """
+    Function for finding the position of the first row of the rolling window ending at each row, for windows of a fixed
+    number of rows or (in case of timestamps as index) of a fixed duration, with the same bounds as the rolling windows
+    of pandas (the last window rows or the rows in (t - window, t] respectively)
+    :param index: the index of the dataframe (sorted timestamps in case of windows of a fixed duration)
+    :param window: the window length (number of rows or offset string)
+    :return: a numpy array with the first position of the window of each row
+    """
+    if isinstance(window, (int, np.integer)):
+        return np.maximum(np.arange(len(index)) - window + 1, 0)
+    dates = np.asarray(index, dtype='datetime64[ns]')
+    return dates.searchsorted(dates - pd.to_timedelta(window).to_timedelta64(), side='right')
+
+
+def rolling_distinct_count(values, starts):
+    """
+    Function for counting the distinct values in the rolling window ending at each row. A running count table of the
+    values in the window is updated as the window slides, so that each step costs O(1) instead of building the set of
+    the values of each window
+    :param values: the values of the rows
+    :param starts: the position of the first row of the window of each row
+    :return: a numpy array with the number of distinct values in the window of each row
+    """
+    codes = np.unique(np.asarray(values), return_inverse=True)[1].ravel().tolist()
+    starts = np.asarray(starts).tolist()
+    counts = [0] * (max(codes) + 1 if len(codes) else 0)
+    distinct = np.empty(len(codes))
+    num_distinct = 0
+    lo = 0
+    for i, code in enumerate(codes):
+        # add the value entering the window
+        if counts[code] == 0:
+            num_distinct += 1
+        counts[code] += 1
+        # and remove the values leaving it
+        while lo < starts[i]:
+            counts[codes[lo]] -= 1
+            if counts[codes[lo]] == 0:
+                num_distinct -= 1
+            lo += 1
+        distinct[i] = num_distinct
+    return distinct
+
+
+def rolling_mode(values, starts):
+    """
+    Function for finding the most frequent value in the rolling window ending at each row (the smallest one in case of
+    ties, as in scipy.stats.mode). A running count table of the values in the window is kept together with the number
+    of values of each frequency (up to the window length), so that the highest frequency is updated in O(1) as the
+    window slides. The smallest value of the highest frequency is found from a min-heap of the values of each frequency,
+    from which the values that no longer have this frequency are removed lazily, i.e. in amortized O(log(window)) per
+    row instead of scanning all the tied values
+    :param values: the values of the rows
+    :param starts: the position of the first row of the window of each row
+    :return: a numpy array with the most frequent value in the window of each row
+    """
+    uniques, codes = np.unique(np.asarray(values), return_inverse=True)
+    codes = codes.ravel().tolist()
+    starts = np.asarray(starts)
+    max_window = int((np.arange(len(codes)) - starts).max()) + 1 if len(codes) else 0
+    starts = starts.tolist()
+    counts = [0] * len(uniques)
+    # the number of values (codes) having each frequency in the window, and the heap of the codes of each frequency
+    sizes = [0] * (max_window + 2)
+    heaps = [[] for _ in range(max_window + 2)]
+    max_frequency = 0
+    modes = np.empty(len(codes), dtype=np.int64)
+    lo = 0
+    for i, code in enumerate(codes):
+        # add the value entering the window
+        sizes[counts[code]] -= 1
+        counts[code] += 1
+        sizes[counts[code]] += 1
+        heapq.heappush(heaps[counts[code]], code)
+        if counts[code] > max_frequency:
+            max_frequency = counts[code]
+        # and remove the values leaving it
+        while lo < starts[i]:
+            leaving = codes[lo]
+            sizes[counts[leaving]] -= 1
+            if counts[leaving] == max_frequency and not sizes[max_frequency]:
+                max_frequency -= 1
+            counts[leaving] -= 1
+            sizes[counts[leaving]] += 1
+            if counts[leaving]:
+                heapq.heappush(heaps[counts[leaving]], leaving)
+            lo += 1
+        # the codes are sorted as the values, so the smallest valid code of the highest frequency is the mode
+        heap = heaps[max_frequency]
+        while counts[heap[0]] != max_frequency:
+            heapq.heappop(heap)
+        modes[i] = heap[0]
+    return uniques[modes].astype(np.float64)
 
 
 def aggregate_in_windows(data, selected_features, window, timed=False, resample=False, new_features=True):
@@ -289,172 +848,283 @@ def aggregate_in_windows(data, selected_features, window, timed=False, resample=
     old_column_names = deepcopy(selected_features)
     # if the timed flag is True then timestamps are used as indices
     if timed:
-        data.set_index('date', inplace=True)
+        data = data.set_index('date')
     if not resample:
+        # the aggregated features are computed from the columns of the input dataframe (which can be a view of the
+        # flows of a trace) without modifying it
+        aggregated = {}
+        # the first row of the rolling window of each row (used by the distinct count and mode kernels)
+        starts = rolling_window_starts(data.index, window)
         for feature in old_column_names:
             # check for ports in features
             if 'port' in feature:
                 if new_features:
-                    data['unique_' + feature + 's'] = data[feature].rolling(window, min_periods=1).apply(lambda x:
-                                                                                                         len(set(x)),
-                                                                                                         raw=False)
-                    data['std_' + feature + 's'] = data[feature].rolling(window, min_periods=1).std()
+                    aggregated['unique_' + feature + 's'] = rolling_distinct_count(data[feature].values, starts)
+                    aggregated['std_' + feature + 's'] = data[feature].rolling(window, min_periods=1).std().values
                 else:
-                    data['median_' + feature] = data[feature].rolling(window, min_periods=1).median()
+                    aggregated['median_' + feature] = data[feature].rolling(window, min_periods=1).median().values
             # check for protocol
             if 'protocol_num' in feature:
-                data['argmax_protocol_num'] = data['protocol_num'].rolling(window, min_periods=1). \
-                    apply(lambda x: mode(x)[0], raw=False)
+                aggregated['argmax_protocol_num'] = rolling_mode(data['protocol_num'].values, starts)
                 if new_features:
-                    data['std_protocol_num'] = data['protocol_num'].rolling(window, min_periods=1).std()
+                    aggregated['std_protocol_num'] = data['protocol_num'].rolling(window, min_periods=1).std().values
             # check for encoding in case of discretized input
             if 'encoding' in feature:
-                data['argmax_encoding'] = data['encoding'].rolling(window, min_periods=1). \
-                    apply(lambda x: mode(x)[0], raw=False)
+                aggregated['argmax_encoding'] = rolling_mode(data['encoding'].values, starts)
                 if new_features:
-                    data['std_encoding'] = data['encoding'].rolling(window, min_periods=1).std()
+                    aggregated['std_encoding'] = data['encoding'].rolling(window, min_periods=1).std().values
             # check for duration in features
             if 'duration' in feature:
-                data['median_' + feature] = data[feature].rolling(window, min_periods=1).median()
+                aggregated['median_' + feature] = data[feature].rolling(window, min_periods=1).median().values
                 if new_features:
-                    data['std_' + feature] = data[feature].rolling(window, min_periods=1).std()
+                    aggregated['std_' + feature] = data[feature].rolling(window, min_periods=1).std().values
             # check for bytes in features
             if 'bytes' in feature:
-                data['median_' + feature] = data[feature].rolling(window, min_periods=1).median()
+                aggregated['median_' + feature] = data[feature].rolling(window, min_periods=1).median().values
                 if new_features:
-                    data['std_' + feature] = data[feature].rolling(window, min_periods=1).std()
+                    aggregated['std_' + feature] = data[feature].rolling(window, min_periods=1).std().values
             # check for destination IP in features in case new features are considered
             if 'dst_ip' in feature:
                 if new_features:
-                    data['unique_dst_ips'] = pd.DataFrame(pd.Categorical(data['dst_ip']).codes, index=data.index). \
-                        rolling(window, min_periods=1).apply(lambda x: len(set(x)), raw=False)
-        data.drop(columns=old_column_names, inplace=True)
-        data.bfill(axis='rows', inplace=True)
+                    aggregated['unique_dst_ips'] = rolling_distinct_count(pd.Categorical(data['dst_ip']).codes,
+                                                                          starts)
+        data = pd.DataFrame(aggregated, index=data.index).bfill(axis='rows')
     else:
-        # can be called only if timed flag has been set to True
-        frames = []
-        new_column_names = []
-        # check for ports in features
-        for feature in old_column_names:
-            if 'port' in feature:
-                new_column_names += (['unique' + feature + 's', 'std_' + feature + 's'] if new_features else
-                                     ['median_' + feature])
-                frames += ([data[feature].resample(window).nunique(), data[feature].resample(window).std()] if
-                           new_features else [data[feature].resample(window).median()])
-            # check for protocol
-            if 'protocol_num' in feature:
-                new_column_names += (['argmax_protocol_num', 'std_protocol_num'] if new_features else
-                                     ['argmax_protocol_num'])
-                frames += ([data['protocol_num'].resample(window).apply(lambda x: mode(x)[0]),
-                            data['protocol_num'].resample(window).std()] if new_features else
-                           [data['protocol_num'].resample(window).apply(lambda x: mode(x)[0])])
-            # check for encoding in case of discretized input
-            if 'encoding' in feature:
-                new_column_names += (['argmax_encoding', 'std_encoding'] if new_features else
-                                     ['argmax_encoding'])
-                frames += ([data['encoding'].resample(window).apply(lambda x: mode(x)[0]),
-                            data['encoding'].resample(window).std()] if new_features else
-                           [data['encoding'].resample(window).apply(lambda x: mode(x)[0])])
-            # check for duration in features
-            if 'duration' in feature:
-                new_column_names += (['median_' + feature, 'std_' + feature] if new_features else ['median_' + feature])
-                frames += ([data[feature].resample(window).median(), data[feature].resample(window).std()] if
-                           new_features else [data[feature].resample(window).median()])
-            # check for bytes in features
-            if 'bytes' in feature:
-                new_column_names += (['median_' + feature, 'std_' + feature] if new_features else ['median_' + feature])
-                frames += ([data[feature].resample(window).median(), data[feature].resample(window).std()]
-                           if new_features else [data[feature].resample(window).median()])
-            # check for destination IP in features in case new features are considered
-            if 'dst_ip' in feature:
-                if new_features:
-                    new_column_names += ['unique_dst_ips']
-                    frames += [data['dst_ip'].resample(window).nunique()]
-        data = pd.concat(frames, axis=1)
-        data.columns = new_column_names
-        data.dropna(inplace=True)
-        # handle the case of discretized data in which the dropna is not sufficient by itself
-        if len(new_column_names) == 1:
-            data = data[data.astype(str)[new_column_names[0]] != '[]']
+        # can be called only if timed flag has been set to True (all the statistics are computed in one resampling)
+        data = drop_incomplete_aggregates(aggregate_groups(data, pd.Grouper(freq=window),
+                                                           aggregation_specs(old_column_names, new_features)))
     return data
 
 
-def aggregate_static(data, selected_features, window, new_features=True):
+def aggregation_specs(selected_features, new_features=True):
     """
-    Function for aggregating specific features of a dataframe in static non-timed windows of length window
+    Function for finding the aggregated features computed in static and resampling windows for the selected features.
     Currently the following features are taken into account: source port, destination ip/port, originator's bytes,
     responder's bytes, duration, and protocol
-    :param data: the input dataframe
-    :param selected_features: the features that are contained in the dataframe (this value is passed even if it can be
-    inferred by the columns of the dataframe for ordering purposes between different runs of the function)
-    :param window: the window length
+    :param selected_features: the features that are contained in the dataframe
     :param new_features: boolean flag specifying if new features should be added to the existing ones
-    :return: a dataframe with the aggregated features
+    :return: a list of (aggregated feature name, feature, statistic) tuples in the order of the aggregated features
     """
-    old_column_names = deepcopy(selected_features)
-    # can be called only if timed flag has been set to True
-    frames = []
-    new_column_names = []
-    # check for ports in features
-    for feature in old_column_names:
+    specs = []
+    for feature in selected_features:
+        # check for ports in features
         if 'port' in feature:
-            new_column_names += (['unique' + feature + 's', 'std_' + feature + 's'] if new_features else
-                                 ['median_' + feature])
-            frames += ([data[feature].groupby(data.index // window).nunique(),
-                        data[feature].groupby(data.index // window).std()] if
-                       new_features else [data[feature].groupby(data.index // window).median()])
+            specs += ([('unique' + feature + 's', feature, 'nunique'), ('std_' + feature + 's', feature, 'std')] if
+                      new_features else [('median_' + feature, feature, 'median')])
         # check for protocol
         if 'protocol_num' in feature:
-            new_column_names += (['argmax_protocol_num', 'std_protocol_num'] if new_features else
-                                 ['argmax_protocol_num'])
-            frames += ([data['protocol_num'].groupby(data.index // window).apply(lambda x: mode(x)[0][0]),
-                        data['protocol_num'].groupby(data.index // window).std()] if new_features else
-                       [data['protocol_num'].groupby(data.index // window).apply(lambda x: mode(x)[0][0])])
+            specs += [('argmax_protocol_num', 'protocol_num', 'mode')] + \
+                     ([('std_protocol_num', 'protocol_num', 'std')] if new_features else [])
         # check for encoding in case of discretized input
         if 'encoding' in feature:
-            new_column_names += (['argmax_encoding', 'std_encoding'] if new_features else
-                                 ['argmax_encoding'])
-            frames += ([data['encoding'].groupby(data.index // window).apply(lambda x: mode(x)[0][0]),
-                        data['encoding'].groupby(data.index // window).std()] if new_features else
-                       [data['encoding'].groupby(data.index // window).apply(lambda x: mode(x)[0][0])])
-        # check for duration in features
-        if 'duration' in feature:
-            new_column_names += (['median_' + feature, 'std_' + feature] if new_features else ['median_' + feature])
-            frames += ([data[feature].groupby(data.index // window).median(),
-                        data[feature].groupby(data.index // window).std()] if
-                       new_features else [data[feature].groupby(data.index // window).median()])
-        # check for bytes in features
-        if 'bytes' in feature:
-            new_column_names += (['median_' + feature, 'std_' + feature] if new_features else ['median_' + feature])
-            frames += ([data[feature].groupby(data.index // window).median(),
-                        data[feature].groupby(data.index // window).std()]
-                       if new_features else [data[feature].groupby(data.index // window).median()])
+            specs += [('argmax_encoding', 'encoding', 'mode')] + ([('std_encoding', 'encoding', 'std')] if
+                                                                  new_features else [])
+        # check for duration and bytes in features
+        if 'duration' in feature or 'bytes' in feature:
+            specs += [('median_' + feature, feature, 'median')] + ([('std_' + feature, feature, 'std')] if
+                                                                   new_features else [])
         # check for destination IP in features in case new features are considered
-        if 'dst_ip' in feature:
-            if new_features:
-                new_column_names += ['unique_dst_ips']
-                frames += [data['dst_ip'].groupby(data.index // window).nunique()]
-    data = pd.concat(frames, axis=1)
-    data.columns = new_column_names
-    data.dropna(inplace=True)
+        if 'dst_ip' in feature and new_features:
+            specs += [('unique_dst_ips', 'dst_ip', 'nunique')]
+    return specs
+
+
+def grouped_mode(values, group_ids, num_groups):
+    """
+    Function for finding the most frequent value of each group (the smallest one in case of ties, as in
+    scipy.stats.mode) without a Python call per group. For small value domains the values of each group are counted
+    with a single bincount, otherwise the (group, value) pairs are counted after sorting
+    :param values: the values of the rows
+    :param group_ids: the group (0 to num_groups - 1) of each row
+    :param num_groups: the number of groups
+    :return: a numpy array with the most frequent value of each group (NaN for empty groups)
+    """
+    uniques, codes = np.unique(np.asarray(values), return_inverse=True)
+    codes = codes.ravel()
+    modes = np.full(num_groups, np.nan)
+    if num_groups * len(uniques) <= 10 ** 7:
+        counts = np.bincount(group_ids * len(uniques) + codes, minlength=num_groups * len(uniques)).reshape(
+            num_groups, len(uniques))
+        # argmax returns the first (smallest) value of the highest count
+        found = counts.max(axis=1) > 0
+        modes[found] = uniques[counts.argmax(axis=1)[found]]
+    else:
+        pairs, counts = np.unique(group_ids.astype(np.int64) * len(uniques) + codes, return_counts=True)
+        groups, codes = pairs // len(uniques), pairs % len(uniques)
+        # sort by group, decreasing count, and increasing value, and keep the first pair of each group
+        order = np.lexsort((codes, -counts, groups))
+        first = order[np.concatenate(([True], groups[order][1:] != groups[order][:-1]))]
+        modes[groups[first]] = uniques[codes[first]]
+    return modes
+
+
+def grouped_nunique(values, group_ids, num_groups):
+    """
+    Function for counting the distinct (non-missing) values of each group by counting the distinct (group, value) pairs
+    once, instead of finding the distinct values of each group separately
+    :param values: the values of the rows
+    :param group_ids: the group (0 to num_groups - 1) of each row
+    :param num_groups: the number of groups
+    :return: a numpy array with the number of distinct values of each group
+    """
+    codes, uniques = pd.factorize(values)
+    present = codes >= 0
+    pairs = np.unique(group_ids[present].astype(np.int64) * max(len(uniques), 1) + codes[present])
+    return np.bincount(pairs // max(len(uniques), 1), minlength=num_groups)
+
+
+def aggregate_groups(data, group_keys, specs):
+    """
+    Function for computing all the aggregated features of the given specs in a single grouping of the data. Each of the
+    median and std statistics is computed for all of its features at once, while the nunique and mode statistics are
+    computed by the grouped_nunique and grouped_mode functions
+    :param data: the input dataframe
+    :param group_keys: the group key of each row (a grouper accepted by the groupby function)
+    :param specs: a list of (aggregated feature name, feature, statistic) tuples as returned by aggregation_specs
+    :return: a dataframe with the aggregated features of each group
+    """
+    grouped = data.groupby(group_keys)
+    aggregated = {}
+    # each statistic is computed for all of its features in one call
+    for statistic in ['median', 'std']:
+        features = list(dict.fromkeys(feature for _, feature, stat in specs if stat == statistic))
+        if len(features):
+            values = getattr(grouped[features], statistic)()
+            aggregated.update({name: values[feature].values for name, feature, stat in specs if stat == statistic})
+    # the group of each row in the order of the aggregated groups
+    group_ids = grouped.ngroup().values
+    for name, feature, statistic in specs:
+        if statistic == 'nunique':
+            aggregated[name] = grouped_nunique(data[feature].values, group_ids, grouped.ngroups)
+        elif statistic == 'mode':
+            aggregated[name] = grouped_mode(data[feature].values, group_ids, grouped.ngroups)
+    return pd.DataFrame({name: aggregated[name] for name, _, _ in specs}, index=grouped.size().index)
+
+
+def window_aggregates(data, keys, aggregated, specs, lo, hi):
+    """
+    Function for retrieving the aggregated records of the rows in positions [lo, hi) of the data from the aggregated
+    records of all the groups of the data (computed once with the aggregate_groups function), instead of aggregating
+    the rows of each window again. The groups at the edges of the range that contain also rows outside of it are
+    aggregated again from the rows in the range, so that the result is the same as aggregating only the rows of the
+    range
+    :param data: the input dataframe
+    :param keys: the numpy array with the sorted group key of each row
+    :param aggregated: the dataframe with the aggregated features of all the groups
+    :param specs: a list of (aggregated feature name, feature, statistic) tuples as returned by aggregation_specs
+    :param lo: the first position of the range
+    :param hi: the position after the last row of the range
+    :return: a dataframe with the aggregated features of the groups of the range
+    """
+    edges = []
+    num_first = 0
+    # the first group of the range starts before it
+    if lo > 0 and keys[lo - 1] == keys[lo]:
+        split = min(keys.searchsorted(keys[lo], side='right'), hi)
+        edges += [np.arange(lo, split)]
+        num_first = 1
+        lo = split
+    # the last group of the range ends after it
+    if lo < hi < len(keys) and keys[hi] == keys[hi - 1]:
+        split = max(keys.searchsorted(keys[hi - 1], side='left'), lo)
+        edges += [np.arange(split, hi)]
+        hi = split
+    parts = [aggregated.loc[keys[lo]:keys[hi - 1]]] if lo < hi else []
+    if len(edges):
+        # both edge groups are aggregated in one grouping
+        rows = np.concatenate(edges)
+        edges = aggregate_groups(data.iloc[rows], keys[rows], specs)
+        parts = [edges.iloc[:num_first]] + parts + [edges.iloc[num_first:]]
+    return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+
+def drop_incomplete_aggregates(data):
+    """
+    Function for removing the aggregated records with missing values (e.g. windows with a single flow, in which the std
+    is not defined, or empty resampling windows)
+    :param data: the dataframe with the aggregated features
+    :return: the dataframe with the complete aggregated records
+    """
+    data = data.dropna()
     # handle the case of discretized data in which the dropna is not sufficient by itself
-    if len(new_column_names) == 1:
-        data = data[data.astype(str)[new_column_names[0]] != '[]']
+    if data.shape[1] == 1:
+        data = data[data.astype(str)[data.columns[0]] != '[]']
     return data
 
 
-def extract_traces_from_window(data, selected, window, stride, trace_limits, total, progress_list,
-                               dynamic=True, aggregation=False, resample=False, new_features=True):
+def aggregate_static(data, selected_features, window, new_features=True):
     """
-    Function for extracting traces from the imput dataframe. The features to be taken into account are provided in the
-    selected list. Each trace is extracted by rolling a window of window seconds in the input data with a stride of
-    stride seconds. If dynamic flag is set to True, then a dynamically changing window is used instead. If aggregation
-    flag is set to True, then aggregation windows are created in each rolling window. If resample flag is set to True,
-    then instead of a rolling window a resampling one is used during aggregation. If new_features is set to True, then
-    in each aggregation windows are used, instead of creating new features only an aggregated view of the existing ones
-    is maintained.
+    Function for aggregating specific features of a dataframe in static non-timed windows of length window
+    Currently the following features are taken into account: source port, destination ip/port, originator's bytes,
+    responder's bytes, duration, and protocol
+    :param data: the input dataframe
+    :param selected_features: the features that are contained in the dataframe (this value is passed even if it can be
+    inferred by the columns of the dataframe for ordering purposes between different runs of the function)
+    :param window: the window length
+    :param new_features: boolean flag specifying if new features should be added to the existing ones
+    :return: a dataframe with the aggregated features
+    """
+    # all the statistics are computed in one grouping of the rows in blocks of window rows
+    return drop_incomplete_aggregates(aggregate_groups(data, data.index // window,
+                                                       aggregation_specs(selected_features, new_features)))
+
+
+def resample_aggregates(data, selected_features, window, new_features=True):
+    """
+    Function for aggregating the features of the whole dataframe in resampling windows of length window once, so that
+    the aggregated records of each trace can be retrieved by the window_aggregates function instead of resampling the
+    flows of every (overlapping) trace again. The resampling windows of a trace start at the midnight of its first flow,
+    so they are the same for all the traces only if the window length divides a day
+    :param data: the input dataframe (with the timestamps in the date column)
+    :param selected_features: the features that are contained in the dataframe
+    :param window: the resampling window length
+    :param new_features: boolean flag specifying if new features should be added to the existing ones
+    :return: the resampling window of each flow, the dataframe with the aggregated features of the non-empty resampling
+    windows, and the aggregation specs, or None if the resampling windows cannot be shared by the traces
+    """
+    if pd.Timedelta(days=1) % pd.to_timedelta(window) != pd.Timedelta(0):
+        return None
+    keys = data['date'].dt.floor(window).values
+    specs = aggregation_specs(selected_features, new_features)
+    return keys, aggregate_groups(data, keys, specs), specs
+
+
+def aggregate_trace(features, lo, hi, resample=False, new_features=True, shared=None):
+    """
+    Function for creating the aggregated records of the trace of the flows in positions [lo, hi) of the feature matrix
+    of an entity. The flows of the trace are taken as a view of the matrix, which is not modified by the aggregation
+    :param features: the dataframe with the selected features of the flows
+    :param lo: the first position of the trace
+    :param hi: the position after the last flow of the trace
+    :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
+    :param new_features: boolean flag specifying if new features should be added to the existing ones
+    :param shared: the aggregated records shared by the traces (if available), i.e. the output of the
+    resample_aggregates function for the whole dataframe in case of resampling, or the dataframe with the rolling
+    aggregated features of all the flows of the dataframe otherwise
+    :return: a dataframe with the aggregated records of the trace
+    """
+    if shared is not None:
+        if not resample:
+            return shared.iloc[lo:hi]
+        keys, aggregated, specs = shared
+        return drop_incomplete_aggregates(window_aggregates(features, keys, aggregated, specs, lo, hi))
+    # this checks also if the window is big enough. If not then it sets the aggregation window to 1/5 of the window
+    # aggregation_length = min(Timedelta(seconds=5), (min(end_date, data['date'].iloc[-1])-start_date)/5) \
+    #     if resample else min(10, int(len(windowed_data.index)))
+    aggregation_length = '5S' if resample else min(10, hi - lo)  # old version
+    timed = True if resample else False
+    return aggregate_in_windows(features.iloc[lo:hi], list(features.columns), aggregation_length, timed, resample,
+                                new_features)
+
+
+def extract_traces_from_window(data, window, stride, trace_limits, total, progress_list, dynamic=True):
+    """
+    Function for extracting traces from the imput dataframe. Each trace is extracted by rolling a window of window
+    seconds in the input data with a stride of stride seconds. If dynamic flag is set to True, then a dynamically
+    changing window is used instead. Each trace is returned as the range of the positions of its flows in the
+    dataframe, so that its records can be taken as a view of the feature matrix of the flows (see the TraceWriter class
+    and the write_window_traces function).
     :param data: the input dataframe
-    :param selected: the features to be used
     :param window: the window size
     :param stride: the stride size
     :param trace_limits: a tuple containing the minimum and maximum length that a trace can have
@@ -462,21 +1132,19 @@ def extract_traces_from_window(data, selected, window, stride, trace_limits, tot
     :param progress_list: list with the progress in processing the original dataframe (for progress visualization
     purposes)
     :param dynamic: boolean flag about the use of dynamically changing windows
-    :param aggregation: the aggregation flag - if set to True, then aggregation windows are created
-    :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
-    :param new_features: boolean flag specifying if new features should be added to the existing ones
-    :return: the traces extracted in a list, the indices of each trace in a list, and the number of features extracted
+    :return: a generator yielding each trace as soon as it is extracted, as a tuple with the first position of its
+    flows and the position after its last flow
     """
 
     # create an anonymous function for increasing timestamps given the type of the window (int or Timedelta)
     time_inc = lambda x, w: x + DateOffset(seconds=w) if type(window) == int else x + w
-    # obtain the indices residing in the processed data
-    data_indices = data.index.tolist()
+    # obtain the indices residing in the processed data and the sorted dates used for finding the window limits
+    data_indices = data.index
+    dates = data['date'].values
+    last_date = data['date'].iloc[-1]
     # set the initial start and end dates, as well as the empty traces' list and the window limits
     start_date = data['date'].iloc[0]
     end_date = time_inc(start_date, window)
-    traces = []  # list of lists
-    traces_indices = []  # list of lists for storing the indices of the flows contained in each trace
     # the minimum and maximum indices of the time window under consideration
     # two values are used for the indices of two consecutive windows
     min_idx = [-2, -1]
@@ -485,138 +1153,84 @@ def extract_traces_from_window(data, selected, window, stride, trace_limits, tot
     cnt = 0
     # extract the traces' limits
     min_trace_length, max_trace_length = trace_limits
-    # create a dict for testing if all the flows have been included in the traces
-    assertion_dict = dict(zip(data_indices, len(data_indices) * [False]))
-    # keep a copy of the actually selected features in case aggregation is used
-    old_selected = deepcopy(selected)
-    # keep also a variable of the number of features to be used for the model creation
-    num_of_features = len(selected)
+    # create an array for testing if all the flows have been included in the traces
+    covered = np.zeros(len(data_indices), dtype=bool)
     # one-time flag for the case that the first time window is proven to be too large
     first_large = True
     # iterate through the input dataframe until the end date is greater than the last date recorded
-    while end_date < data['date'].iloc[-1]:
-        # retrieve the window of interest
-        time_mask = calculate_window_mask(data, start_date, end_date)
-        windowed_data = data[time_mask]
-        window_len = len(windowed_data.index.tolist())
+    while end_date < last_date:
+        # retrieve the window of interest as the range of positions [lo, hi) of its flows
+        lo, hi = find_window_range(dates, start_date, end_date)
+        window_len = hi - lo
         # if there is at least one record in the window
         if window_len != 0:
             if dynamic:
                 # store the minimum and maximum indices of the time window to evaluate how much it moved
                 if min_idx[0] == -2:  # the case of the first recorded time window
-                    min_idx[0] = data.index[time_mask].tolist()[0]
-                    max_idx[0] = data.index[time_mask].tolist()[-1]
+                    min_idx[0] = data_indices[lo]
+                    max_idx[0] = data_indices[hi - 1]
                 elif min_idx[1] == -1:  # the case of the second recorded time window
-                    min_idx[1] = data.index[time_mask].tolist()[0]
-                    max_idx[1] = data.index[time_mask].tolist()[-1]
+                    min_idx[1] = data_indices[lo]
+                    max_idx[1] = data_indices[hi - 1]
                 else:  # otherwise update the previous values and add the new ones
-                    min_idx[0] = deepcopy(min_idx[1])
-                    max_idx[0] = deepcopy(max_idx[1])
-                    min_idx[1] = data.index[time_mask].tolist()[0]
-                    max_idx[1] = data.index[time_mask].tolist()[-1]
+                    min_idx[0] = min_idx[1]
+                    max_idx[0] = max_idx[1]
+                    min_idx[1] = data_indices[lo]
+                    max_idx[1] = data_indices[hi - 1]
 
                 # first check if the time window captured new information
                 while min_idx[0] == min_idx[1] and max_idx[0] == max_idx[1]:
                     print('-------------- No change between traces ==> Increasing the stride... --------------')
                     start_date = time_inc(start_date, stride)
                     end_date = time_inc(start_date, window)
-                    time_mask = calculate_window_mask(data, start_date, end_date)
-                    window_len = len(data[time_mask].index.tolist())
+                    lo, hi = find_window_range(dates, start_date, end_date)
+                    window_len = hi - lo
                     # if the new window is empty or we have surpassed the next unseen flow, the next window is set to
                     # start at the timestamp of this unseen flow
-                    if window_len == 0 or data.index[time_mask].tolist()[0] > max_idx[1] + 1:
+                    if window_len == 0 or data_indices[lo] > max_idx[1] + 1:
                         start_date = data['date'].loc[max_idx[1] + 1]
                         end_date = time_inc(start_date, window)
-                        time_mask = calculate_window_mask(data, start_date, end_date)
-                        window_len = len(data[time_mask].index.tolist())
+                        lo, hi = find_window_range(dates, start_date, end_date)
+                        window_len = hi - lo
                     # set the updated indices
-                    min_idx[1] = data.index[time_mask].tolist()[0]
-                    max_idx[1] = data.index[time_mask].tolist()[-1]
+                    min_idx[1] = data_indices[lo]
+                    max_idx[1] = data_indices[hi - 1]
                     # and increase the stride in case we still haven't captured new information
                     if min_idx[0] == min_idx[1] and max_idx[0] == max_idx[1]:
                         stride *= 2
                         if stride >= window:
                             window = stride * 5
 
-                # set the parameters for the length adjustment process of each trace
-                init_magnifier = 2
-                magnifier = 2
-                reducer = 0.05
-                # check that the trace length conforms to the specified limits
-                while window_len < min_trace_length or window_len > max_trace_length:
-                    # first check the case of a very large window
-                    while window_len > max_trace_length:
-                        print('-------------- Too many flows in the trace ==> Reducing time window... --------------')
-                        window /= magnifier
-                        if stride >= window:
-                            stride = window / 5
-                        end_date = time_inc(start_date, window)
-                        time_mask = calculate_window_mask(data, start_date, end_date)
-                        window_len = len(data[time_mask].index.tolist())
-
-                    # then check the case of a very small window
-                    while window_len < min_trace_length:
-                        print('-------------- Too few flows in the trace ==> Increasing time window... --------------')
-                        window *= magnifier
-                        end_date = time_inc(start_date, window)
-                        time_mask = calculate_window_mask(data, start_date, end_date)
-                        window_len = len(data[time_mask].index.tolist())
-                        # limit case to prevent integer overflow in the window size
-                        if end_date > data['date'].iloc[-1]:
-                            break
+                # check that the trace length conforms to the specified limits, and otherwise set the window to the
+                # nearest one starting at the start date that conforms to them
+                if window_len < min_trace_length or window_len > max_trace_length:
+                    print('-------------- Trace length out of limits ==> Fitting time window... --------------')
+                    window = fit_window(dates, lo, start_date, window_len, trace_limits)
+                    if stride >= window:
+                        stride = window / 5
+                    end_date = time_inc(start_date, window)
+                    lo, hi = find_window_range(dates, start_date, end_date)
+                    window_len = hi - lo
 
                     # and update the window indices
                     if first_large:
-                        min_idx[0] = data.index[time_mask].tolist()[0]
-                        max_idx[0] = data.index[time_mask].tolist()[-1]
+                        min_idx[0] = data_indices[lo]
+                        max_idx[0] = data_indices[hi - 1]
                     else:
-                        min_idx[1] = data.index[time_mask].tolist()[0]
-                        max_idx[1] = data.index[time_mask].tolist()[-1]
-
-                    # update the magnifier in case more iterations are needed due to fluctuations
-                    magnifier -= reducer
-                    magnifier = round(magnifier, len(str(reducer).split('.')[1]))
-                    # in case that the fluctuations cannot be dealt with the current values, refine them and start over
-                    if magnifier <= 1:
-                        magnifier = init_magnifier + 1
-                        reducer = reducer / 2
-                    # limit case to prevent endless loop
-                    if end_date > data['date'].iloc[-1]:
-                        break
+                        min_idx[1] = data_indices[lo]
+                        max_idx[1] = data_indices[hi - 1]
 
                 # set the one-time flag of the first window to False
                 first_large = False
-                # finally get the current window
-                windowed_data = data[time_mask]
 
-            # insert the indices of the current trace to the assertion dictionary
-            assertion_dict.update(zip(data.index[time_mask].tolist(), len(data.index[time_mask].tolist()) * [True]))
+            # mark the flows of the current window as included in the traces
+            covered[lo:hi] = True
 
-            # create aggregated features if needed (currently with a hard-coded window length)
-            if aggregation:
-                # this checks also if the window is big enough. If not then it sets the aggregation window to 1/5 of
-                # the window
-                # aggregation_length = min(Timedelta(seconds=5), (min(end_date, data['date'].iloc[-1])-start_date)/5) \
-                #     if resample else min(10, int(len(windowed_data.index)))
-                aggregation_length = '5S' if resample else min(10, int(len(windowed_data.index))) # old version
-                timed = True if resample else False
-                windowed_data = aggregate_in_windows(windowed_data[selected].copy(deep=True), selected,
-                                                     aggregation_length, timed, resample, new_features)
-                selected = windowed_data.columns.values
-                num_of_features = len(selected)
-
-            # extract the trace of this window and add it to the traces' list
-            ints = False if (aggregation and 'encoding' not in old_selected) or 'duration' in old_selected else True
-            # this case applies only on resampling in case there are no more than 1 flow per resampling window
-            if windowed_data.shape[0] != 0:
-                traces += [convert2flexfringe_format(windowed_data[selected], ints)]
-            selected = deepcopy(old_selected)
-            # store also the flow indices of the current time window
-            if windowed_data.shape[0] != 0:  # this case applies only on resampling as explained above
-                traces_indices += [windowed_data.index.tolist()]
+            # the trace of this window is the range of its flows
+            yield lo, hi
 
             # update the progress variable
-            cnt = data.index[time_mask].tolist()[-1]
+            cnt = data_indices[hi - 1]
 
             # increment the window limits
             start_date = time_inc(start_date, stride)
@@ -650,11 +1264,10 @@ def extract_traces_from_window(data, selected, window, stride, trace_limits, tot
             print('More than ' + str((prog // 10) * 10) + '% of the data processed...')
 
     # addition of the last flows in the dataframe in case they weren't added
-    if not all(list(assertion_dict.values())):
-        time_mask = calculate_window_mask(data, start_date, end_date)
-        windowed_data = data[time_mask]
+    if not covered.all():
+        lo, hi = find_window_range(dates, start_date, end_date)
         # in case that the start date is also greater than the last seen flow then set the start date appropriately
-        if windowed_data.index.tolist()[0] > max_idx[1] + 1:
+        if hi == lo or data_indices[lo] > max_idx[1] + 1:
             if max_idx[1] < 0:
                 if max_idx[0] < 0:
                     start_date = data['date'].iloc[0]
@@ -662,43 +1275,204 @@ def extract_traces_from_window(data, selected, window, stride, trace_limits, tot
                     start_date = data['date'].loc[max_idx[0] + 1]
             else:
                 start_date = data['date'].loc[max_idx[1] + 1]
-            time_mask = calculate_window_mask(data, start_date, end_date)
-            windowed_data = data[time_mask]
-        # update the assertion dictionary
-        assertion_dict.update(zip(data.index[time_mask].tolist(), len(data.index[time_mask].tolist()) * [True]))
-        # check for aggregation
-        if aggregation:
-            # this checks also if the window is big enough. If not then it sets the aggregation window to 1/5 of
-            # the window
-            # aggregation_length = min(Timedelta(seconds=5), (min(end_date, data['date'].iloc[-1]) - start_date) / 5) \
-            #     if resample else min(10, int(len(windowed_data.index)))
-            aggregation_length = '5S' if resample else min(10, int(len(windowed_data.index))) # old version
-            timed = True if resample else False
-            windowed_data = aggregate_in_windows(windowed_data[selected].copy(deep=True), selected, aggregation_length,
-                                                 timed, resample, new_features)
-            selected = windowed_data.columns.values
-            num_of_features = len(selected)
+            lo, hi = find_window_range(dates, start_date, end_date)
+        # update the covered flows
+        covered[lo:hi] = True
         # and add the new trace
-        ints = False if (aggregation and 'encoding' not in old_selected) or 'duration' in old_selected else True
-        if windowed_data.shape[0] != 0:  # for the resampling case
-            traces += [convert2flexfringe_format(windowed_data[selected], ints)]
-        # store also the starting and the ending index of the current time window
-        if windowed_data.shape[0] != 0:  # for the resampling case
-            traces_indices += [windowed_data.index.tolist()]
+        if hi != lo:
+            yield lo, hi
 
     # evaluate correctness of the process
-    if not all(list(assertion_dict.values())):
+    if not covered.all():
         print('There are flows missed in the current high level window -- Check again the implementation!!!')
-        print([k for k, v in assertion_dict.items() if not v], file=sys.stderr)
+        print(data_indices[~covered].tolist(), file=sys.stderr)
 
     else:
         print('All flows correctly converted to traces in the current high level window!!!')
 
-    return traces, traces_indices, num_of_features
+
+def write_window_traces(writer, data, selected, windows, start=0, aggregation=False, resample=False,
+                        new_features=True, shared_rolling=False):
+    """
+    Function for writing the traces of a high-level window given the range of the positions of the flows of each trace.
+    Without aggregation each trace is written as a range of rows of the feature matrix of the writer (in which the
+    high-level window starts at row start), otherwise the aggregated records of each trace are computed from a view of
+    the selected features of its flows
+    :param writer: the TraceWriter of the traces' file
+    :param data: the dataframe of the high-level window
+    :param selected: the features to be used
+    :param windows: an iterable with the first position of the flows of each trace in the high-level window and the
+    position after its last flow (as yielded by the extract_traces_from_window function)
+    :param start: the position of the first flow of the high-level window in the feature matrix of the writer
+    :param aggregation: the aggregation flag - if set to True, then aggregation windows are created
+    :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
+    :param new_features: boolean flag specifying if new features should be added to the existing ones
+    :param shared_rolling: boolean flag specifying if the rolling aggregation windows should be computed once for all
+    the flows of the dataframe and shared by the traces (see the extract_traces function)
+    :return: the number of features of the records of the traces
+    """
+    num_of_features = len(selected)
+    if not aggregation:
+        for lo, hi in windows:
+            writer.write(start + lo, start + hi)
+        return num_of_features
+    # the feature matrix of the flows, of which each trace takes a view
+    features = data[selected]
+    # check if the records of the traces contain only int values
+    ints = False if 'encoding' not in selected or 'duration' in selected else True
+    # the resampling windows of all the flows are aggregated once and shared by the (overlapping) traces, and the same
+    # holds for the rolling windows if requested (with windows of 10 flows as the ones of traces of at least 10 flows)
+    shared = None
+    if resample:
+        shared = resample_aggregates(features, selected, '5S', new_features)
+    elif shared_rolling:
+        shared = aggregate_in_windows(features, selected, 10, False, False, new_features)
+    for lo, hi in windows:
+        windowed_data = aggregate_trace(features, lo, hi, resample, new_features, shared)
+        num_of_features = windowed_data.shape[1]
+        # this case applies only on resampling in case there are no more than 1 flow per resampling window
+        if windowed_data.shape[0] != 0:
+            writer.write_records(format_records(windowed_data.to_numpy(), ints), windowed_data.index)
+    return num_of_features
+
+
+def high_level_windows(data, bounds):
+    """
+    Function for setting the windowing variables of the high-level windows of the flows. The high-level windows are
+    returned one at a time, so that the flows of each one are taken from the dataframe only once it is processed
+    :param data: the input dataframe
+    :param bounds: the list with the first position of each high-level window followed by the number of flows
+    :return: a generator yielding for each high-level window a tuple with its first position, its dataframe, the window
+    and stride sizes, the trace limits, and the progress already shown when its processing starts
+    """
+    for starting_index, index in zip(bounds[:-1], bounds[1:]):
+        windowed_data = data.iloc[starting_index:index]
+        window, stride = set_windowing_vars(windowed_data)
+        # special handle in case a zero length window has been returned
+        if window.total_seconds() == 0:
+            window = pd.to_timedelta('25ms')
+            stride = pd.to_timedelta('5ms')
+        min_trace_len = int(max(windowed_data.shape[0] / 10000, 10))
+        max_trace_len = int(max(windowed_data.shape[0] / 100, 1500))
+        if windowed_data.shape[0] < min_trace_len:
+            min_trace_len = windowed_data.shape[0]
+        if max_trace_len > 1500:
+            max_trace_len = 1500
+        progress = list(range(1, int((max(starting_index - 1, 0) / data.shape[0]) * 100) // 10 + 1))
+        yield starting_index, windowed_data, window, stride, (min_trace_len, max_trace_len), progress
+
+
+def window_part_filepath(out_filepath, starting_index):
+    """
+    Function for finding the filepath of the traces of a high-level window extracted in a worker process
+    :param out_filepath: the filepath of the traces' file
+    :param starting_index: the first position of the high-level window
+    :return: the filepath of the traces of the high-level window
+    """
+    return '.'.join(out_filepath.split('.')[:-1]) + '_window' + str(starting_index) + '.' + out_filepath.split('.')[-1]
+
+
+def extract_window_traces(task):
+    """
+    Function for extracting the traces of a high-level window in a worker process. The traces are streamed to the files
+    of a separate TraceWriter as they are extracted, and only the number of the traces is returned, so that the calling
+    process appends them to the traces of the entity (see the TraceWriter.append method). The output of the extraction
+    (e.g. the progress) is shown by the worker itself
+    :param task: a tuple with the filepath of the traces of the high-level window, the alphabet size, the total number
+    of flows, the dynamic flag, the keyword arguments of the write_window_traces function, and the selected features
+    followed by the output of the high_level_windows function for the high-level window
+    :return: the filepath of the traces of the high-level window, the number of its traces, and the number of features
+    """
+    part_filepath, alphabet_size, total, dynamic, kwargs, selected, (_, data, window, stride, trace_limits,
+                                                                     progress) = task
+    # each line of the output is shown as soon as it is printed, without being mixed with the output of other workers
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(line_buffering=True, write_through=False)
+    writer = TraceWriter(part_filepath, alphabet_size)
+    try:
+        if not kwargs['aggregation']:
+            writer.set_records(data[selected].to_numpy(), data.index, False if 'duration' in selected else True)
+        windows = extract_traces_from_window(data, window, stride, trace_limits, total, progress, dynamic=dynamic)
+        num_of_features = write_window_traces(writer, data, selected, windows, **kwargs)
+    finally:
+        num_of_traces = writer.close_part()
+    return part_filepath, num_of_traces, num_of_features
+
+
+def flow_count_windows(num_of_flows, window=100, stride=20):
+    """
+    Function for finding at once all the non-timed windows of window flows rolled with a stride of stride flows over
+    the flows, instead of stepping through the flows window by window. The windows starting less than window flows
+    before the last flow are shortened to end at the last flow
+    :param num_of_flows: the number of flows
+    :param window: the number of flows of each window
+    :param stride: the stride (in number of flows) of the windows
+    :return: two numpy arrays with the position of the first flow and the position after the last flow of each window
+    """
+    starts = np.arange(0, num_of_flows, stride)
+    return starts, np.minimum(starts + window, num_of_flows)
+
+
+def window_settings(window_type):
+    """
+    Function for translating the type of window used for trace extraction to the flags of the extract_traces function.
+    :param window_type: the type of the window (0: non-timed | 1: static-timed | 2: dynamic-timed)
+    :return: the timed and dynamic flags, and the suffix added to the name of the traces' file
+    """
+    dynamic = window_type == 2
+    timed = bool(window_type)
+    # if static windows are used add it to the naming of the tracefile
+    timed_name = ''
+    if not timed:
+        timed_name = '_static'
+    elif not dynamic:
+        timed_name = '_static_timed'
+    return timed, dynamic, timed_name
+
+
+def aggregation_features(selected, host_level, resample):
+    """
+    Function for adding to the selected features the ones needed when aggregation windows are used.
+    :param selected: the features to be used
+    :param host_level: boolean flag showing if host level analysis is conducted
+    :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
+    :return: the features to be used by the aggregation windows
+    """
+    # add also the destination ip in case of host level aggregation (and the date in case of resampling)
+    if host_level:
+        return selected + (['dst_ip'] if not resample else ['dst_ip', 'date'])
+    return selected + (['date'] if resample else [])
+
+
+def build_traces_filepath(dataset_filepath, stage, analysis_type, selected, instance_name, aggregation=False,
+                          resample=False, new_features=True, bidirectional=False, timed_name=''):
+    """
+    Function for building the filepath of the traces' file of a network entity. The file is stored in the <stage>
+    directory of the dataset, under the directory of the analysis type and the selected features.
+    :param dataset_filepath: the relative path of the dataset's flows (e.g. Datasets/CTU13/scenario3)
+    :param stage: the stage for which the traces are extracted ('training' | 'test')
+    :param analysis_type: the type of the analysis ('host_level' | 'connection_level')
+    :param selected: the features to be used
+    :param instance_name: the name of the network entity
+    :param aggregation: the aggregation flag - if set to True, then aggregation windows are used
+    :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
+    :param new_features: boolean flag specifying if new features are added to the existing ones
+    :param bidirectional: boolean flag showing if the flows of both directions are used
+    :param timed_name: the suffix showing the type of the window used
+    :return: the filepath of the traces' file
+    """
+    if not aggregation:
+        traces_name = '-traces'
+    else:
+        traces_name = ('-traces_resampled' if resample else '-traces_aggregated') + ('' if new_features else '_reduced')
+    return '/'.join(dataset_filepath.split('/')[0:2]) + '/' + stage + '/' + analysis_type + '/' + '_'.join(selected) + \
+        '/' + dataset_filepath.split('/')[2] + '-' + instance_name + traces_name + ('_bdr' if bidirectional else '') + \
+        timed_name + '.txt'
 
 
 def extract_traces(data, out_filepath, selected, alphabet_size, timed=True, dynamic=True, aggregation=False,
-                   resample=False, new_features=True):
+                   resample=False, new_features=True, shared_rolling=False, pool=None, flow_window=100,
+                   flow_stride=20):
     """
     Function for extracting traces from the given dataset by first applying a high-level filtering to find windows of
     significant time difference between them to be processed separately by the extract_traces_from_window function. The
@@ -712,131 +1486,99 @@ def extract_traces(data, out_filepath, selected, alphabet_size, timed=True, dyna
     :param aggregation: the aggregation flag - if set to True, then aggregation windows are created
     :param resample: the resampling flag - if set to True, then resampling is used in the aggregation windows
     :param new_features: boolean flag specifying if new features should be added to the existing ones
+    :param shared_rolling: boolean flag specifying if the rolling aggregation windows (timed windows without
+    resampling) should be computed once for all the flows of each high-level window and sliced for each trace, instead
+    of being computed again for every (overlapping) trace. The records of a trace are then the same, apart from its
+    first 9 records (and all the records of traces with less than 10 flows), whose aggregation windows contain also the
+    flows preceding the trace instead of only the first flows of the trace, and of the rolling stds, which may differ
+    in their last digits (relative difference in the order of 1e-12) since the rolling computation starts earlier
+    :param pool: the pool of worker processes among which the high-level windows of timed windows are distributed (if
+    None, they are processed in order in the calling process). The pool is created once by the caller and shared by
+    the extractions of all the entities
+    :param flow_window: the number of flows of each window in case of non-timed windows
+    :param flow_stride: the stride (in number of flows) of the non-timed windows
     :return: creates and stores the traces' file extracted from the input dataframe
     """
-    traces_indices = []
-    traces = []
+    # each trace is written to the traces' file (and the indices of its flows to the indices' file) once extracted
+    writer = TraceWriter(out_filepath, alphabet_size)
+    kwargs = {'aggregation': aggregation, 'resample': resample, 'new_features': new_features,
+              'shared_rolling': shared_rolling}
     progress_list = []
-    starting_index = 0
     num_of_features = len(selected)
+    # check if the records of the (non-aggregated) traces contain only int values
+    ints = False if 'duration' in selected else True
     # timed version
     if timed:
         medians = data['date'].sort_values().diff().dt.total_seconds()
         high_level_window_indices = medians[medians > 1800].index.tolist()
         if len(high_level_window_indices) != 0:
             print(str(len(high_level_window_indices)) + ' of high level windows identified!!')
-            for i in range(len(high_level_window_indices) + 1):
-                index = data.shape[0] if i == len(high_level_window_indices) else high_level_window_indices[i]
-                windowed_data = data[starting_index:index].copy(deep=True)
-                window, stride = set_windowing_vars(windowed_data)
-                # special handle in case a zero length window has been returned
-                if window.total_seconds() == 0:
-                    window = pd.to_timedelta('25ms')
-                    stride = pd.to_timedelta('5ms')
-                min_trace_len = int(max(windowed_data.shape[0] / 10000, 10))
-                max_trace_len = int(max(windowed_data.shape[0] / 100, 1500))
-                if windowed_data.shape[0] < min_trace_len:
-                    min_trace_len = windowed_data.shape[0]
-                if max_trace_len > 1500:
-                    max_trace_len = 1500
-                new_traces, new_indices, num_of_features = extract_traces_from_window(windowed_data, selected, window,
-                                                                                      stride,
-                                                                                      (min_trace_len, max_trace_len),
-                                                                                      data.shape[0], progress_list,
-                                                                                      dynamic=dynamic,
-                                                                                      aggregation=aggregation,
-                                                                                      resample=resample,
-                                                                                      new_features=new_features)
-                traces += new_traces
-                traces_indices += new_indices
-                starting_index = index
         else:
             print('All the dataset is taken into account!!')
-            window, stride = set_windowing_vars(data)
-            # special handle in case a zero length window has been returned
-            if window.total_seconds() == 0:
-                window = pd.to_timedelta('25ms')
-                stride = pd.to_timedelta('5ms')
-            min_trace_len = int(max(data.shape[0] / 10000, 10))
-            max_trace_len = int(max(data.shape[0] / 100, 1500))
-            if data.shape[0] < min_trace_len:
-                min_trace_len = data.shape[0]
-            if max_trace_len > 1500:
-                max_trace_len = 1500
-            new_traces, new_indices, num_of_features = extract_traces_from_window(data, selected, window, stride,
-                                                                                  (min_trace_len, max_trace_len),
-                                                                                  data.shape[0], progress_list,
-                                                                                  dynamic=dynamic,
-                                                                                  aggregation=aggregation,
-                                                                                  resample=resample,
-                                                                                  new_features=new_features)
-            traces += new_traces
-            traces_indices += new_indices
+        bounds = [0] + high_level_window_indices + [data.shape[0]]
+        if pool is None or len(bounds) == 2:
+            # process the high-level windows in order (without aggregation the records of the flows are converted
+            # once for all the traces of the entity, which are written as ranges of its rows)
+            if not aggregation:
+                writer.set_records(data[selected].to_numpy(), data.index, ints)
+            for starting_index, windowed_data, window, stride, trace_limits, _ in high_level_windows(data, bounds):
+                windows = extract_traces_from_window(windowed_data, window, stride, trace_limits, data.shape[0],
+                                                     progress_list, dynamic=dynamic)
+                num_of_features = write_window_traces(writer, windowed_data, selected, windows, starting_index,
+                                                      **kwargs)
+        else:
+            # or in parallel, appending their traces in the order of the high-level windows (the flows of each one are
+            # sent to the workers only once it is to be processed)
+            tasks = ((window_part_filepath(out_filepath, settings[0]), alphabet_size, data.shape[0], dynamic, kwargs,
+                      selected, settings) for settings in high_level_windows(data, bounds))
+            for part_filepath, num_of_traces, num_of_features in pool.imap(extract_window_traces, tasks):
+                writer.append(part_filepath, num_of_traces)
     # flow version
     else:
-        # set the window and stride
-        window = 100
-        stride = int(window/5)
         # obtain the indices residing in the processed data
-        data_indices = data.index.tolist()
-        # create a dict for testing if all the flows have been included in the traces
-        assertion_dict = dict(zip(data_indices, len(data_indices) * [False]))
-        # keep the maximum index
-        max_ind = data_indices[-1]
-        # keep the original features
-        old_selected = deepcopy(selected)
-        while starting_index < len(data_indices):
-            # retrieve the flows of the current window
-            windowed_data = data[starting_index: min(starting_index + window, len(data_indices))]
-            # insert the indices of the current trace to the assertion dictionary
-            assertion_dict.update(zip(windowed_data.index.tolist(), len(windowed_data.index.tolist()) * [True]))
-            # update the maximum seen index (for progress visualization) purposes
-            cnt = windowed_data.index.tolist()[-1]
-            # create aggregated features if needed (currently with a hard-coded window length)
+        data_indices = data.index
+        # find all the windows of flow_window flows (with a stride of flow_stride flows) at once, and test if all the
+        # flows have been included in them
+        starts, ends = flow_count_windows(len(data_indices), flow_window, flow_stride)
+        covered = np.cumsum(np.bincount(starts, minlength=len(data_indices) + 1) -
+                            np.bincount(ends, minlength=len(data_indices) + 1))[:-1] > 0
+        # the progress after each window (for progress visualization purposes)
+        progress = (np.asarray(data_indices[ends - 1]) / data_indices[-1] * 100).astype(int) // 10
+        if not aggregation:
+            # the records of the flows in the flexfringe format, converted once for all the traces of the entity, which
+            # are written as ranges of its rows
+            writer.set_records(data[selected].to_numpy(), data.index, ints)
+        else:
+            # the aggregated features of the static blocks of flows (currently with a hard-coded block length), as
+            # computed by the aggregate_static function, for all the blocks at once
+            aggregation_length = 5
+            keys = np.asarray(data_indices // aggregation_length)
+            specs = aggregation_specs(selected, new_features)
+            aggregated = aggregate_groups(data[selected], keys, specs)
+        for starting_index, end_index, prog in zip(starts.tolist(), ends.tolist(), progress.tolist()):
+            # create aggregated features if needed (the aggregated records of each window are retrieved from the ones
+            # computed once for all the blocks of the data)
             if aggregation:
-                aggregation_length = 5
-                windowed_data = aggregate_static(windowed_data[selected].copy(deep=True), selected, aggregation_length,
-                                                 new_features)
-                selected = windowed_data.columns.values
-                num_of_features = len(selected)
-            # extract the trace of this window and add it to the traces' list
-            ints = False if aggregation or 'duration' in old_selected else True
-            traces += [convert2flexfringe_format(windowed_data[selected], ints)]
-            # store also the flow indices of the current time window
-            traces_indices += [windowed_data.index.tolist()]
-            # retrieve the original features
-            selected = deepcopy(old_selected)
-            # increase the starting index of the window
-            starting_index += stride
+                windowed_data = drop_incomplete_aggregates(window_aggregates(data, keys, aggregated, specs,
+                                                                             starting_index, end_index))
+                num_of_features = windowed_data.shape[1]
+                writer.write_records(format_records(windowed_data.to_numpy(), False), windowed_data.index)
+            else:
+                # the trace of this window is the range of its flows in the feature matrix
+                writer.write(starting_index, end_index)
             # show progress
-            prog = int((cnt / max_ind) * 100)
-            if prog // 10 != 0 and prog // 10 not in progress_list:
-                progress_list += [prog // 10]
-                print('More than ' + str((prog // 10) * 10) + '% of the data processed...')
+            if prog != 0 and prog not in progress_list:
+                progress_list += [prog]
+                print('More than ' + str(prog * 10) + '% of the data processed...')
         # evaluate correctness of the process
-        if not all(list(assertion_dict.values())):
+        if not covered.all():
             print('There are flows missed in the current high level window -- Check again the implementation!!!')
-            print([k for k, v in assertion_dict.items() if not v], file=sys.stderr)
+            print(data_indices[~covered].tolist(), file=sys.stderr)
 
     print('Finished with rolling windows!!!')
-    print('Starting writing traces to file...')
-    # create the traces' file in the needed format
-    f = open(out_filepath, "w")
-    if alphabet_size > 0:
-        # if symbols are used
-        f.write(str(len(traces)) + ' ' + str(alphabet_size) + '\n')
-        for trace in traces:
-            f.write('1 ' + str(len(trace)) + ' ' + ' '.join(trace) + '\n')
-    else:
-        # if the multivariate version is used
-        f.write(str(len(traces)) + ' ' + '100:' + str(num_of_features) + '\n')
-        for trace in traces:
-            f.write('1 ' + str(len(trace)) + ' 0:' + ' 0:'.join(trace) + '\n')
-    f.close()
-    # save also the indices of each trace
-    indices_filepath = '.'.join(out_filepath.split('.')[:-1]) + '_indices.pkl'
-    with open(indices_filepath, 'wb') as f:
-        pickle.dump(traces_indices, f)
+    print('Completing the traces\' file with its header...')
+    # complete the traces' file in the needed format (the file with the indices of each trace is already complete)
+    writer.close(num_of_features)
     print('Traces written successfully to file!!!')
 
 
@@ -1016,8 +1758,7 @@ def run_traces_on_model(traces_path, indices_path, model, attribute_type='train'
     :return: the updated model
     """
     traces = traces2list(traces_path)
-    with open(indices_path, 'rb') as f:
-        traces_indices = pickle.load(f)
+    traces_indices = load_trace_indices(indices_path)
     for trace, inds in zip(traces, traces_indices):
         # first fire the transition from root node
         label = model.fire_transition('root', dict())
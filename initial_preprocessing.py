@@ -1,54 +1,299 @@
 #!/usr/bin/python
 
+import numpy as np
 import pandas as pd
-import socket
 from os import path
 import pickle
+import flow_store
+from dataset_specs import DATASET_SPECS
+from multiprocessing import Pool
 
 
-def preprocess_unidirectional_data(filepath):
+def split_address(addresses):
+    """
+    Helper function for splitting the ip:port fields of the unidirectional netflows in a vectorized way. Ports that are
+    missing or not numerical are set to NaN
+    :param addresses: the Series with the ip:port values
+    :return: a tuple with the Series of the ips and the Series of the ports
+    """
+    parts = addresses.str.split(':', n=2, expand=True)
+    ips = parts[0]
+    if parts.shape[1] == 1:
+        return ips, pd.Series(float('nan'), index=addresses.index, dtype=object)
+    ports = parts[1].where(parts[1].str.isdigit().fillna(False).astype(bool))
+    return ips, ports
+
+
+def iter_unidirectional_chunks(filepath, chunksize=1000000):
+    """
+    Function for converting the unidirectional netflows chunk by chunk. The ips are separated from the ports with
+    vectorized string operations and the date is rebuilt from its two space-separated parts, so that each chunk has the
+    columns of the comma-separated format of the rest datasets. Lines with a different number of fields than expected
+    are moved to a quarantine file
+    :param filepath: the relative path of the file to be processed
+    :param chunksize: the number of lines in each chunk
+    :return: a generator over the converted chunks (all values are kept as strings)
+    """
+    raw_names = ['day', 'time', 'duration', 'protocol', 'src_address', 'direction', 'dst_address', 'flags', 'tos',
+                 'packets', 'bytes', 'flows', 'label']
+    column_names = ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'flags', 'tos',
+                    'packets', 'bytes', 'flows', 'label']
+    source = QuarantineFile(filepath, delimiter=None, expected_fields=len(raw_names), header_lines=1)
+    processed = 0
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunksize, delim_whitespace=True, header=None, names=raw_names,
+                                 skiprows=1, dtype=str, na_filter=False, engine='c'):
+            # take into account that date has a space
+            chunk['date'] = chunk['day'] + ' ' + chunk['time']
+            # split source and destination ips and ports
+            chunk['src_ip'], chunk['src_port'] = split_address(chunk['src_address'])
+            chunk['dst_ip'], chunk['dst_port'] = split_address(chunk['dst_address'])
+            processed += chunk.shape[0]
+            # progress is reported once per chunk
+            print(str(processed) + ' lines have been processed...')
+            yield chunk[column_names]
+    finally:
+        source.close()
+
+
+def preprocess_unidirectional_data(filepath, chunksize=1000000):
     """
     Helper function for preprocessing the unidirectional netflows. The ips should be separated from the ports, the date
     values should be taken care of while splitting, while the separator should be converted from space to comma to meet
-    the specifications of the rest datasets
+    the specifications of the rest datasets. The file is converted in chunks, so memory usage does not depend on its
+    size
     :param filepath: the relative path of the file to be processed
+    :param chunksize: the number of lines converted at once
     :return: a file with the preprocessed data is created
     """
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-    fout = open(filepath + '_preprocessed', 'w')
+    with open(filepath + '_preprocessed', 'w') as fout:
+        header = True
+        for chunk in iter_unidirectional_chunks(filepath, chunksize=chunksize):
+            chunk.to_csv(fout, header=header, index=False, na_rep='NaN')
+            header = False
 
-    column_names = ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'flags', 'tos',
-                    'packets', 'bytes', 'flows', 'label']
 
-    fout.write(','.join(column_names) + '\n')
-    for i, line in enumerate(lines[1:]):
-        elements = []
-        columns = line.split()
-        for ind in range(len(columns)):
-            # take into account that date has a space
-            if ind == 1:
-                elements += [columns[ind - 1] + ' ' + columns[ind]]
-            # split source ips and ports
-            elif ind == 4:
-                elements += [columns[ind].split(':')[0]]
-                elements += ['NaN' if len(columns[ind].split(':')) == 1 or not columns[ind].split(':')[1].isdigit()
-                             else columns[ind].split(':')[1]]
-            # split destination ips and ports
-            elif ind == 6:
-                elements += [columns[ind].split(':')[0]]
-                elements += ['NaN' if len(columns[ind].split(':')) == 1 or not columns[ind].split(':')[1].isdigit()
-                             else columns[ind].split(':')[1]]
-            # ignore these two indexes
-            elif ind == 0 or ind == 5:
-                pass
-            else:
-                elements += [columns[ind]]
-
-        fout.write(','.join(elements) + '\n')
-        if i % 10000:
-            print(str(i) + ' lines have been processed...')
-    fout.close()
+def read_options(filepath, flag):
+    """
+    Helper function for setting the flags for dataframe parsing in the appropriate way for each dataset
+    The values set are the following:
+    delimeter: Delimiter to use to separate the values in each column
+    header: row number to use as header - if it is set to None then no header is inferred
+    names: List of column names to use, in case header is set to None
+    usecols: The set of columns to be used
+    skiprows: The row numbers to skip or the number of rows to skip from the beginning of the document
+    na_values: Additional strings to recognize as NA/NaN
+    parse_field: The columns to parse with the dateparse function
+    dateparse: Function to use for converting a sequence of string columns to an array of datetime instances
+    encoding: The encoding of the file
+    dtype: The explicit type of each column (used only by the C parsing engine)
+    date_formats: The candidate formats of the date columns tried in order during vectorized date conversion
+    date_unit: The unit of the date columns in case they are given as epoch numbers (None otherwise)
+    All the values are taken from the declarative spec of the dataset (see dataset_specs)
+    :param filepath: the relative path of the file to be read
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :return: a dictionary with the parsing options
+    """
+    spec = DATASET_SPECS[flag]
+    options = {
+        'delimiter': spec['delimiter'],
+        'header': None,
+        'skiprows': spec['skiprows'],
+        'na_values': spec['na_values'],
+        'parse_field': spec['date_fields'],
+        'encoding': spec['encoding'],
+        'names': spec['names'],
+        'usecols': spec['usecols'],
+        'dtype': spec['dtype'],
+        'date_formats': spec['date_formats'],
+        'date_unit': spec['date_unit']
+    }
+    options['dateparse'] = lambda x: parse_dates(pd.Series(x), options['date_formats'], options['date_unit']).values
+    if spec['header_marker'] is not None and spec['header_marker'] in filepath.split('/')[2]:
+        options['skiprows'] = 1
+    return options
+
+
+def parse_dates(values, formats, unit=None):
+    """
+    Function for converting a column of dates in a vectorized way. Each of the candidate formats is tried in order on
+    the values that have not been converted yet, and only the values that match none of them are parsed by inference
+    :param values: the Series with the date values
+    :param formats: the list of candidate formats
+    :param unit: the unit of the values in case they are epoch numbers (the formats are ignored in that case)
+    :return: the Series with the converted dates
+    """
+    if unit is not None:
+        return pd.to_datetime(values, unit=unit)
+    dates = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    missing = values.notna()
+    for date_format in formats:
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(values[missing], format=date_format, errors='coerce')
+        missing = dates.isna() & values.notna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(values[missing], dayfirst=True)
+    return dates
+
+
+def count_fields(line, delimiter=','):
+    """
+    Helper function for counting the fields of a line, used for finding the malformed lines of a dataset
+    :param line: the line
+    :param delimiter: the delimiter of the fields (None for any whitespace)
+    :return: the number of fields
+    """
+    return len(line.split()) if delimiter is None else line.count(delimiter) + 1
+
+
+class QuarantineFile:
+    """
+    File-like wrapper used for reading a dataset while moving its malformed lines to a quarantine file. A line is
+    considered malformed when it has a different number of fields than the first line of the file (more fields cause
+    tokenizing errors while parsing, and less fields, as in a truncated last line, missing values in typed columns).
+    Empty lines are passed through, since they are skipped by the parser. The file is scanned only once, no matter how
+    many malformed lines it contains, and the quarantined lines are stored together with their line numbers in the
+    original file.
+    """
+
+    def __init__(self, filepath, delimiter=',', encoding='utf_8', quarantine_filepath=None, block_size=1 << 20,
+                 expected_fields=None, header_lines=0):
+        """
+        Init function for the QuarantineFile class
+        :param filepath: the relative path of the file to be read
+        :param delimiter: the delimiter of the fields in each line (None for any whitespace)
+        :param encoding: the encoding of the file
+        :param quarantine_filepath: the path of the quarantine file (by default the input path with a '_quarantine'
+        suffix)
+        :param block_size: the number of characters read from the file at once
+        :param expected_fields: the number of fields of a well-formed line (by default the number of fields of the
+        first line)
+        :param header_lines: the number of lines at the beginning of the file that are passed through without checking
+        """
+        self.f = open(filepath, 'r', encoding=encoding)
+        self.delimiter = delimiter
+        self.quarantine_filepath = filepath + '_quarantine' if quarantine_filepath is None else quarantine_filepath
+        self.quarantine = None
+        self.block_size = block_size
+        self.expected_fields = expected_fields
+        self.header_lines = header_lines
+        self.line_number = 0
+        self.quarantined = 0
+        self.partial = ''
+        self.pending = ''
+        self.position = 0
+
+    def count_fields(self, line):
+        """
+        Function for counting the fields of a line
+        :param line: the line
+        :return: the number of fields
+        """
+        return count_fields(line, self.delimiter)
+
+    def filter_lines(self, lines):
+        """
+        Function for keeping the well-formed lines out of the given ones and writing the rest to the quarantine file
+        :param lines: the list of complete lines
+        :return: the well-formed lines joined in one string
+        """
+        kept = []
+        for line in lines:
+            self.line_number += 1
+            if self.line_number <= self.header_lines or not line.strip():
+                kept += [line]
+                continue
+            num_fields = self.count_fields(line)
+            if self.expected_fields is None:
+                self.expected_fields = num_fields
+            elif num_fields != self.expected_fields:
+                # the quarantine file is created only if malformed lines exist
+                if self.quarantine is None:
+                    self.quarantine = open(self.quarantine_filepath, 'w')
+                self.quarantine.write(str(self.line_number) + '\t' + line.rstrip('\r\n') + '\n')
+                self.quarantined += 1
+                continue
+            kept += [line]
+        return ''.join(kept)
+
+    def read_block(self):
+        """
+        Function for reading the next block of well-formed lines from the file
+        :return: the lines read as a string (an empty string at the end of the file)
+        """
+        out = ''
+        while not out:
+            block = self.f.read(self.block_size)
+            if not block:
+                # process the last line in case it did not end with a newline
+                out, self.partial = self.filter_lines([self.partial] if self.partial else []), ''
+                return out
+            lines = (self.partial + block).splitlines(keepends=True)
+            # the last line of the block is kept for the next block if it is incomplete
+            self.partial = lines.pop() if not lines[-1].endswith(('\n', '\r')) else ''
+            out = self.filter_lines(lines)
+        return out
+
+    def read(self, size=-1):
+        """
+        Function for reading up to size characters of well-formed lines (as in any file object)
+        :param size: the maximum number of characters to be read (all the remaining ones if negative)
+        :return: the characters read
+        """
+        if size is None or size < 0:
+            out = [self.pending[self.position:]]
+            block = self.read_block()
+            while block:
+                out += [block]
+                block = self.read_block()
+            self.pending, self.position = '', 0
+            return ''.join(out)
+        if self.position >= len(self.pending):
+            self.pending, self.position = self.read_block(), 0
+        out = self.pending[self.position:self.position + size]
+        self.position += len(out)
+        return out
+
+    def readline(self, size=-1):
+        """
+        Function for reading the next well-formed line (as in any file object)
+        :param size: the maximum number of characters to be read (the whole line if negative)
+        :return: the line read
+        """
+        end = self.pending.find('\n', self.position)
+        while end < 0:
+            block = self.read_block()
+            if not block:
+                end = len(self.pending) - 1
+                break
+            self.pending, self.position = self.pending[self.position:] + block, 0
+            end = self.pending.find('\n')
+        if size is not None and 0 <= size < end + 1 - self.position:
+            end = self.position + size - 1
+        line = self.pending[self.position:end + 1]
+        self.position = end + 1
+        return line
+
+    def __iter__(self):
+        """
+        Function for iterating over the well-formed lines (as in any file object)
+        :return: a generator over the lines
+        """
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+    def close(self):
+        """
+        Function for closing the input and the quarantine files and reporting the number of quarantined lines
+        :return:
+        """
+        self.f.close()
+        if self.quarantine is not None:
+            self.quarantine.close()
+            print(str(self.quarantined) + ' malformed lines have been written to ' + self.quarantine_filepath)
 
 
 def read_data(filepath, flag='CTU-uni', preprocessing=None, chunks=False, expl=False):
@@ -58,7 +303,7 @@ def read_data(filepath, flag='CTU-uni', preprocessing=None, chunks=False, expl=F
     :param flag: flag showing the origin of the dataset (CTU | CICIDS | USNW)
     :param preprocessing: flag only applicable to the unidirectional Netflow case of CTU-13
     :param chunks: flag showing if the input data should be parsed in chunks into the dataframe
-    :param expl: flag regarding the visualization of the error lines in the dataset
+    :param expl: flag regarding the quarantine of the error lines in the dataset
     :return: the dataframe with the data
     """
     # if the dataset needs some preprocessing
@@ -67,308 +312,538 @@ def read_data(filepath, flag='CTU-uni', preprocessing=None, chunks=False, expl=F
         filepath += '_preprocessed'
 
     # Set the flags for dataframe parsing in the appropriate way for each dataset
-    # The values set are the following:
-    # delimeter: Delimiter to use to separate the values in each column
-    # header: row number to use as header - if it is set to None then no header is inferred
-    # names: List of column names to use, in case header is set to None
-    # usecols: The set of columns to be used
-    # skiprows: The row numbers to skip or the number of rows to skip from the beginning of the document
-    # sikpfooter: Number of lines at bottom of file to skip
-    # na_values: Additional strings to recognize as NA/NaN
-    # parse_field: The columns to parse with the dateparse function
-    # dateparse: Function to use for converting a sequence of string columns to an array of datetime instances
-    delimiter = ','
-    header = None
-    skiprows = 1
+    options = read_options(filepath, flag)
     skipfooter = 0
-    na_values = []
-    parse_field = ['date']
-    encoding = 'utf_8'
     engine = 'python'
 
-    # Unidirectional Netflow data from CTU-13 dataset
-    if flag == 'CTU-uni':
-        names = ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'flags', 'packets',
-                 'bytes', 'label']
-        usecols = [_ for _ in range(0, 8)] + [9, 10, 12]
-        dateparse = lambda x: pd.datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f')
-    # Bidirectional Netflow data from CTU-13 dataset
-    elif flag == 'CTU-bi':
-        names = ['date', 'duration', 'protocol', 'src_ip', 'src_port', 'direction', 'dst_ip', 'dst_port', 'state',
-                 'packets', 'bytes', 'src_bytes', 'label']
-        usecols = [_ for _ in range(0, 9)] + [_ for _ in range(11, 15)]
-        dateparse = lambda x: pd.datetime.strptime(x, '%Y/%m/%d %H:%M:%S.%f')
-    # Netflow data from UNSW-NB15 dataset
-    elif flag == 'UNSW':
-        names = ['src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol', 'state', 'duration', 'src_bytes',
-                 'dst_bytes', 'missed_src_bytes', 'missed_dst_bytes', 'service', 'src_packets', 'dst_packets',
-                 'date', 'end_date', 'detailed_label', 'label']
-        usecols = [_ for _ in range(0, 9)] + [_ for _ in range(11, 14)] + [16, 17, 28, 29, 47, 48]
-        na_values = ['-']
-        skiprows = []
-        dateparse = lambda x: pd.to_datetime(x, unit='s')
-        parse_field = ['date', 'end_date']
-        # special handling for the first dataset of the UNSW datasets
-        if '1' in filepath.split('/')[2]:
-            skiprows = 1
-    # Netflow data from CICIDS2017 dataset
-    else:
-        # in this dataset the features 'total length of forward packets' and 'total length of
-        # backward packets' have been considered as sent and received bytes
-        names = ['src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol', 'date', 'duration', 'total_fwd_packets',
-                 'total_bwd_packets', 'src_bytes', 'dst_bytes', 'label']
-        usecols = [_ for _ in range(1, 12)] + [84]
-        dateparse = lambda x: pd.to_datetime(x, dayfirst=True)
-        encoding = 'latin_1'
-
-    # a simple try-except loop to catch any tokenizing errors in the data (e.g. the FILTER_LEGITIMATE field in the
-    # unidirectional flows - for now these lines are ignored) in case the explanatory flag is True
-    cont = True
-    data = []
-    while cont:
-        try:
-            # read the data into a dataframe according to the background flag
-            data = pd.read_csv(filepath, delimiter=delimiter, header=header, names=names, parse_dates=parse_field,
-                               date_parser=dateparse, usecols=usecols, na_values=na_values, error_bad_lines=expl,
-                               engine=engine, skiprows=skiprows, skipfooter=skipfooter, encoding=encoding) if not chunks \
-                else pd.concat(pd.read_csv(filepath, chunksize=1000000, delimiter=delimiter, header=header, names=names,
-                                           parse_dates=parse_field, date_parser=dateparse, usecols=usecols,
-                                           na_values=na_values, error_bad_lines=expl, engine=engine, skiprows=skiprows,
-                                           encoding=encoding))
-            cont = False
-        except Exception as e:
-            errortype = str(e).split('.')[0].strip()
-            if errortype == 'Error tokenizing data':
-                cerror = str(e).split(':')[1].strip().replace(',', '')
-                nums = [n for n in cerror.split(' ') if str.isdigit(n)]
-                skiprows.append(int(nums[1]) - 1)
-                with open(filepath, 'r') as f:
-                    lines = f.readlines()
-                err_line = lines[int(nums[1]) - 1]
-                print(err_line)
-            else:
-                print(errortype)
+    # any tokenizing errors in the data (e.g. the FILTER_LEGITIMATE field in the unidirectional flows) are caught in a
+    # single pass in case the explanatory flag is True, by moving the malformed lines to a quarantine file
+    source = QuarantineFile(filepath, encoding=options['encoding']) if expl else filepath
+    try:
+        # read the data into a dataframe according to the background flag
+        data = pd.read_csv(source, delimiter=options['delimiter'], header=options['header'], names=options['names'],
+                           parse_dates=options['parse_field'], date_parser=options['dateparse'],
+                           usecols=options['usecols'], na_values=options['na_values'], error_bad_lines=expl,
+                           engine=engine, skiprows=options['skiprows'], skipfooter=skipfooter,
+                           encoding=options['encoding']) if not chunks \
+            else pd.concat(pd.read_csv(source, chunksize=1000000, delimiter=options['delimiter'],
+                                       header=options['header'], names=options['names'],
+                                       parse_dates=options['parse_field'], date_parser=options['dateparse'],
+                                       usecols=options['usecols'], na_values=options['na_values'],
+                                       error_bad_lines=expl, engine=engine, skiprows=options['skiprows'],
+                                       encoding=options['encoding']))
+    finally:
+        if expl:
+            source.close()
+
+    return data
+
+
+def read_data_chunks(filepath, flag='CTU-uni', preprocessing=None, chunksize=1000000, quarantine=True, usecols=None):
+    """
+    High-throughput alternative of read_data. The file is parsed with the C engine using explicit column types, the
+    date columns are converted in a vectorized way according to the known formats of each dataset, and the data are
+    yielded chunk by chunk instead of being concatenated in one dataframe. Malformed lines are moved to a quarantine
+    file in the same pass (if quarantine is False they are skipped by the parser instead)
+    :param filepath: the relative path of the file to be read
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param preprocessing: flag only applicable to the unidirectional Netflow case of CTU-13
+    :param chunksize: the number of lines in each chunk
+    :param quarantine: flag showing if the malformed lines should be written to a quarantine file
+    :param usecols: the names of the columns to be read (None for all the columns of the dataset)
+    :return: a generator over the dataframes of the chunks
+    """
+    options = read_options(filepath, flag)
+    names = options['names']
+    positions = options['usecols']
+    if usecols is not None:
+        positions = [pos for pos, name in zip(options['usecols'], options['names']) if name in usecols]
+        names = [name for name in options['names'] if name in usecols]
+
+    # if the dataset needs some preprocessing the converted chunks are used directly (no intermediate file is written)
+    if preprocessing:
+        for chunk in iter_unidirectional_chunks(filepath, chunksize=chunksize):
+            chunk = chunk[names]
+            for name in names:
+                if options['dtype'][name] is not str:
+                    chunk[name] = chunk[name].astype(options['dtype'][name])
+            for field in options['parse_field']:
+                if field in names:
+                    chunk[field] = parse_dates(chunk[field], options['date_formats'], options['date_unit'])
+            yield chunk
+        return
+
+    source = QuarantineFile(filepath, encoding=options['encoding']) if quarantine else filepath
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunksize, delimiter=options['delimiter'],
+                                 header=options['header'], names=names, usecols=positions,
+                                 dtype={name: options['dtype'][name] for name in names},
+                                 na_values=options['na_values'], on_bad_lines='skip', engine='c',
+                                 skiprows=options['skiprows'], encoding=options['encoding']):
+            for field in options['parse_field']:
+                if field in names:
+                    chunk[field] = parse_dates(chunk[field], options['date_formats'], options['date_unit'])
+            yield chunk
+    finally:
+        if quarantine:
+            source.close()
+
+
+def count_hosts(filepath, flag, chunksize=1000000):
+    """
+    Function for counting the flows of each host of the host network of a dataset (see dataset_specs) in a file with a
+    projection pass over the source IPs, so that host filtering can be applied while the rest of the file is processed
+    in chunks
+    :param filepath: the relative path of the file to be read
+    :param flag: flag showing the origin of the dataset
+    :param chunksize: the number of lines in each chunk
+    :return: a Series with the number of flows of each source IP
+    """
+    prefix = DATASET_SPECS[flag]['host_network'][0]
+    counts = []
+    for chunk in read_data_chunks(filepath, flag=flag, chunksize=chunksize, quarantine=False, usecols=['src_ip']):
+        chunk = chunk[chunk['src_ip'].str.contains(prefix)]
+        counts += [chunk.groupby('src_ip').size()]
+    return pd.concat(counts).groupby(level=0).sum() if len(counts) else pd.Series(dtype='int64')
+
+
+def extend_categories(categories, values):
+    """
+    Helper function for adding the unseen values of a categorical feature to its list of categories in the order of
+    their first appearance, so that the numerical codes of data processed in chunks are the same as if the whole data
+    had been processed at once
+    :param categories: the list of categories seen so far (updated in place)
+    :param values: the Series with the values of the current data
+    :return: the updated list of categories
+    """
+    seen = set(categories)
+    categories += [value for value in pd.unique(values.dropna()) if value not in seen]
+    return categories
+
+
+def output_directory(filepath, flag):
+    """
+    Helper function returning the directory in which the preprocessed flows of a file are stored
+    :param filepath: the relative path of the input file
+    :param flag: flag showing the origin of the dataset
+    :return: the output directory
+    """
+    return '/'.join(filepath.split('/')[0:DATASET_SPECS[flag]['output_depth']])
+
+
+def load_protocol_categories(filepath):
+    """
+    Helper function for loading the protocol categories shared between the files of the UNSW-NB15 dataset
+    :param filepath: the relative path of the input file
+    :return: the list of protocol categories or None if they have not been stored yet
+    """
+    protocol_names_filepath = '/'.join(filepath.split('/')[0:2]) + '/protocol_names.pkl'
+    if path.exists(protocol_names_filepath):
+        with open(protocol_names_filepath, 'rb') as f:
+            return pickle.load(f)
+    return None
+
+
+def store_protocol_categories(filepath, protocol_categories):
+    """
+    Helper function for storing the protocol categories shared between the files of the UNSW-NB15 dataset
+    :param filepath: the relative path of the input file
+    :param protocol_categories: the list of protocol categories
+    :return: creates the protocol names' file
+    """
+    protocol_names_filepath = '/'.join(filepath.split('/')[0:2]) + '/protocol_names.pkl'
+    with open(protocol_names_filepath, 'wb') as f:
+        pickle.dump(protocol_categories, f)
 
+
+def ingest_state_path(filepath, flag, sota=True):
+    """
+    Helper function returning the path of the file with the ingestion state of the stores that a file is split into.
+    The state is shared by all the files split into the same stores (e.g. the hourly exports of a capture)
+    :param filepath: the relative path of the input file
+    :param flag: flag showing the origin of the dataset
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :return: the path of the ingestion state's file
+    """
+    prefix = path.commonprefix([name for name, _ in split_rules(filepath, flag, sota=sota)])
+    return path.join(output_directory(filepath, flag), prefix + 'ingest_state.pkl')
+
+
+def load_ingest_state(filepath, flag, sota=True):
+    """
+    Function for loading the ingestion state of the stores that a file is split into, i.e. the learned categories of
+    the categorical features, the number of flows of each host read so far, and the date watermark of each source IP
+    bucket among the flows read so far (including the ones that were filtered out during preprocessing)
+    :param filepath: the relative path of the input file
+    :param flag: flag showing the origin of the dataset
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :return: a dictionary with the 'categories', the 'host_counts' (Series indexed by source IP), and the 'watermarks'
+    """
+    state_filepath = ingest_state_path(filepath, flag, sota=sota)
+    if not path.exists(state_filepath):
+        return {'categories': {}, 'host_counts': pd.Series(dtype='int64'), 'watermarks': {}}
+    with open(state_filepath, 'rb') as f:
+        return pickle.load(f)
+
+
+def store_ingest_state(filepath, flag, categories, host_counts, watermarks, sota=True):
+    """
+    Function for storing the ingestion state of the stores that a file is split into
+    :param filepath: the relative path of the input file
+    :param flag: flag showing the origin of the dataset
+    :param categories: dictionary with the categories of the categorical features (see preprocess_data)
+    :param host_counts: a Series with the number of flows of each host read so far
+    :param watermarks: a dictionary with the latest date read in each source IP bucket
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :return: creates the ingestion state's file
+    """
+    state = {'categories': {col: values for col, values in categories.items() if col != 'extend'},
+             'host_counts': host_counts, 'watermarks': watermarks}
+    with open(ingest_state_path(filepath, flag, sota=sota), 'wb') as f:
+        pickle.dump(state, f)
+
+
+def parse_hex_ports(values):
+    """
+    Function for converting the hexadecimal values (e.g. 0x0303) of a port column to integers in a vectorized way. The
+    hexadecimal digits of all the values are padded to the same width and converted at once as an array of code points
+    :param values: the Series with the port values as strings
+    :return: the Series with the hexadecimal values converted to integers (the rest of the values are left untouched)
+    """
+    hexadecimal = values.str.contains('x', regex=False).fillna(False).astype(bool)
+    if not hexadecimal.any():
+        return values
+    digits = values[hexadecimal].str.strip().str.lower().str.replace('0x', '', regex=False)
+    width = int(digits.str.len().max())
+    code_points = digits.str.zfill(width).values.astype('U' + str(width)).view(np.uint32).reshape(-1, width)
+    digit_values = np.where(code_points >= ord('a'), code_points - ord('a') + 10, code_points - ord('0'))
+    values = values.astype(object)
+    values[hexadecimal] = (digit_values.astype(np.int64) << (4 * np.arange(width - 1, -1, -1))).sum(axis=1)
+    return values
+
+
+def preprocess_data(data, flag, categories, sota=True, host_counts=None):
+    """
+    Function for applying the dataset-specific preprocessing on the fields of a dataframe, as described by the
+    declarative spec of each dataset (see dataset_specs). It can be applied either on the whole data or on each chunk of
+    them, since any state needed across chunks is kept in the given categories
+    :param data: the dataframe with the data (or a chunk of them)
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param categories: dictionary with the categories of the categorical features seen so far and a boolean 'extend'
+    entry showing if new categories can be added to them
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :param host_counts: the number of flows of each host in the whole data (computed on the given data if None)
+    :return: the preprocessed dataframe
+    """
+    spec = DATASET_SPECS[flag]
+    # resetting indices for data
+    data = data.reset_index(drop=True)
+
+    # the background data are taken into account only in state-of-the-art experiments
+    if not sota and spec['background'] is not None:
+        data = data[~data['label'].str.contains(spec['background'])]
+    # while in these experiments only the hosts of the host network with enough flows in total are kept
+    elif sota and spec['host_network'] is not None:
+        prefix, min_flows = spec['host_network']
+        data = data[data['src_ip'].str.contains(prefix)]
+        hosts = data.groupby('src_ip').size() if host_counts is None else host_counts
+        ips = hosts[hosts > min_flows].index
+        data = data[data['src_ip'].isin(ips)]
+    if spec['dropna']:
+        data = data.dropna()
+    else:
+        data = data.copy()
+
+    # handle NaN values (mostly NaN ports)
+    for col, value in spec['fillna'].items():
+        data[col] = data[col].fillna(value)
+    # handle special hexadecimal values in the port columns
+    for col in spec['hex_ports']:
+        if data[col].dtype == object:
+            data[col] = parse_hex_ports(data[col])
+    # parse packets, bytes, and ports as integers and duration as float instead of strings
+    data = data.astype(spec['types'])
+    for col, expression in spec['derived'].items():
+        data[col] = data.eval(expression)
+
+    # add the numerical representation of the categorical data (the learned categories are extended only if they have
+    # not been fixed, e.g. by a previously processed file of the UNSW-NB15 dataset)
+    for col, fixed_categories in spec['category_codes'].items():
+        if fixed_categories is None:
+            fixed_categories = categories.setdefault(col, [])
+            if categories.get('extend', True):
+                extend_categories(fixed_categories, data[col])
+            elif not set(data[col].unique().tolist()).issubset(set(fixed_categories)):
+                print('New ' + col + ' types found!!!!')
+        data[col + '_num'] = pd.Categorical(data[col], categories=fixed_categories).codes
+    # convert the numerical values to names according to their code
+    for col, table in spec['category_names'].items():
+        data[col + '_num'] = data[col].astype('int64')
+        data[col] = data[col + '_num'].map(table)
     return data
 
 
+def split_rules(filepath, flag, sota=True):
+    """
+    Helper function returning the label rules of the splits of a file together with the names of the splits
+    :param filepath: the relative path of the input file (used for the naming of the UNSW-NB15 splits)
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :return: a list of (name, rule) tuples
+    """
+    stem = path.basename(filepath).split('.')[0]
+    return [(rule['name'].format(stem=stem), rule) for rule in DATASET_SPECS[flag]['splits']
+            if rule.get('sota', sota) == sota]
+
+
+def split_data(data, filepath, flag, sota=True):
+    """
+    Function for splitting the preprocessed data according to the label rules of the spec of each dataset and sorting
+    them by date
+    :param data: the preprocessed dataframe (or a chunk of it)
+    :param filepath: the relative path of the input file (used for the naming of the UNSW-NB15 splits)
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :return: a dictionary with the name of each split as key and the corresponding dataframe as value
+    """
+    splits = {}
+    for name, rule in split_rules(filepath, flag, sota=sota):
+        if 'equals' in rule:
+            mask = data['label'] == rule['equals']
+        elif 'differs' in rule:
+            mask = data['label'] != rule['differs']
+        elif 'contains' in rule:
+            mask = data['label'].str.contains(rule['contains'])
+        else:
+            mask = ~data['label'].str.contains(rule['excludes'])
+        splits[name] = data[mask].sort_values(by=['date']).reset_index(drop=True)
+    return splits
+
+
+def ingest_file(filepath, flag, categories, sota=True, preprocessing=None, chunksize=1000000):
+    """
+    Function for ingesting a whole file in the fast chunked mode. Each chunk is preprocessed, split according to its
+    labels, and appended to the flow store as soon as it has been read
+    :param filepath: the relative path of the file to be ingested
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param categories: dictionary with the categories of the categorical features (see preprocess_data)
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :param preprocessing: flag only applicable to the unidirectional Netflow case of CTU-13
+    :param chunksize: the number of lines in each chunk
+    :return: a dictionary with the number of flows written in each split
+    """
+    # the host filtering of the state-of-the-art experiments needs the flow counts of the whole file
+    host_counts = count_hosts(filepath, flag, chunksize=chunksize) \
+        if sota and DATASET_SPECS[flag]['host_network'] is not None else None
+    written = {}
+    counts = []
+    watermarks = {}
+    for i, chunk in enumerate(read_data_chunks(filepath, flag=flag, preprocessing=preprocessing,
+                                               chunksize=chunksize)):
+        counts += [chunk.groupby('src_ip').size()]
+        flow_store.update_watermarks(watermarks, chunk)
+        chunk = preprocess_data(chunk, flag, categories, sota=sota, host_counts=host_counts)
+        # each chunk is split and appended to the flow store as soon as it has been processed
+        for name, split in split_data(chunk, filepath, flag, sota=sota).items():
+            flow_store.write_flows(split, output_directory(filepath, flag), name, append=name in written)
+            written[name] = written.get(name, 0) + split.shape[0]
+        print(filepath + ': ' + str(i + 1) + ' chunks have been processed...')
+    # the stores have been rebuilt so their ingestion state starts from this file
+    store_ingest_state(filepath, flag, categories, pd.concat(counts).groupby(level=0).sum() if len(counts)
+                       else pd.Series(dtype='int64'), watermarks, sota=sota)
+    return written
+
+
+def ingest_increment(filepath, flag, sota=True, preprocessing=None, chunksize=1000000):
+    """
+    Function for ingesting a new file (e.g. the latest hourly export of a sensor) into the existing flow store. Only the
+    flows newer than the date watermark of their source IP bucket are processed and appended, so files overlapping with
+    the already ingested ones can be given as well. The learned categories and the flow counts of each host are loaded
+    from the ingestion state of the stores and are updated with the new flows, so the numerical codes of the categorical
+    features stay the same and the host filtering of the state-of-the-art experiments considers all the flows read so
+    far (flows of hosts that reach the threshold only with the new flows are kept only from then on)
+    :param filepath: the relative path of the file to be ingested
+    :param flag: flag showing the origin of the dataset (CTU-uni | CTU-bi | CICIDS | UNSW)
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :param preprocessing: flag only applicable to the unidirectional Netflow case of CTU-13
+    :param chunksize: the number of lines in each chunk
+    :return: a dictionary with the number of flows appended in each split
+    """
+    spec = DATASET_SPECS[flag]
+    directory = output_directory(filepath, flag)
+    state = load_ingest_state(filepath, flag, sota=sota)
+    # the watermarks are fixed before ingestion, so that flows that are not in order within the file are not dropped
+    watermarks = dict(state['watermarks'])
+    categories = state['categories']
+    categories['extend'] = True
+    if spec['shared_protocols']:
+        protocol_categories = load_protocol_categories(filepath)
+        if protocol_categories is not None:
+            categories['protocol'] = protocol_categories
+
+    # projection pass updating the flow counts of each host with the new flows
+    counts = [state['host_counts']]
+    for chunk in read_data_chunks(filepath, flag=flag, preprocessing=preprocessing, chunksize=chunksize,
+                                  quarantine=False, usecols=['date', 'src_ip']):
+        chunk = chunk[flow_store.new_flows_mask(chunk, watermarks)]
+        counts += [chunk.groupby('src_ip').size()]
+        flow_store.update_watermarks(state['watermarks'], chunk)
+    host_counts = pd.concat(counts).groupby(level=0).sum().astype('int64')
+
+    written = {}
+    for i, chunk in enumerate(read_data_chunks(filepath, flag=flag, preprocessing=preprocessing,
+                                               chunksize=chunksize)):
+        chunk = chunk[flow_store.new_flows_mask(chunk, watermarks)]
+        if chunk.shape[0] == 0:
+            continue
+        chunk = preprocess_data(chunk, flag, categories, sota=sota, host_counts=host_counts)
+        for name, split in split_data(chunk, filepath, flag, sota=sota).items():
+            written[name] = written.get(name, 0) + flow_store.write_flows(split, directory, name, append=True)
+        print(filepath + ': ' + str(i + 1) + ' chunks have been processed...')
+
+    store_ingest_state(filepath, flag, categories, host_counts, state['watermarks'], sota=sota)
+    if spec['shared_protocols']:
+        store_protocol_categories(filepath, categories['protocol'])
+    return written
+
+
+def collect_protocol_categories(filepath, flag, chunksize=1000000):
+    """
+    Function for collecting the protocol categories of a file in the order of their first appearance with a projection
+    pass over the protocol column
+    :param filepath: the relative path of the file
+    :param flag: flag showing the origin of the dataset
+    :param chunksize: the number of lines in each chunk
+    :return: the list of protocol categories
+    """
+    protocol_categories = []
+    for chunk in read_data_chunks(filepath, flag=flag, chunksize=chunksize, quarantine=False, usecols=['protocol']):
+        extend_categories(protocol_categories, chunk['protocol'])
+    return protocol_categories
+
+
+def read_manifest(manifest_filepath):
+    """
+    Function for reading a manifest of files to be ingested. Each line of the manifest contains the relative path of a
+    file and the flag of its dataset separated by comma, while empty lines and lines starting with # are ignored
+    :param manifest_filepath: the path of the manifest
+    :return: a list of (filepath, flag) tuples in the order of the manifest
+    """
+    entries = []
+    with open(manifest_filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            filepath, flag = [field.strip() for field in line.split(',')]
+            if flag not in DATASET_SPECS:
+                raise ValueError('Unknown dataset flag ' + flag + ' for ' + filepath)
+            entries += [(filepath, flag)]
+    return entries
+
+
+def ingest_manifest(manifest_filepath, processes=None, sota=True, chunksize=1000000):
+    """
+    Function for ingesting all the files of a manifest concurrently in a process pool. The protocol categories of the
+    UNSW-NB15 files are shared, so they are collected from all the files first and merged in the order of the manifest
+    (extending any already stored categories), before any file is ingested with the merged categories
+    :param manifest_filepath: the path of the manifest
+    :param processes: the number of worker processes (all the available cores if None)
+    :param sota: flag for modifications in preprocessing for state-of-the-art experiments
+    :param chunksize: the number of lines in each chunk
+    :return: a list with the number of flows written in each split of each file (in the order of the manifest)
+    """
+    entries = read_manifest(manifest_filepath)
+    with Pool(processes, maxtasksperchild=1) as pool:
+        # merge the protocol categories of the UNSW-NB15 files of each dataset directory
+        shared_entries = [(filepath, flag, chunksize) for filepath, flag in entries
+                        if DATASET_SPECS[flag]['shared_protocols']]
+        collected = pool.starmap(collect_protocol_categories, shared_entries, chunksize=1)
+        shared_categories = {}
+        for (filepath, _, _), protocol_categories in zip(shared_entries, collected):
+            directory = '/'.join(filepath.split('/')[0:2])
+            if directory not in shared_categories:
+                stored = load_protocol_categories(filepath)
+                shared_categories[directory] = stored if stored is not None else []
+            extend_categories(shared_categories[directory], pd.Series(protocol_categories, dtype=object))
+            store_protocol_categories(filepath, shared_categories[directory])
+
+        tasks = []
+        for filepath, flag in entries:
+            categories = {}
+            if DATASET_SPECS[flag]['shared_protocols']:
+                categories = {'protocol': shared_categories['/'.join(filepath.split('/')[0:2])], 'extend': False}
+            # raw unidirectional netflows need to be converted during ingestion
+            preprocessing = 'uni' if flag == 'CTU-uni' and not filepath.endswith('_preprocessed') else None
+            tasks += [(filepath, flag, categories, sota, preprocessing, chunksize)]
+        results = pool.starmap(ingest_file, tasks, chunksize=1)
+    for (filepath, _), written in zip(entries, results):
+        print(filepath + ' -> ' + ', '.join(name + ': ' + str(num) for name, num in written.items()))
+    return results
+
+
 if __name__ == '__main__':
-    filepath = input("Enter the desired filepath: ")
+    filepath = input("Enter the desired filepath (or the path of a .manifest file for batch ingestion): ")
+
+    # all the files of a manifest are ingested concurrently in the fast chunked mode
+    if filepath.endswith('.manifest'):
+        processes = input("Enter the number of worker processes (for all the cores give no answer): ")
+        ingest_manifest(filepath, processes=int(processes) if processes else None)
+        print('All the files of the manifest have been preprocessed and split by label!!!')
+        exit()
 
     # Choose between the flags CTU-uni | CTU-bi | CTU-mixed | CICIDS | UNSW
     while True:
         flag = input("Enter the desired flag (CTU-uni | CTU-bi | CICIDS | UNSW): ")
-        if flag in ['CTU-uni', 'CTU-bi', 'CICIDS', 'UNSW']:
+        if flag in DATASET_SPECS:
             break
 
     # flag for modifications in preprocessing for state-of-the-art experiments
     sota = True
 
-    print('Reading data from ' + filepath + '...\n')
     # to get preprocessing, necessary for unidirectional netflows, done, set the 'preprocessing' flag to True
+    preprocessing = None
     if flag == 'CTU-uni':
-        data = read_data(filepath, flag=flag, preprocessing='uni' if bool(input("Enable preprocessing (for NO give no answer)? ")) else None)
-    else:
-        data = read_data(filepath, flag=flag, chunks=True)
+        preprocessing = 'uni' if bool(input("Enable preprocessing (for NO give no answer)? ")) else None
 
-    print('Dataset from ' + filepath + ' has been successfully read!!!\n')
-    print('Starting initial preprocessing...\n')
+    # the incremental mode appends only the new flows of the file to the existing flow store
+    if bool(input("Append only the new flows to the existing flow store (for NO give no answer)? ")):
+        ingest_increment(filepath, flag, sota=sota, preprocessing=preprocessing)
+        print('New data preprocessed and appended by label!!!')
+        exit()
 
-    # resetting indices for data
-    data = data.reset_index(drop=True)
+    # the fast ingestion mode parses the file with the C engine and processes and stores it chunk by chunk
+    fast = bool(input("Enable fast chunked ingestion (for NO give no answer)? "))
 
-    # some more preprocessing on the specific fields of the dataframe
-    # Unidirectional flows of CTU-13 dataset
-    if flag == 'CTU-uni':
-        # parse packets, and bytes as integers instead of strings
-        data['packets'] = data['packets'].astype(int)
-        data['bytes'] = data['bytes'].astype(int)
-
-        # parse duration as float
-        data['duration'] = data['duration'].astype(float)
-
-        # add the numerical representation of the categorical data
-        data['protocol_num'] = pd.Categorical(data['protocol'], categories=data['protocol'].unique()).codes
-        data['flags_num'] = pd.Categorical(data['flags'], categories=data['flags'].unique()).codes
-
-        # handle NaN values (mostly NaN ports)
-        # data.dropna(inplace=True) # one solution would be to drop the flows
-        data['src_port'].fillna('-1', inplace=True)
-        data['dst_port'].fillna('-1', inplace=True)
-
-        # since NaN values have been removed from ports
-        data['src_port'] = data['src_port'].astype(int)
-        data['dst_port'] = data['dst_port'].astype(int)
-
-        # split the data according to their labels and sort them by date
-        anomalous = data[data['label'] == 'Botnet']
-        anomalous = anomalous.reset_index(drop=True)
-        anomalous.sort_values(by=['date'], inplace=True)
-
-        normal = data[data['label'] == 'LEGITIMATE']
-        normal = normal.reset_index(drop=True)
-        normal.sort_values(by=['date'], inplace=True)
-
-        background = data[data['label'] == 'Background']
-        background = background.reset_index(drop=True)
-        background.sort_values(by=['date'], inplace=True)
-
-        # save the separated data
-        anomalous.to_pickle('/'.join(filepath.split('/')[0:3]) + '/netflow_anomalous.pkl')
-        normal.to_pickle('/'.join(filepath.split('/')[0:3]) + '/netflow_normal.pkl')
-        background.to_pickle('/'.join(filepath.split('/')[0:3]) + '/netflow_background.pkl')
-    # Bidirectional flows of CTU-13 dataset
-    elif flag == 'CTU-bi':
-        # the background data are taken into account only in state-of-the-art experiments
-        if not sota:
-            data = data[~data['label'].str.contains("Background")]
-        else:
-            # only hosts from the host network with more than 150 flows in total are kept
-            data = data[data['src_ip'].str.contains("147.32.8")]
-            hosts = data.groupby('src_ip').size()
-            ips = hosts[hosts > 150].index
-            data = data[data['src_ip'].isin(ips)]
-
-        # for now the state and direction features are kept but are ignored in the pipeline
-        # parse packets, and bytes as integers instead of strings
-        data['packets'] = data['packets'].astype(int)
-        data['bytes'] = data['bytes'].astype(int)
-        data['src_bytes'] = data['src_bytes'].astype(int)
-        data['dst_bytes'] = data['bytes'] - data['src_bytes']
-
-        # parse duration as float
-        data['duration'] = data['duration'].astype(float)
-
-        # handle NaN values (mostly NaN ports)
-        data['state'].fillna('missing', inplace=True)
-        # data.dropna(inplace=True)  # dropping the rows with nan values (nan ports mostly) is a solution
-        data['src_port'].fillna('-1', inplace=True)
-        data['dst_port'].fillna('-1', inplace=True)
-
-        # add the numerical representation of the categorical data
-        protocol_categories = ['udp', 'tcp', 'icmp', 'arp', 'igmp', 'rtp', 'pim', 'rtcp', 'udt', 'ipv6']
-        data['protocol_num'] = pd.Categorical(data['protocol'], categories=protocol_categories).codes
-        # data['state_num'] = pd.Categorical(data['state'], categories=data['state'].unique()).codes
-
-        # handle special hexadecimal values in the port columns
-        data['src_port'] = data['src_port'].apply(lambda x: int(x, 16) if 'x' in x else x)
-        data['dst_port'] = data['dst_port'].apply(lambda x: int(x, 16) if 'x' in x else x)
-
-        # since NaN values have been removed from ports
-        data['src_port'] = data['src_port'].astype(int)
-        data['dst_port'] = data['dst_port'].astype(int)
-
-        # split the data according to their labels and sort them by date
-        anomalous = data[data['label'].str.contains("From-Botnet")]
-        anomalous = anomalous.reset_index(drop=True)
-        anomalous.sort_values(by=['date'], inplace=True)
-
-        if not sota:
-            normal = data[data['label'].str.contains("From-Normal")]
-        else:
-            normal = data[~data['label'].str.contains("Botnet")]
-        normal = normal.reset_index(drop=True)
-        normal.sort_values(by=['date'], inplace=True)
-
-        # save the separated data
-        anomalous.to_pickle('/'.join(filepath.split('/')[0:3]) + '/binetflow_anomalous.pkl')
-        if not sota:
-            normal.to_pickle('/'.join(filepath.split('/')[0:3]) + '/binetflow_normal.pkl')
-        else:
-            normal.to_pickle('/'.join(filepath.split('/')[0:3]) + '/binetflow_normal_sota.pkl')
-    # Flows of UNSW-NB15 dataset
-    elif flag == 'UNSW':
-        # fill appropriately columns that contain too many NaN values
-        data['detailed_label'].fillna('missing', inplace=True)
-        data['service'].fillna('missing', inplace=True)
-        data['src_port'].fillna('-1', inplace=True)
-        data['dst_port'].fillna('-1', inplace=True)
-
-        # handle special hexadecimal values in the destination port columns
-        if data.src_port.dtype == object:
-            data['src_port'] = data['src_port'].apply(lambda x: int(x, 16) if 'x' in x else x)
-        if data.dst_port.dtype == object:
-            data['dst_port'] = data['dst_port'].apply(lambda x: int(x, 16) if 'x' in x else x)
-
-        # parse packets, bytes, and ports as integers instead of strings
-        data['src_port'] = data['src_port'].astype(int)
-        data['dst_port'] = data['dst_port'].astype(int)
-        data['src_bytes'] = data['src_bytes'].astype(int)
-        data['dst_bytes'] = data['dst_bytes'].astype(int)
-        data['missed_src_bytes'] = data['missed_src_bytes'].astype(int)
-        data['missed_dst_bytes'] = data['missed_dst_bytes'].astype(int)
-        data['src_packets'] = data['src_packets'].astype(int)
-        data['dst_packets'] = data['dst_packets'].astype(int)
-
-        # parse duration as float
-        data['duration'] = data['duration'].astype(float)
-
-        # for now the state and service features are kept but are ignored in the pipeline
-        # add the numerical representation of the categorical data
-        protocol_names_filepath = '/'.join(filepath.split('/')[0:2]) + '/protocol_names.pkl'
-        if path.exists(protocol_names_filepath):
-            with open(protocol_names_filepath, 'rb') as f:
-                protocol_categories = pickle.load(f)
+    # the categories of the categorical features (for UNSW-NB15 they are shared between the files of the dataset)
+    categories = {}
+    if DATASET_SPECS[flag]['shared_protocols']:
+        protocol_categories = load_protocol_categories(filepath)
+        categories = {'protocol': protocol_categories if protocol_categories is not None else [],
+                      'extend': protocol_categories is None}
+
+    print('Reading data from ' + filepath + '...\n')
+    if not fast:
+        if flag == 'CTU-uni':
+            data = read_data(filepath, flag=flag, preprocessing=preprocessing)
         else:
-            protocol_categories = data.protocol.unique().tolist()
-            with open(protocol_names_filepath, 'wb') as f:
-                pickle.dump(protocol_categories, f)
-
-        if not set(data.protocol.unique().tolist()).issubset(set(protocol_categories)):
-            print('New protocol types found!!!!')
-        data['protocol_num'] = pd.Categorical(data['protocol'], categories=protocol_categories).codes
-        # data['service_num'] = pd.Categorical(data['service'], categories=data['service'].unique()).codes
-        # data['state_num'] = pd.Categorical(data['state'], categories=data['state'].unique()).codes
-
-        # split the data according to their labels and sort them by date
-        anomalous = data[data['label'] == 1]
-        anomalous = anomalous.reset_index(drop=True)
-        anomalous.sort_values(by=['date'], inplace=True)
-        anomalous.reset_index(drop=True, inplace=True)
-
-        normal = data[data['label'] == 0]
-        normal = normal.reset_index(drop=True)
-        normal.sort_values(by=['date'], inplace=True)
-        normal.reset_index(drop=True, inplace=True)
-
-        # save the separated data
-        anomalous.to_pickle('/'.join(filepath.split('/')[0:2]) + '/' + filepath.split('/')[2].split('.')[0] +
-                            '_anomalous.pkl')
-        normal.to_pickle('/'.join(filepath.split('/')[0:2]) + '/' + filepath.split('/')[2].split('.')[0] +
-                         '_normal.pkl')
-    # Flows of CICIDS2017 dataset
+            data = read_data(filepath, flag=flag, chunks=True)
+
+        print('Dataset from ' + filepath + ' has been successfully read!!!\n')
+        print('Starting initial preprocessing...\n')
+
+        # some more preprocessing on the specific fields of the dataframe
+        host_counts = data.groupby('src_ip').size()
+        watermarks = flow_store.update_watermarks({}, data)
+        data = preprocess_data(data, flag, categories, sota=sota)
+        # split the data according to their labels and save the separated data in the partitioned flow store
+        for name, split in split_data(data, filepath, flag, sota=sota).items():
+            flow_store.write_flows(split, output_directory(filepath, flag), name)
+        store_ingest_state(filepath, flag, categories, host_counts, watermarks, sota=sota)
     else:
-        # drop rows with NaN values (mostly for the Thursday morning dataset)
-        data.dropna(inplace=True)
-
-        # parse packets, bytes, and ports as integers instead of strings
-        data['src_port'] = data['src_port'].astype(int)
-        data['dst_port'] = data['dst_port'].astype(int)
-        data['total_fwd_packets'] = data['total_fwd_packets'].astype(int)
-        data['total_bwd_packets'] = data['total_bwd_packets'].astype(int)
-        data['src_bytes'] = data['src_bytes'].astype(int)
-        data['dst_bytes'] = data['dst_bytes'].astype(int)
-        data['protocol_num'] = data['protocol'].astype(int)
-
-        # convert the numerical protocol values to strings according to their code
-        table = {num: name[8:] for name, num in vars(socket).items() if name.startswith("IPPROTO")}
-        data['protocol'] = data['protocol'].apply(lambda x: table[x])
-
-        # parse duration as float
-        data['duration'] = data['duration'].astype(float)
-
-        # split the data according to their labels and sort them by date
-        anomalous = data[data['label'] != 'BENIGN']
-        anomalous = anomalous.reset_index(drop=True)
-        anomalous.sort_values(by=['date'], inplace=True)
-        anomalous.reset_index(drop=True, inplace=True)
-
-        normal = data[data['label'] == 'BENIGN']
-        normal = normal.reset_index(drop=True)
-        normal.sort_values(by=['date'], inplace=True)
-        normal.reset_index(drop=True, inplace=True)
-
-        # save the separated data
-        anomalous.to_pickle('/'.join(filepath.split('/')[0:3]) + '/anomalous.pkl')
-        normal.to_pickle('/'.join(filepath.split('/')[0:3]) + '/normal.pkl')
+        ingest_file(filepath, flag, categories, sota=sota, preprocessing=preprocessing)
+
+    # store the protocol categories of the first processed file of the UNSW-NB15 dataset
+    if DATASET_SPECS[flag]['shared_protocols'] and categories['extend']:
+        store_protocol_categories(filepath, categories['protocol'])
     print('Data preprocessed and split by label!!!')
@@ -5,10 +5,11 @@ import os
 import glob
 import graphviz
 import helper
-import pandas as pd
+import flow_store
 import re
 from copy import deepcopy
 import pickle
+from multiprocessing import Pool
 
 # flag for specifying which version of flexfringe shall be used. In case the symbolic approach is used the master branch
 # is selected, otherwise the multivariate branch is used
@@ -130,6 +131,9 @@ if __name__ == '__main__':
         # alphabet size in case the discretized version is used
         alphabet_size = -1
 
+        # the maximum number of flows of each instance used for the trace extraction (None for no budget)
+        flow_budget = 20000
+
         host_level = int(input('Select the type of modelling to be conducted (connection level: 0 | host level: 1): '))
         if not host_level:
             analysis_type = 'connection_level'
@@ -140,12 +144,14 @@ if __name__ == '__main__':
         # set the input filepath
         training_filepath = input('Give the relative path of the dataframe to be used for training: ')
 
+        # only the columns needed for the trace extraction are read from the flow store
+        columns = ['date', 'src_ip', 'dst_ip'] + old_selected
         if flag == 'CTU-bi':
             # read the appropriate netflow file (in case the state-of-the-art experiments are to be conducted)
-            data = pd.read_pickle(training_filepath + '/binetflow_normal.pkl') if not sota else \
-                pd.read_pickle(training_filepath + '/binetflow_normal_sota.pkl')
+            data = flow_store.read_flows(training_filepath, 'binetflow_normal' if not sota else 'binetflow_normal_sota',
+                                         columns=columns)
         else:
-            data = pd.read_pickle(training_filepath + '/normal.pkl')
+            data = flow_store.read_flows(training_filepath, 'normal', columns=columns)
 
         if with_discretization:
             # first find the discretization limits for each feature
@@ -162,30 +168,23 @@ if __name__ == '__main__':
             with open(discretization_filepath, 'wb') as f:
                 pickle.dump(discretization_dict, f)
             # then for each feature discretize its values and add the new features in the dataframe
-            alphabet_size = 1
-            for feature in discretization_dict.keys():
-                alphabet_size *= (len(discretization_dict[feature]) + 1)
-                if 'num' not in feature:
-                    data[feature + '_num'] = data[feature].apply(helper.find_percentile,
-                                                                 args=(discretization_dict[feature],))
-                    selected.remove(feature)
-                    selected += [feature + '_num']
-                else:
-                    data[feature] = data[feature].apply(helper.check_existence,
-                                                                 args=(discretization_dict[feature],))
-            helper.netflow_encoding(data, selected, discretization_dict)
-            selected = ['encoding']
+            selected, alphabet_size = helper.discretize_flows(data, selected, discretization_dict)
             old_selected = deepcopy(selected)
 
         # select instances according to a different level of analysis
         if analysis_type == 'host_level':
-            # in host level analysis only host with significant number of flows are considered
-            instances = helper.select_hosts(data, 50, bidirectional=bidirectional).values.tolist()  # 10000
+            # in host level analysis only host with significant number of flows are considered (in the bidirectional
+            # case the flows of each host are taken from the canonicalized data)
+            instances, data = helper.select_hosts(data, 50, bidirectional=bidirectional, return_data=True)  # 10000
+            instances = instances.values.tolist()
             print('Number of hosts to be processed: ' + str(len(instances)))
         else:
             # in connection level analysis only connections with significant number of flows are considered
-            instances = helper.select_connections(data, 50, bidirectional=bidirectional).values.tolist()
+            instances, data = helper.select_connections(data, 50, bidirectional=bidirectional, return_data=True)
+            instances = instances.values.tolist()
             print('Number of connections to be processed: ' + str(len(instances)))
+        # the date-sorted positions of the flows of each instance are found in one pass over the data
+        entity_index = helper.build_entity_index(data, 'host' if analysis_type == 'host_level' else 'connection')
 
         # initialize an empty list to hold the filepaths of the trace files for each host
         traces_filepaths = []
@@ -193,82 +192,65 @@ if __name__ == '__main__':
         # variables used only in the case of the mixed analysis
         prev = None
         ind = 0
+        # the worker processes among which the high-level windows of the entities are distributed, created once for
+        # all the entities (none if there is a single core)
+        pool = Pool() if os.cpu_count() > 1 else None
         # extract the data according to the analysis level
         while j < len(instances):
             if analysis_type == 'host_level':
                 instance_name = instances[j][0]
                 print('Extracting traces for host ' + instance_name)
-                instance_data = data.loc[data['src_ip'] == instances[j][0]].sort_values(by='date').reset_index(drop=True)
+                instance_data = data.iloc[entity_index[instances[j][0]]].reset_index(drop=True)
                 print('The number of flows for this host are: ' + str(instance_data.shape[0]))
             else:
                 instance_name = instances[j][0] + '-' + instances[j][1]
                 print('Extracting traces for connection ' + instance_name)
-                instance_data = data.loc[(data['src_ip'] == instances[j][0]) & (data['dst_ip'] == instances[j][1])].\
-                    sort_values(by='date').reset_index(drop=True)
+                instance_data = data.iloc[entity_index[(instances[j][0], instances[j][1])]].reset_index(drop=True)
                 print('The number of flows for this connection are: ' + str(instance_data.shape[0]))
 
             # if the number of flows is excessive then sample from these flows to a feasible extent
-            if instance_data.shape[0] > 20000:
-                instance_data = instance_data.iloc[:20000]
+            instance_data, kept = helper.budget_flows(instance_data, flow_budget)
 
             # first ask about the nature of the windowing technique
-            timed = int(input('What type of window to use (0: non-timed | 1: static-timed | 2: dynamic-timed)? '))
-            dynamic = True if timed == 2 else False
-            timed = bool(timed)
-            # if static windows are used add it to the naming of the tracefile
-            timed_name = ''
-            if not timed:
-                timed_name = '_static'
-            elif not dynamic:
-                timed_name = '_static_timed'
+            timed, dynamic, timed_name = helper.window_settings(
+                int(input('What type of window to use (0: non-timed | 1: static-timed | 2: dynamic-timed)? ')))
 
             # seconldy ask if new features are to be added
             new_features = int(input('Are there any new features to be added (no: 0 | yes: 1)? '))
 
             # extract the traces and save them in the traces' filepath
             aggregation = int(input('Do you want to use aggregation windows (no: 0 | yes-rolling: 1 | yes-resample: 2 )? '))
+            resample = aggregation == 2
+            aggregation = bool(aggregation)
+            # add also the needed features in case of aggregation
+            if aggregation:
+                selected = helper.aggregation_features(selected, analysis_type == 'host_level', resample)
 
             # set the traces output filepath depending on the aggregation value
-            # if aggregation has been set to 1 then proper naming is conducted in the extract_traces function of the
-            # helper.py file
-            if not aggregation:
-                traces_filepath = '/'.join(training_filepath.split('/')[0:2]) + '/training/' + analysis_type + '/' \
-                                  + '_'.join(old_selected) + '/' + training_filepath.split('/')[2] + '-' + \
-                                  instance_name + '-traces' + ('_bdr' if bidirectional else '') + timed_name + '.txt'
-                aggregation = False
-                resample = False
-            else:
-                resample = False if aggregation == 1 else True
-                aggregation = True
-                if resample:
-                    traces_filepath = '/'.join(training_filepath.split('/')[0:2]) + '/training/' + analysis_type \
-                                      + '/' + '_'.join(old_selected) + '/' + training_filepath.split('/')[2] + '-' \
-                                      + instance_name + '-traces_resampled' + ('' if new_features else '_reduced') \
-                                      + ('_bdr' if bidirectional else '') + timed_name + '.txt'
-                else:
-                    traces_filepath = '/'.join(training_filepath.split('/')[0:2]) + '/training/' + analysis_type \
-                                      + '/' + '_'.join(old_selected) + '/' + training_filepath.split('/')[2] + '-' \
-                                      + instance_name + '-traces_aggregated' + ('' if new_features else '_reduced') \
-                                      + ('_bdr' if bidirectional else '') + timed_name + '.txt'
-                # add also the destination ip in case of aggregation
-                if analysis_type == 'host_level':
-                    selected += ['dst_ip'] if not resample else ['dst_ip', 'date']
-                else:
-                    if resample:
-                        selected += ['date']
+            traces_filepath = helper.build_traces_filepath(training_filepath, 'training', analysis_type, old_selected,
+                                                           instance_name, aggregation=aggregation, resample=resample,
+                                                           new_features=new_features, bidirectional=bidirectional,
+                                                           timed_name=timed_name)
 
             # create the directory if it does not exist
             os.makedirs(os.path.dirname(traces_filepath), exist_ok=True)
 
             # and extract the traces
             helper.extract_traces(instance_data, traces_filepath, selected, alphabet_size, timed=timed, dynamic=dynamic,
-                                  aggregation=aggregation, resample=resample, new_features=bool(new_features))
+                                  aggregation=aggregation, resample=resample, new_features=bool(new_features),
+                                  pool=pool)
+            # and keep track of the flows kept by the budget
+            helper.store_kept_flows(traces_filepath, kept)
 
             # add the trace filepath of each host's traces to the list
             traces_filepaths += [traces_filepath]
             # and reset the selected features
             selected = deepcopy(old_selected)
             j += 1
+        # and stop the worker processes
+        if pool is not None:
+            pool.close()
+            pool.join()
     else:
         # in case the traces' filepath already exists, provide it (in this case only one path - NOT a list)
         traces_filepaths = [input('Give the path to the input file for flexfringe: ')]
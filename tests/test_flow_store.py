@@ -0,0 +1,105 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import flow_store
+
+HOSTS = ['147.32.84.165', '147.32.84.191', '147.32.84.192', '10.0.0.1', '10.0.0.2', '192.168.1.7']
+
+
+def flows(num_flows, seed, start='2011-08-18 10:00:00'):
+    rng = np.random.default_rng(seed)
+    # unique dates spanning a few days, so that the flows are spread over several day partitions
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.choice(3 * 86400 * 1000, num_flows, replace=False)),
+                                                  unit='ms')
+    return pd.DataFrame({'date': dates, 'src_ip': rng.choice(HOSTS, num_flows),
+                         'dst_ip': rng.choice(['147.32.80.9', '8.8.8.8', '74.125.232.195'], num_flows),
+                         'src_port': rng.integers(-1, 65536, num_flows),
+                         'dst_port': rng.choice([-1, 53, 80], num_flows),
+                         'protocol': rng.choice(['tcp', 'udp', 'icmp'], num_flows),
+                         'src_bytes': rng.integers(0, 10 ** 6, num_flows), 'packets': rng.integers(1, 100, num_flows),
+                         'label': rng.choice(['Background', 'Botnet'], num_flows)})
+
+
+def plain(data):
+    # the flows with the categorical columns decoded, for comparing them regardless of their categories
+    return data.astype({col: object for col in data.select_dtypes(include='category').columns}).reset_index(drop=True)
+
+
+def test_write_read_round_trip_with_compact_dtypes(tmp_path):
+    data = flows(2000, 0)
+    assert flow_store.write_flows(data, str(tmp_path), 'flows') == 2000
+    stored = flow_store.read_flows(str(tmp_path), 'flows')
+    assert list(stored.columns) == list(data.columns)
+    for col in ['src_ip', 'dst_ip', 'protocol', 'label']:
+        assert isinstance(stored[col].dtype, pd.CategoricalDtype)
+    assert stored['src_port'].dtype == np.int32 and stored['dst_port'].dtype == np.int32
+    assert stored['packets'].dtype == np.uint32
+    pd.testing.assert_frame_equal(plain(stored), plain(data), check_dtype=False)
+    # the flows are partitioned by the hash bucket of their source IP and by their day
+    path = flow_store.store_path(str(tmp_path), 'flows')
+    buckets = sorted(entry for entry in os.listdir(path) if entry.startswith('src_bucket='))
+    assert buckets == sorted(set('src_bucket=%d' % bucket for bucket in flow_store.host_buckets(data['src_ip'])))
+    bucket = data[flow_store.host_buckets(data['src_ip']) == int(buckets[0].split('=')[1])]
+    assert sorted(os.listdir(os.path.join(path, buckets[0]))) == \
+        sorted(set('day=' + day for day in bucket['date'].dt.strftime('%Y-%m-%d')))
+
+
+def test_read_flows_with_filters(tmp_path):
+    data = flows(2000, 1)
+    flow_store.write_flows(data, str(tmp_path), 'flows')
+    hosts = HOSTS[:2]
+    selected = flow_store.read_flows(str(tmp_path), 'flows', columns=['src_ip', 'src_bytes'], hosts=hosts)
+    expected = data.loc[data['src_ip'].isin(hosts), ['src_ip', 'src_bytes', 'date']]
+    pd.testing.assert_frame_equal(plain(selected), plain(expected), check_dtype=False)
+    connections = [(HOSTS[2], '8.8.8.8'), (HOSTS[3], '147.32.80.9')]
+    start, end = data['date'].iloc[300], data['date'].iloc[1500]
+    selected = flow_store.read_flows(str(tmp_path), 'flows', connections=connections, start=start, end=end)
+    pairs = pd.MultiIndex.from_arrays([data['src_ip'], data['dst_ip']])
+    expected = data[pairs.isin(connections) & (data['date'] >= start) & (data['date'] <= end)]
+    assert selected.shape[0] > 0
+    pd.testing.assert_frame_equal(plain(selected), plain(expected), check_dtype=False)
+    # a host without flows
+    assert flow_store.read_flows(str(tmp_path), 'flows', hosts=['1.2.3.4']).shape[0] == 0
+
+
+def test_incremental_append_with_watermarks(tmp_path):
+    data = flows(3000, 2)
+    old, new = data.iloc[:2000], data.iloc[2000:]
+    flow_store.write_flows(old, str(tmp_path), 'flows')
+    state = flow_store.read_state(str(tmp_path), 'flows')
+    buckets = flow_store.host_buckets(old['src_ip'])
+    assert state['watermarks'] == old['date'].groupby(buckets).max().to_dict()
+    # a later capture that repeats the last flows of the stored one
+    batch = data.iloc[1800:]
+    mask = flow_store.new_flows_mask(batch, state['watermarks'])
+    assert mask.sum() == new.shape[0] and not mask[:200].any()
+    flow_store.write_flows(batch[mask], str(tmp_path), 'flows', append=True)
+    pd.testing.assert_frame_equal(plain(flow_store.read_flows(str(tmp_path), 'flows')), plain(data),
+                                  check_dtype=False)
+    state = flow_store.read_state(str(tmp_path), 'flows')
+    assert state['watermarks'] == data['date'].groupby(flow_store.host_buckets(data['src_ip'])).max().to_dict()
+    assert state['host_counts'].sort_index().to_dict() == data['src_ip'].value_counts().sort_index().to_dict()
+    # the watermarks are only raised
+    watermarks = dict(state['watermarks'])
+    assert flow_store.update_watermarks(watermarks, old) == state['watermarks']
+
+
+def test_legacy_pickle_fallback(tmp_path):
+    data = flows(1000, 3)
+    data.to_pickle(os.path.join(str(tmp_path), 'flows.pkl'))
+    flow_store.write_flows(data, str(tmp_path), 'stored')
+    for kwargs in [{}, {'columns': ['src_ip', 'packets'], 'hosts': HOSTS[4:]},
+                   {'connections': [(HOSTS[0], '8.8.8.8')], 'end': data['date'].iloc[500]}]:
+        legacy = flow_store.read_flows(str(tmp_path), 'flows', **kwargs)
+        stored = flow_store.read_flows(str(tmp_path), 'stored', **kwargs)
+        assert list(legacy.columns) == list(stored.columns)
+        assert legacy['src_ip'].dtype == 'category'
+        pd.testing.assert_frame_equal(plain(legacy), plain(stored), check_dtype=False)
+    batches = list(flow_store.iter_flows(str(tmp_path), 'flows', columns=['src_ip', 'date'], batch_size=300))
+    assert [batch.shape[0] for batch in batches] == [300, 300, 300, 100]
+    pd.testing.assert_frame_equal(plain(pd.concat(batches)), plain(data[['src_ip', 'date']]), check_dtype=False)
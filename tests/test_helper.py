@@ -0,0 +1,238 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import mode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import helper
+
+
+def rolling_reference(values, window, index=None):
+    # the rolling lambdas that the kernels replaced in aggregate_in_windows
+    rolling = pd.Series(values, index=index, dtype=float).rolling(window, min_periods=1)
+    distinct = rolling.apply(lambda x: len(set(x)), raw=False).values
+    modes = rolling.apply(lambda x: mode(x, keepdims=False)[0], raw=False).values
+    return distinct, modes
+
+
+def assert_kernels_match(values, window, index=None):
+    starts = helper.rolling_window_starts(pd.RangeIndex(len(values)) if index is None else index, window)
+    distinct, modes = rolling_reference(values, window, index)
+    assert np.array_equal(helper.rolling_distinct_count(values, starts), distinct)
+    assert np.array_equal(helper.rolling_mode(values, starts), modes)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_rolling_kernels_with_fixed_windows(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 300))
+    # few distinct values, so that most windows have tied modes
+    values = rng.integers(0, int(rng.integers(1, 6)), n) * 10 + 80
+    assert_kernels_match(values, int(rng.integers(1, 25)))
+
+
+def test_rolling_kernels_with_repeated_values_entering_and_leaving():
+    # runs of the same values leave the window while other runs of equal length enter it
+    values = np.array([7, 7, 3, 3, 7, 7, 3, 3, 9, 9, 9, 3, 3, 3, 7, 1, 1, 7, 7, 1, 1, 1, 1, 3])
+    for window in range(1, len(values) + 2):
+        assert_kernels_match(values, window)
+    assert_kernels_match(np.full(50, 443), 10)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_rolling_kernels_with_timed_windows(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 300))
+    # irregular gaps with flows sharing the same timestamp
+    gaps = np.where(rng.random(n) < 0.2, 0, rng.exponential(1.5, n))
+    index = pd.DatetimeIndex(pd.Timestamp('2011-08-18 10:00:00') + pd.to_timedelta(np.cumsum(gaps), unit='s'))
+    values = rng.integers(0, 4, n)
+    for window in ['500ms', '3s', '10s']:
+        assert_kernels_match(values, window, index)
+
+
+def bursty_host(num_of_flows, seed):
+    # alternating bursts of 200 dense and 200 sparse flows
+    rng = np.random.default_rng(seed)
+    gaps = np.where((np.arange(num_of_flows) // 200) % 2 == 0, rng.exponential(0.01, num_of_flows),
+                    rng.exponential(5, num_of_flows))
+    dates = pd.Timestamp('2011-08-18 10:00:00') + pd.to_timedelta(np.cumsum(gaps), unit='s')
+    return pd.DataFrame({'date': dates.round('us'), 'src_port': rng.integers(1000, 1010, num_of_flows),
+                         'dst_port': rng.choice([53, 80, 443], num_of_flows)})
+
+
+def test_find_window_range_matches_date_mask():
+    dates = bursty_host(1000, 0)['date']
+    # repeated dates at the window limits
+    dates = pd.Series(np.sort(np.concatenate([dates.values, dates.values[::7]])))
+    values = dates.values
+    for start, end in [(0, 10), (5, 5), (100, 450), (990, len(dates) - 1)]:
+        start_date, end_date = dates.iloc[start], dates.iloc[end]
+        lo, hi = helper.find_window_range(values, start_date, end_date)
+        positions = np.flatnonzero((dates >= start_date) & (dates <= end_date))
+        assert (lo, hi) == (positions[0], positions[-1] + 1)
+    assert helper.find_window_range(values, dates.iloc[-1] + pd.Timedelta(1, unit='s'),
+                                    dates.iloc[-1] + pd.Timedelta(2, unit='s')) == (len(dates), len(dates))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fit_window_conforms_to_trace_limits(seed):
+    dates = bursty_host(2000, seed)['date'].values
+    trace_limits = (10, 100)
+    rng = np.random.default_rng(seed)
+    for lo in rng.integers(0, len(dates) - 1, 50).tolist():
+        start_date = pd.Timestamp(dates[lo])
+        # a window can only have too many flows if there are more than max_trace_length flows after its first one
+        for window_len in [1, 150] if lo + trace_limits[1] < len(dates) else [1]:
+            window = helper.fit_window(dates, lo, start_date, window_len, trace_limits)
+            lo_fit, hi_fit = helper.find_window_range(dates, start_date, start_date + window)
+            assert lo_fit == lo
+            if window_len > trace_limits[1]:
+                # the largest window with at most max_trace_length flows
+                assert hi_fit - lo_fit == trace_limits[1]
+                assert helper.find_window_range(dates, start_date, start_date + window + pd.Timedelta(1, unit='ns'))[
+                    1] - lo == trace_limits[1] + 1
+            else:
+                # the smallest window with at least min_trace_length flows (or the flows up to the last one)
+                assert hi_fit - lo_fit == min(trace_limits[0], len(dates) - lo)
+                if window > pd.Timedelta(1, unit='us'):
+                    assert helper.find_window_range(dates, start_date, start_date + window -
+                                                    pd.Timedelta(1, unit='ns'))[1] - lo < trace_limits[0]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_dynamic_windows_cover_all_flows_within_limits(seed):
+    data = bursty_host(2000, seed)
+    window, stride = helper.set_windowing_vars(data)
+    windows = list(helper.extract_traces_from_window(data, window, stride, (10, 100), data.shape[0], [],
+                                                     dynamic=True))
+    lengths = np.array([hi - lo for lo, hi in windows])
+    assert lengths.min() >= 10 and lengths.max() <= 100
+    covered = np.zeros(data.shape[0], dtype=bool)
+    for lo, hi in windows:
+        covered[lo:hi] = True
+    assert covered.all()
+
+
+def test_dynamic_traces_file_covers_all_flows(tmp_path):
+    data = bursty_host(3000, 0)
+    out_filepath = str(tmp_path / 'host-traces.txt')
+    helper.extract_traces(data, out_filepath, ['src_port', 'dst_port'], -1, timed=True, dynamic=True)
+    traces_indices = helper.load_trace_indices(helper.trace_indices_filepath(out_filepath))
+    with open(out_filepath) as f:
+        header = f.readline().split()
+        lengths = [int(line.split()[1]) for line in f]
+    assert header == [str(len(traces_indices)), '100:2']
+    assert lengths == [len(indices) for indices in traces_indices]
+    assert sorted(set(index for indices in traces_indices for index in indices)) == list(range(3000))
+
+
+def time_strata(dates, num_strata):
+    # the time stratum of each flow in the budget_flows function
+    dates = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+    edges = np.linspace(dates.min(), dates.max(), num_strata + 1)[1:-1]
+    return np.searchsorted(edges, dates, side='right')
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_budget_flows_allocation(seed):
+    rng = np.random.default_rng(seed)
+    data = bursty_host(int(rng.integers(500, 3000)), seed)
+    # a few flows long after the rest, so that most strata are empty or almost empty
+    data.loc[data.index[-3:], 'date'] += pd.Timedelta(days=1)
+    # the flows are not necessarily sorted by date
+    data = data.sample(frac=1, random_state=seed)
+    budget = int(rng.integers(1, data.shape[0]))
+    num_strata = int(rng.integers(1, 20))
+    budgeted, kept = helper.budget_flows(data, budget, num_strata)
+    assert budgeted.shape[0] == len(kept) == budget
+    assert np.array_equal(np.unique(kept), kept)
+    strata = time_strata(data['date'], num_strata)
+    counts = np.bincount(strata, minlength=num_strata)
+    kept_counts = np.bincount(strata[kept], minlength=num_strata)
+    # the allocation sums to the budget, never exceeds a stratum, and is proportional to the strata up to rounding
+    assert kept_counts.sum() == budget
+    assert (kept_counts <= counts).all()
+    assert (np.abs(kept_counts - budget * counts / data.shape[0]) < 1).all()
+    # the flows kept in each stratum are consecutive in time
+    ranks = np.empty(data.shape[0], dtype=np.int64)
+    ranks[np.argsort(data['date'].values, kind='mergesort')] = np.arange(data.shape[0])
+    for stratum in np.unique(strata[kept]):
+        block = np.sort(ranks[kept[strata[kept] == stratum]])
+        assert np.array_equal(block, np.arange(block[0], block[0] + len(block)))
+
+
+def test_budget_flows_without_excess():
+    data = bursty_host(100, 0)
+    assert helper.budget_flows(data, 100)[1] is None
+    assert helper.budget_flows(data, None)[0] is data
+
+
+def test_kept_flows_round_trip(tmp_path):
+    data = bursty_host(1000, 1).sample(frac=1, random_state=1)
+    budgeted, kept = helper.budget_flows(data, 300, 7)
+    traces_filepath = str(tmp_path / 'host-traces.txt')
+    helper.store_kept_flows(traces_filepath, kept)
+    loaded = helper.load_kept_flows(traces_filepath)
+    assert np.array_equal(loaded, kept)
+    # the kept positions map the flows used in the traces back to the flows of the entity (as in evaluate_models.py)
+    pd.testing.assert_frame_equal(data.iloc[loaded].reset_index(drop=True), budgeted)
+    # a later extraction that keeps all the flows removes the stale positions
+    helper.store_kept_flows(traces_filepath, None)
+    assert helper.load_kept_flows(traces_filepath) is None
+    assert not os.path.exists(helper.kept_flows_filepath(traces_filepath))
+
+
+def skewed_flows(seed):
+    # 20 heavy hitters among thousands of hosts (and connections) with a few flows each
+    rng = np.random.default_rng(seed)
+    heavy = ['147.32.84.%d' % i for i in range(20)]
+    light = ['10.0.%d.%d' % (i // 250, i % 250) for i in range(3000)]
+    src_ips = np.concatenate([np.repeat(heavy, rng.integers(200, 1000, len(heavy))),
+                              np.repeat(light, rng.integers(1, 10, len(light)))])
+    dst_ips = np.where(rng.random(len(src_ips)) < 0.8, rng.choice(['147.32.80.9', '8.8.8.8'], len(src_ips)),
+                       rng.choice(light, len(src_ips)))
+    order = rng.permutation(len(src_ips))
+    return pd.DataFrame({'src_ip': pd.Categorical(src_ips[order]), 'dst_ip': pd.Categorical(dst_ips[order])})
+
+
+def chunk_reader(data, chunksize=1000):
+    return lambda: (data.iloc[i:i + chunksize] for i in range(0, data.shape[0], chunksize))
+
+
+def plain_selection(selected, keys):
+    return selected.astype({key: object for key in keys}).sort_values(keys).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_stream_select_matches_in_memory_selection(seed):
+    data = skewed_flows(seed)
+    # far fewer monitored entities than entities, so that the sketch evicts entities
+    hosts = helper.stream_select_hosts(chunk_reader(data), 50, capacity=200)
+    pd.testing.assert_frame_equal(plain_selection(hosts, ['src_ip']),
+                                  plain_selection(helper.select_hosts(data, 50), ['src_ip']))
+    connections = helper.stream_select_connections(chunk_reader(data), 50, capacity=400)
+    pd.testing.assert_frame_equal(plain_selection(connections, ['src_ip', 'dst_ip']),
+                                  plain_selection(helper.select_connections(data, 50), ['src_ip', 'dst_ip']))
+
+
+def test_space_saving_overestimates_within_bound():
+    data = skewed_flows(0)
+    sketch = helper.SpaceSaving(200)
+    for chunk in chunk_reader(data)():
+        sketch.update(helper.chunk_counts(chunk, ['src_ip']))
+    counts = data['src_ip'].astype(object).value_counts()
+    assert sketch.evicted and sketch.total == data.shape[0]
+    assert len(sketch.counts) == 200
+    # the counts are overestimated by at most their error, which is bounded by total / capacity
+    true_counts = counts.reindex(sketch.counts.index).values
+    assert (sketch.counts.values >= true_counts).all()
+    assert (sketch.counts.values - sketch.errors.values <= true_counts).all()
+    assert (sketch.errors.values <= sketch.total / sketch.capacity).all()
+    # without the exact pass all the heavy hitters are candidates
+    candidates = sketch.candidates(50)
+    assert set(counts[counts > 50].index) <= set(candidates.index)
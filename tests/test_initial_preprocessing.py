@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from initial_preprocessing import QuarantineFile, read_data_chunks
+
+HEADER = 'StartTime,Dur,Proto,SrcAddr,Sport,Dir,DstAddr,Dport,State,sTos,dTos,TotPkts,TotBytes,SrcBytes,Label\n'
+
+
+def ctu_line(i):
+    return '2011/08/18 10:00:%02d.%06d,0.5,tcp,147.32.84.165,0x0303,   ->,10.0.0.%d,80,CON,0,,5,500,%d,' \
+           'flow=From-Normal-V42\n' % (i % 60, i, i % 250, i)
+
+
+def write_capture(filepath, num_lines):
+    lines = [HEADER] + [ctu_line(i) for i in range(num_lines)]
+    # a line with an extra field in the middle and a truncated last line (without a newline)
+    lines.insert(num_lines // 2, ctu_line(num_lines).rstrip('\n') + ',extra\n')
+    lines += ['2011/08/18 10:00:00.000001,0.5,tcp']
+    with open(filepath, 'w') as f:
+        f.write(''.join(lines))
+    return num_lines // 2 + 1, num_lines + 3
+
+
+def test_quarantine_short_and_long_lines(tmp_path):
+    filepath = str(tmp_path / 'capture.binetflow')
+    long_line, short_line = write_capture(filepath, 200)
+    source = QuarantineFile(filepath)
+    kept = source.read().splitlines()
+    source.close()
+    assert len(kept) == 201
+    assert source.quarantined == 2
+    with open(filepath + '_quarantine') as f:
+        quarantined = [int(line.split('\t')[0]) for line in f]
+    assert quarantined == [long_line, short_line]
+
+
+def test_read_data_chunks_with_truncated_last_line(tmp_path):
+    filepath = str(tmp_path / 'capture.binetflow')
+    write_capture(filepath, 200)
+    data = pd.concat(read_data_chunks(filepath, flag='CTU-bi', chunksize=64))
+    assert data.shape[0] == 200
+    assert data['src_bytes'].tolist() == list(range(200))
+    assert os.path.exists(filepath + '_quarantine')